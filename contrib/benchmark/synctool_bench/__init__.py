@@ -0,0 +1,30 @@
+#
+#   synctool_bench    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''benchmarks for synctool
+
+synctool_bench.generate makes a synthetic repository with a large
+synctool.conf, many group dirs and a deep overlay tree.
+synctool_bench.bench times the core functions of synctool against it,
+and writes the results to a JSON file that can be compared to the
+results of an earlier run.
+synctool_bench.simulate times synctool, dsh and dsh-ping against
+a simulated cluster (see synctool_bench.simnode) for a number of
+NUM_PROC values
+
+usage:
+  PYTHONPATH=src:contrib/benchmark python -m synctool_bench -o new.json
+  PYTHONPATH=src:contrib/benchmark python -m synctool_bench \\
+      --compare old.json
+  PYTHONPATH=src:contrib/benchmark python -m synctool_bench.simulate \\
+      --nodes=1000 --numproc=16,32,64
+'''
+
+# EOB
@@ -0,0 +1,118 @@
+#
+#   synctool_bench.__main__.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''run the synctool benchmarks'''
+
+import os
+import sys
+import getopt
+import shutil
+import tempfile
+
+from synctool_bench import bench, generate
+
+PROGNAME = 'synctool_bench'
+
+
+def usage():
+    '''print usage information'''
+
+    print 'usage: python -m %s [options]' % PROGNAME
+    print '''options:
+  -h, --help            Display this information
+  -o, --output=FILE     Write results to FILE (default: synctool-bench.json)
+  -c, --compare=FILE    Compare results to an earlier run
+  -s, --scale=NUM       Scale the size of the repository (default: 1.0)
+  -r, --repeat=NUM      Run every benchmark NUM times (default: %d)
+  -d, --dir=DIR         Generate the repository in DIR, and keep it
+''' % bench.REPEAT
+
+
+def main():
+    '''run the program'''
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'ho:c:s:r:d:',
+                                   ['help', 'output=', 'compare=', 'scale=',
+                                    'repeat=', 'dir='])
+    except getopt.GetoptError as reason:
+        print '%s: %s' % (PROGNAME, reason)
+        usage()
+        sys.exit(1)
+
+    if args:
+        usage()
+        sys.exit(1)
+
+    output = 'synctool-bench.json'
+    compare_file = None
+    scale = 1.0
+    repeat = bench.REPEAT
+    rootdir = None
+
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit(1)
+
+        try:
+            if opt in ('-o', '--output'):
+                output = arg
+            elif opt in ('-c', '--compare'):
+                compare_file = arg
+            elif opt in ('-s', '--scale'):
+                scale = float(arg)
+            elif opt in ('-r', '--repeat'):
+                repeat = int(arg)
+            elif opt in ('-d', '--dir'):
+                rootdir = os.path.abspath(arg)
+        except ValueError:
+            print "option '%s' requires a numeric value" % opt
+            sys.exit(1)
+
+    if scale <= 0 or repeat < 1:
+        print 'invalid value for scale or repeat'
+        sys.exit(1)
+
+    # remember these; running the benchmarks changes them
+    output = os.path.abspath(output)
+    if compare_file:
+        compare_file = os.path.abspath(compare_file)
+
+    keep = rootdir is not None
+    if rootdir is None:
+        rootdir = tempfile.mkdtemp(prefix='synctool-bench-')
+    elif os.path.exists(rootdir):
+        print '%s: %s already exists' % (PROGNAME, rootdir)
+        sys.exit(1)
+
+    try:
+        print 'generating repository in %s' % rootdir
+        sizes = generate.generate(rootdir, generate.scaled_sizes(scale))
+
+        data = bench.run(rootdir, sizes, repeat)
+        bench.save(data, output)
+        print 'results written to %s' % output
+
+        slower = 0
+        if compare_file:
+            slower = bench.compare(data, compare_file)
+    finally:
+        if not keep:
+            shutil.rmtree(rootdir, ignore_errors=True)
+
+    if slower:
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
+
+# EOB
@@ -0,0 +1,337 @@
+#
+#   synctool_bench.bench.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''time synctool functions against a generated repository
+
+Every benchmark is a function that does one run and returns the
+elapsed time, so that it can leave any preparations out of the timing.
+Each benchmark is run REPEAT times; the best time is the one to compare
+'''
+
+import os
+import sys
+import time
+import json
+import random
+import platform
+
+import synctool.config
+import synctool.configparser
+import synctool.nodeset
+import synctool.overlay
+import synctool.param
+import synctool.prefetch
+import synctool.range
+
+from synctool_bench import generate
+
+REPEAT = 3
+
+# number of nodes for the range benchmarks
+RANGE_SIZE = 100000
+
+# a benchmark is reported as slower or faster when the best time
+# differs more than this fraction from the earlier result
+THRESHOLD = 0.1
+
+
+class _Quiet(object):
+    '''context manager that sends stdout to /dev/null'''
+
+    def __enter__(self):
+        '''redirect stdout'''
+
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        '''restore stdout'''
+
+        sys.stdout.close()
+        sys.stdout = self.stdout
+        return False
+
+
+def _init_param(rootdir):
+    '''reset synctool.param and point it at rootdir'''
+
+    reload(synctool.param)
+
+    # param.init() finds the rootdir by looking at the program name
+    sys.argv[0] = os.path.join(rootdir, 'bin', 'synctool-bench')
+    synctool.param.init()
+
+    synctool.configparser.SYMBOLS.clear()
+    del synctool.configparser.CONFIG_FILES[:]
+
+
+def setup(rootdir):
+    '''read the config and act as the first node of the cluster'''
+
+    _init_param(rootdir)
+    with _Quiet():
+        synctool.config.read_config()
+
+    synctool.param.NODENAME = generate.node_name(1)
+    synctool.param.MY_GROUPS = synctool.config.get_my_groups()
+
+    # always compare the files for real
+    synctool.param.MANIFEST = False
+    synctool.prefetch.RESULTS.clear()
+
+
+def bench_config_parse(ctx):
+    '''parse synctool.conf'''
+
+    _init_param(ctx['rootdir'])
+
+    t_start = time.time()
+    errors = synctool.configparser.read_config_file(
+                 synctool.param.CONF_FILE)
+    elapsed = time.time() - t_start
+
+    if errors:
+        raise RuntimeError('errors in generated synctool.conf')
+
+    return elapsed
+
+
+def bench_config_cached(ctx):
+    '''read the config, using the config cache'''
+
+    _init_param(ctx['rootdir'])
+
+    t_start = time.time()
+    with _Quiet():
+        synctool.config.read_config()
+    return time.time() - t_start
+
+
+def bench_range_expand(ctx):
+    '''expand a large node range'''
+
+    t_start = time.time()
+    synctool.range.expand('n[1-%d]' % RANGE_SIZE)
+    return time.time() - t_start
+
+
+def bench_range_compress(ctx):
+    '''compress a large, shuffled list of nodes'''
+
+    if not 'shuffled' in ctx:
+        nodes = ['n%d' % x for x in xrange(RANGE_SIZE)]
+        random.Random(1).shuffle(nodes)
+        ctx['shuffled'] = nodes
+
+    t_start = time.time()
+    synctool.range.compress(ctx['shuffled'])
+    return time.time() - t_start
+
+
+def bench_nodeset_addresses(ctx):
+    '''select all nodes, plus a group, minus some nodes'''
+
+    num_nodes = ctx['sizes']['nodes']
+
+    t_start = time.time()
+    nodeset = synctool.nodeset.NodeSet()
+    nodeset.add_node('n[00001-%05d]' % num_nodes)
+    nodeset.add_group('even')
+    nodeset.exclude_node('n00002,n[00010-00020]')
+    nodeset.addresses(silent=True)
+    return time.time() - t_start
+
+
+def _visit_noop(obj, pre_dict, post_dict):
+    '''overlay callback that does nothing'''
+
+    return True, False
+
+
+def bench_overlay_visit(ctx):
+    '''walk the overlay tree'''
+
+    t_start = time.time()
+    with _Quiet():
+        synctool.overlay.visit(synctool.param.OVERLAY_DIR, _visit_noop,
+                               silent=True)
+    return time.time() - t_start
+
+
+def _objects(ctx):
+    '''Returns list of SyncObjects in the overlay tree'''
+
+    if 'objects' in ctx:
+        return ctx['objects']
+
+    objs = []
+
+    def _collect(obj, pre_dict, post_dict):
+        '''collect objects, except templates'''
+
+        if obj.ov_type != synctool.overlay.OV_TEMPLATE:
+            objs.append(obj)
+        return True, False
+
+    with _Quiet():
+        synctool.overlay.visit(synctool.param.OVERLAY_DIR, _collect,
+                               silent=True)
+
+    ctx['objects'] = objs
+    return objs
+
+
+def bench_object_check(ctx):
+    '''SyncObject.check() for all objects in the overlay tree'''
+
+    objs = _objects(ctx)
+
+    t_start = time.time()
+    with _Quiet():
+        for obj in objs:
+            obj.check()
+    return time.time() - t_start
+
+
+def bench_vnode_compare(ctx):
+    '''compare the contents of all regular files'''
+
+    vnodes = []
+    for obj in _objects(ctx):
+        if obj.src_stat.is_file() and obj.dest_stat.is_file():
+            vnodes.append((obj.vnode_obj(), obj.src_path, obj.dest_stat))
+
+    t_start = time.time()
+    with _Quiet():
+        for vnode, src_path, dest_stat in vnodes:
+            vnode.compare(src_path, dest_stat)
+    return time.time() - t_start
+
+
+# the config benchmarks reset synctool.param, so they go first,
+# before setup()
+CONFIG_BENCHMARKS = [
+    ('config_parse', bench_config_parse),
+    ('config_cached', bench_config_cached),
+]
+
+BENCHMARKS = [
+    ('range_expand', bench_range_expand),
+    ('range_compress', bench_range_compress),
+    ('nodeset_addresses', bench_nodeset_addresses),
+    ('overlay_visit', bench_overlay_visit),
+    ('object_check', bench_object_check),
+    ('vnode_compare', bench_vnode_compare),
+]
+
+
+def _run(name, func, ctx, repeat):
+    '''run benchmark repeat times
+    Returns dict with the results
+    '''
+
+    timings = [func(ctx) for _ in xrange(repeat)]
+    result = {
+        'best': min(timings),
+        'mean': sum(timings) / len(timings),
+        'runs': timings,
+    }
+    print '%-20s best %9.4f  mean %9.4f' % (name, result['best'],
+                                             result['mean'])
+    return result
+
+
+def run(rootdir, sizes, repeat=REPEAT):
+    '''run all benchmarks
+    Returns dict with the results, fit for writing as JSON
+    '''
+
+    ctx = {'rootdir': rootdir, 'sizes': sizes}
+
+    # warm up the config cache
+    _init_param(rootdir)
+    with _Quiet():
+        synctool.config.read_config()
+
+    results = {}
+    for name, func in CONFIG_BENCHMARKS:
+        results[name] = _run(name, func, ctx, repeat)
+
+    setup(rootdir)
+
+    for name, func in BENCHMARKS:
+        results[name] = _run(name, func, ctx, repeat)
+
+    return {
+        'synctool_version': synctool.param.VERSION,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'sizes': sizes,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def save(data, filename):
+    '''write results to JSON file'''
+
+    with open(filename, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+
+def compare(data, filename):
+    '''compare results to those in an earlier JSON file
+    Returns number of benchmarks that got slower
+    '''
+
+    with open(filename) as f:
+        old = json.load(f)
+
+    if old.get('sizes') != data['sizes']:
+        print 'warning: %s was made with different sizes' % filename
+
+    print
+    print 'compared to synctool %s (%s):' % (old.get('synctool_version'),
+                                             old.get('date'))
+
+    slower = 0
+    for name in sorted(data['results']):
+        if not name in old.get('results', {}):
+            continue
+
+        if (data['results'][name].get('failed') or
+                old['results'][name].get('failed')):
+            print '%-20s failed, not compared' % name
+            continue
+
+        old_best = old['results'][name]['best']
+        new_best = data['results'][name]['best']
+        if old_best > 0:
+            ratio = new_best / old_best
+        else:
+            ratio = 1.0
+
+        if ratio > 1.0 + THRESHOLD:
+            verdict = 'slower'
+            slower += 1
+        elif ratio < 1.0 - THRESHOLD:
+            verdict = 'faster'
+        else:
+            verdict = ''
+
+        print '%-20s %9.4f -> %9.4f  %5.2fx  %s' % (name, old_best, new_best,
+                                                   ratio, verdict)
+
+    return slower
+
+# EOB
@@ -0,0 +1,226 @@
+#
+#   synctool_bench.generate.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''generate a synthetic synctool repository
+
+The repository lives in rootdir, which looks like a synctool installation:
+  rootdir/etc/synctool.conf
+  rootdir/var/overlay/, delete/, purge/
+The overlay tree describes files under rootdir/dest/, which is filled
+with copies of the files; some of them are made different on purpose,
+so that comparing them has something to find
+'''
+
+import os
+import random
+
+# default sizes; these are multiplied by the scale
+SIZES = {
+    'nodes': 2000,          # number of nodes in synctool.conf
+    'rack_size': 100,       # nodes per 'node' line (range expression)
+    'groups': 1000,         # number of groups, each with an overlay dir
+    'depth': 4,             # depth of the overlay tree
+    'fanout': 4,            # subdirectories per directory
+    'files': 8,             # files per directory
+    'variants': 2,          # extra ._group variants per file
+    'file_size': 4096,      # size of generated files
+}
+
+# sizes that do not grow with the scale
+FIXED = ('rack_size', 'depth', 'fanout', 'file_size')
+
+# every Nth file gets a .post script, every Mth file is a template
+POST_EVERY = 10
+TEMPLATE_EVERY = 20
+
+# fraction of destination files that differ from the repository
+DIFFERENT = 0.1
+
+POST_SCRIPT = '#! /bin/sh\ntrue\n'
+TEMPLATE_SCRIPT = '#! /bin/sh\ncp "$1" "$2"\n'
+
+
+def scaled_sizes(scale=1.0):
+    '''Returns dict of sizes, multiplied by scale'''
+
+    sizes = {}
+    for key, value in SIZES.iteritems():
+        if key in FIXED:
+            sizes[key] = value
+        else:
+            sizes[key] = max(1, int(value * scale))
+
+    return sizes
+
+
+def _write(path, data, mode=0644):
+    '''write data to file'''
+
+    with open(path, 'w') as f:
+        f.write(data)
+
+    os.chmod(path, mode)
+
+
+def _content(rng, size):
+    '''Returns random file content of size bytes'''
+
+    line = ''.join([rng.choice('abcdefghijklmnopqrstuvwxyz ')
+                    for _ in xrange(63)]) + '\n'
+    return (line * (size / len(line) + 1))[:size]
+
+
+def group_name(num):
+    '''Returns name of group number num'''
+
+    return 'g%04d' % num
+
+
+def node_name(num):
+    '''Returns name of node number num'''
+
+    return 'n%05d' % num
+
+
+def generate(rootdir, sizes=None, seed=1):
+    '''generate repository in rootdir
+    Returns the dict of sizes that was used
+    '''
+
+    if sizes is None:
+        sizes = scaled_sizes()
+
+    rng = random.Random(seed)
+
+    for subdir in ('bin', 'etc', 'scripts', 'var/overlay', 'var/delete',
+                   'var/purge', 'var/cache', 'dest'):
+        os.makedirs(os.path.join(rootdir, subdir))
+
+    _generate_config(rootdir, sizes)
+
+    destdir = os.path.join(rootdir, 'dest')
+    _generate_overlay(rootdir, destdir, sizes, rng)
+    _generate_delete_purge(rootdir, destdir, sizes, rng)
+    return sizes
+
+
+def _generate_config(rootdir, sizes):
+    '''write synctool.conf with range-generated nodes'''
+
+    num_groups = sizes['groups']
+    rack_size = sizes['rack_size']
+    num_racks = (sizes['nodes'] + rack_size - 1) / rack_size
+
+    lines = ['master localhost',
+             'syslogging no',
+             'num_proc 16',
+             '']
+
+    # a compound group, made of half of all groups
+    lines.append('group even g[0000-%04d/2]' % (num_groups - 1))
+    lines.append('')
+
+    # every rack gets its own share of the groups,
+    # so that every group has members
+    for rack in xrange(num_racks):
+        first = rack * rack_size + 1
+        last = min(sizes['nodes'], first + rack_size - 1)
+        groups = ['rack%03d' % rack]
+        groups.extend([group_name(x)
+                       for x in xrange(rack, num_groups, num_racks)])
+        lines.append('node n[%05d-%05d] %s' % (first, last,
+                                               ' '.join(groups)))
+
+    lines.append('')
+    lines.append('ignore_node %s' % node_name(sizes['nodes']))
+    lines.append('')
+
+    _write(os.path.join(rootdir, 'etc', 'synctool.conf'),
+           '\n'.join(lines) + '\n')
+
+
+def _generate_overlay(rootdir, destdir, sizes, rng):
+    '''make the overlay tree and the destination tree'''
+
+    overlay_all = os.path.join(rootdir, 'var', 'overlay', 'all')
+    num_groups = sizes['groups']
+
+    # a group dir for every group, holding a single file
+    for num in xrange(num_groups):
+        group = group_name(num)
+        path = os.path.join(rootdir, 'var', 'overlay', group,
+                            destdir[1:], 'groups')
+        os.makedirs(path)
+        _write(os.path.join(path, group + '._' + group),
+               _content(rng, sizes['file_size']))
+
+    # a deep tree under overlay/all/
+    dirs = ['']
+    level = ['']
+    for _ in xrange(sizes['depth']):
+        level = [os.path.join(parent, 'd%d' % num)
+                 for parent in level for num in xrange(sizes['fanout'])]
+        dirs.extend(level)
+
+    file_num = 0
+    for subdir in dirs:
+        src_dir = os.path.join(overlay_all, destdir[1:], subdir)
+        dest_dir = os.path.join(destdir, subdir)
+        if not os.path.isdir(src_dir):
+            os.makedirs(src_dir)
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+
+        for _ in xrange(sizes['files']):
+            file_num += 1
+            name = 'f%d' % file_num
+            data = _content(rng, sizes['file_size'])
+
+            if file_num % TEMPLATE_EVERY == 0:
+                # a template and its generator script
+                _write(os.path.join(src_dir, name + '._template'), data)
+                _write(os.path.join(src_dir, name + '._template.post'),
+                       TEMPLATE_SCRIPT, 0755)
+                continue
+
+            _write(os.path.join(src_dir, name + '._all'), data)
+
+            # variants for other groups
+            for _ in xrange(sizes['variants']):
+                group = group_name(rng.randrange(num_groups))
+                _write(os.path.join(src_dir, name + '._' + group),
+                       _content(rng, sizes['file_size']))
+
+            if file_num % POST_EVERY == 0:
+                _write(os.path.join(src_dir, name + '.post'),
+                       POST_SCRIPT, 0755)
+
+            if rng.random() < DIFFERENT:
+                data = data[:-1] + '!'
+
+            _write(os.path.join(dest_dir, name), data)
+
+
+def _generate_delete_purge(rootdir, destdir, sizes, rng):
+    '''make delete/ and purge/ trees'''
+
+    path = os.path.join(rootdir, 'var', 'delete', 'all', destdir[1:], 'old')
+    os.makedirs(path)
+    for num in xrange(sizes['files']):
+        _write(os.path.join(path, 'old%d._all' % num), '')
+
+    path = os.path.join(rootdir, 'var', 'purge', 'all', destdir[1:],
+                        'purged')
+    os.makedirs(path)
+    for num in xrange(sizes['files'] * sizes['fanout']):
+        _write(os.path.join(path, 'p%d' % num),
+               _content(rng, sizes['file_size']))
+
+# EOB
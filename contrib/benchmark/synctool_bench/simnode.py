@@ -0,0 +1,481 @@
+#
+#   synctool_bench.simnode.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+#   usage: python -m synctool_bench.simnode SIMDIR ssh|rsync|ping [args ...]
+#
+
+'''stand-ins for ssh, rsync and ping in a simulated cluster
+
+The simulated nodes do not exist; every node is a directory
+SIMDIR/nodes/<nodename>/ on the local machine. The stand-ins behave
+according to the node spec in SIMDIR/spec.json:
+
+  latency   seconds it takes to set up a connection
+  jitter    up to this many extra seconds of latency
+  fail      chance that the node refuses connections
+  hang      seconds the node stalls after connecting
+  output    lines of output of a simulated synctool-client
+  run       really run synctool-client, rather than simulating it
+
+spec.json holds a 'default' spec and 'nodes': a dict of node range
+expressions to specs that override the default for those nodes.
+The random draws are fixed per node, so that repeated runs
+are comparable
+
+ssh runs remote commands through /bin/sh in the node directory.
+A connection over an existing ControlPath has no latency;
+a master connection creates the ControlPath as a UNIX socket,
+just like ssh does
+'''
+
+import os
+import sys
+import json
+import time
+import shlex
+import signal
+import socket
+import random
+import subprocess
+
+DEFAULT_SPEC = {
+    'latency': 0.0,
+    'jitter': 0.0,
+    'fail': 0.0,
+    'hang': 0.0,
+    'output': 0,
+    'run': False,
+}
+
+# seed for the random draws per node
+SEED = 1
+
+# ssh options that take an argument
+SSH_ARG_OPTS = 'BbcDEeFIiJLlmOoPpQRSWw'
+
+SSH_VERSION = 'OpenSSH_6.6p1 (synctool simulator)'
+
+# rsync options that take an argument in the next word
+RSYNC_ARG_OPTS = ('-e', '-f', '-B', '-T')
+
+# exit codes of failed connections
+SSH_EXIT_FAIL = 255
+RSYNC_EXIT_FAIL = 12
+
+# a file list entry as sent by rsync; roughly
+FILE_LIST_ENTRY = 32
+
+
+def load_spec(simdir, nodename):
+    '''Returns the spec dict for nodename'''
+
+    with open(os.path.join(simdir, 'spec.json')) as f:
+        data = json.load(f)
+
+    spec = DEFAULT_SPEC.copy()
+    spec.update(data.get('default', {}))
+
+    overrides = data.get('nodes', {})
+    if overrides:
+        import synctool.range
+
+        for expr in sorted(overrides):
+            if nodename in synctool.range.expand(expr):
+                spec.update(overrides[expr])
+
+    # fixed random draws for this node
+    rng = random.Random('%s:%s' % (data.get('seed', SEED), nodename))
+    spec['down'] = rng.random() < spec['fail']
+    spec['latency'] += rng.uniform(0.0, spec['jitter'])
+    return spec
+
+
+def node_dir(simdir, nodename):
+    '''Returns the directory of the simulated node'''
+
+    path = os.path.join(simdir, 'nodes', nodename)
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # another stand-in may have made it just now
+            if not os.path.isdir(path):
+                raise
+
+    return path
+
+
+def connect(spec, nodename, control_path=None, prog='ssh'):
+    '''simulate connecting to the node
+    Returns True if connected
+    '''
+
+    if control_path and os.path.exists(control_path):
+        # use the existing master connection
+        return True
+
+    if spec['latency'] > 0:
+        time.sleep(spec['latency'])
+
+    if spec['down']:
+        sys.stderr.write('%s: connect to host %s port 22: '
+                         'Connection refused\n' % (prog, nodename))
+        return False
+
+    if spec['hang'] > 0:
+        time.sleep(spec['hang'])
+
+    return True
+
+
+def parse_ssh_args(args):
+    '''Returns tuple: (dict of options, set of flags, host, command)
+    The dict maps option letters to lists of arguments
+    '''
+
+    opts = {}
+    flags = set()
+
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--':
+            i += 1
+            break
+
+        if not arg.startswith('-') or arg == '-':
+            break
+
+        letters = arg[1:]
+        for j, letter in enumerate(letters):
+            if letter in SSH_ARG_OPTS:
+                value = letters[j + 1:]
+                if not value:
+                    i += 1
+                    value = args[i] if i < len(args) else ''
+                opts.setdefault(letter, []).append(value)
+                break
+
+            flags.add(letter)
+
+        i += 1
+
+    if i < len(args):
+        host = args[i]
+        if '@' in host:
+            host = host.split('@', 1)[1]
+        command = args[i + 1:]
+    else:
+        host = None
+        command = []
+
+    return opts, flags, host, command
+
+
+def control_path_of(opts):
+    '''Returns the ControlPath given in the ssh options, or None'''
+
+    path = None
+    for value in opts.get('o', []):
+        if value.startswith('ControlPath='):
+            path = value[len('ControlPath='):]
+
+    if 'S' in opts:
+        path = opts['S'][-1]
+
+    if path == 'none':
+        path = None
+
+    return path
+
+
+def _make_socket(path):
+    '''create a UNIX socket at path, that stays behind'''
+
+    if os.path.exists(path):
+        os.unlink(path)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+    finally:
+        sock.close()
+
+
+def _remove(path):
+    '''remove path, if it is there'''
+
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _terminate(signum, frame):
+    '''signal handler for a master connection'''
+
+    sys.exit(0)
+
+
+def ssh_control(opts, control_path):
+    '''handle 'ssh -O' control command
+    Returns exit code
+    '''
+
+    ctl_cmd = opts['O'][-1]
+    alive = control_path is not None and os.path.exists(control_path)
+
+    if ctl_cmd == 'check':
+        if alive:
+            sys.stderr.write('Master running (pid=%d)\n' % os.getpid())
+            return 0
+
+    elif ctl_cmd in ('exit', 'stop'):
+        if alive:
+            _remove(control_path)
+            sys.stderr.write('Exit request sent.\n')
+            return 0
+
+    else:
+        sys.stderr.write('ssh: unsupported control command %s\n' % ctl_cmd)
+        return SSH_EXIT_FAIL
+
+    sys.stderr.write('Control socket connect(%s): No such file or '
+                     'directory\n' % control_path)
+    return SSH_EXIT_FAIL
+
+
+def ssh_master(spec, nodename, flags, control_path):
+    '''start a simulated master connection
+    Returns exit code
+    '''
+
+    if not control_path:
+        sys.stderr.write('ssh: no ControlPath for master connection\n')
+        return SSH_EXIT_FAIL
+
+    if not connect(spec, nodename):
+        return SSH_EXIT_FAIL
+
+    _make_socket(control_path)
+
+    if 'f' in flags:
+        # a real master would go into the background now;
+        # the socket is all that the stand-ins need
+        return 0
+
+    # stay around until terminated
+    signal.signal(signal.SIGTERM, _terminate)
+    signal.signal(signal.SIGHUP, _terminate)
+    try:
+        while True:
+            signal.pause()
+    except (SystemExit, KeyboardInterrupt):
+        pass
+    finally:
+        _remove(control_path)
+
+    return 0
+
+
+def simulate_client(spec, nodename):
+    '''print the output of a simulated synctool-client'''
+
+    for num in xrange(spec['output']):
+        print '/etc/sim/file%d mismatch (file content)' % num
+
+    sys.stdout.flush()
+
+
+def ssh(simdir, args):
+    '''stand-in for ssh
+    Returns exit code
+    '''
+
+    opts, flags, host, command = parse_ssh_args(args)
+
+    if 'V' in flags:
+        sys.stderr.write(SSH_VERSION + '\n')
+        return 0
+
+    if host is None:
+        sys.stderr.write('usage: ssh [options] host [command]\n')
+        return SSH_EXIT_FAIL
+
+    control_path = control_path_of(opts)
+    if 'O' in opts:
+        return ssh_control(opts, control_path)
+
+    spec = load_spec(simdir, host)
+
+    if 'M' in flags:
+        return ssh_master(spec, host, flags, control_path)
+
+    if not connect(spec, host, control_path):
+        return SSH_EXIT_FAIL
+
+    if 'N' in flags or not command:
+        return 0
+
+    if (os.path.basename(command[0]).startswith('synctool-client') and
+            not spec['run']):
+        simulate_client(spec, host)
+        return 0
+
+    # the remote shell gets the command as a single string
+    env = os.environ.copy()
+    env['SYNCTOOL_SIM_NODE'] = host
+    return subprocess.call(['/bin/sh', '-c', ' '.join(command)],
+                           cwd=node_dir(simdir, host), env=env)
+
+
+def _tree_size(path):
+    '''Returns tuple: (number of files, total size) of the tree at path'''
+
+    num_files = 0
+    total = 0
+
+    if not os.path.isdir(path) or os.path.islink(path):
+        return 1, os.lstat(path).st_size
+
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            num_files += 1
+            total += os.lstat(os.path.join(root, name)).st_size
+
+    return num_files, total
+
+
+def rsync(simdir, args):
+    '''stand-in for rsync
+    It walks the source tree like the sending side of rsync does,
+    but it does not copy anything
+    Returns exit code
+    '''
+
+    rsh = None
+    log_file = None
+    paths = []
+
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--':
+            paths.extend(args[i + 1:])
+            break
+
+        if arg in RSYNC_ARG_OPTS:
+            i += 1
+            if arg == '-e' and i < len(args):
+                rsh = args[i]
+        elif arg.startswith('--rsh='):
+            rsh = arg[len('--rsh='):]
+        elif arg.startswith('--log-file='):
+            log_file = arg[len('--log-file='):]
+        elif not arg.startswith('-'):
+            paths.append(arg)
+
+        i += 1
+
+    if len(paths) < 2 or not ':' in paths[-1]:
+        sys.stderr.write('rsync: destination must be remote: host:path\n')
+        return 1
+
+    host = paths[-1].split(':', 1)[0]
+    if '@' in host:
+        host = host.split('@', 1)[1]
+
+    control_path = None
+    if rsh:
+        opts, _, _, _ = parse_ssh_args(shlex.split(rsh)[1:])
+        control_path = control_path_of(opts)
+
+    spec = load_spec(simdir, host)
+    if not connect(spec, host, control_path, 'rsync'):
+        sys.stderr.write('rsync: connection unexpectedly closed\n')
+        return RSYNC_EXIT_FAIL
+
+    num_files = 0
+    total = 0
+    for src in paths[:-1]:
+        try:
+            num, size = _tree_size(src)
+        except OSError as err:
+            sys.stderr.write('rsync: link_stat "%s" failed: %s\n' %
+                             (src, err.strerror))
+            return 23
+
+        num_files += num
+        total += size
+
+    # the first sync sends everything, later ones only the file list
+    stamp = os.path.join(node_dir(simdir, host), 'rsync.stamp')
+    if os.path.exists(stamp):
+        sent = num_files * FILE_LIST_ENTRY
+    else:
+        sent = total + num_files * FILE_LIST_ENTRY
+    with open(stamp, 'w') as f:
+        f.write('%d\n' % time.time())
+
+    if log_file:
+        with open(log_file, 'a') as f:
+            f.write('%s [%d] sent %d bytes  received %d bytes  '
+                    'total size %d\n' % (time.strftime('%Y/%m/%d %H:%M:%S'),
+                                         os.getpid(), sent,
+                                         num_files * 2, total))
+    return 0
+
+
+def ping(simdir, args):
+    '''stand-in for ping
+    Returns exit code
+    '''
+
+    hosts = [x for x in args if not x.startswith('-') and not x.isdigit()]
+    if not hosts:
+        sys.stderr.write('usage: ping [options] host\n')
+        return 2
+
+    host = hosts[-1]
+    spec = load_spec(simdir, host)
+    if spec['latency'] > 0:
+        time.sleep(spec['latency'])
+
+    received = 0 if spec['down'] else 1
+    print '1 packets transmitted, %d packets received' % received
+    if not received:
+        return 1
+
+    return 0
+
+
+COMMANDS = {
+    'ssh': ssh,
+    'rsync': rsync,
+    'ping': ping,
+}
+
+
+def main():
+    '''run the stand-in'''
+
+    if len(sys.argv) < 3 or not sys.argv[2] in COMMANDS:
+        sys.stderr.write('usage: python -m synctool_bench.simnode SIMDIR '
+                         'ssh|rsync|ping [args ...]\n')
+        sys.exit(1)
+
+    simdir = sys.argv[1]
+    func = COMMANDS[sys.argv[2]]
+    sys.exit(func(simdir, sys.argv[3:]))
+
+
+if __name__ == '__main__':
+    main()
+
+# EOB
@@ -0,0 +1,394 @@
+#
+#   synctool_bench.simulate.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''benchmark the master against a simulated cluster
+
+make_cluster() sets up SIMDIR:
+  SIMDIR/root/      a synctool installation with a generated repository
+  SIMDIR/sim/       stand-ins for ssh, rsync and ping
+  SIMDIR/nodes/     a directory per simulated node
+  SIMDIR/spec.json  latency, failures and hangs of the nodes
+synctool.conf points ssh_cmd, rsync_cmd and ping_cmd at the stand-ins
+(see synctool_bench.simnode), so that synctool, dsh and dsh-ping fan
+out to thousands of nodes without leaving the machine.
+run() times the commands for a number of NUM_PROC values
+'''
+
+import os
+import sys
+import json
+import time
+import getopt
+import shutil
+import socket
+import platform
+import tempfile
+import subprocess
+
+import synctool
+import synctool.param
+import synctool_launch
+
+from synctool_bench import bench, generate, simnode
+
+PROGNAME = 'synctool_bench.simulate'
+
+# the commands that are timed; the program name is relative to root/bin/
+SIM_COMMANDS = [
+    ('synctool', ['synctool']),
+    ('synctool_aggr', ['synctool', '-a']),
+    ('dsh', ['dsh', 'true']),
+    ('dsh_ping', ['dsh-ping']),
+]
+
+NUM_NODES = 1000
+NUM_PROC = [16, 32, 64, 128]
+
+# the simulation does not need a big repository
+SCALE = 0.05
+
+# the default spec of the nodes
+LATENCY = 0.05
+
+
+def _src_dir():
+    '''Returns the directory holding the synctool sources'''
+
+    return os.path.dirname(os.path.dirname(os.path.abspath(
+        synctool.__file__)))
+
+
+def _bench_dir():
+    '''Returns the directory holding the synctool_bench package'''
+
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _install(rootdir):
+    '''make rootdir look like an installed synctool
+    The programs are copied, because they must be executable;
+    the library is a symlink to the sources
+    '''
+
+    src_dir = _src_dir()
+
+    os.mkdir(os.path.join(rootdir, 'sbin'))
+    for name in os.listdir(src_dir):
+        if name.endswith('.py'):
+            path = os.path.join(rootdir, 'sbin', name)
+            shutil.copy(os.path.join(src_dir, name), path)
+            os.chmod(path, 0755)
+
+    for prog in synctool_launch.LAUNCH:
+        os.symlink(os.path.join('..', 'sbin', 'synctool_launch.py'),
+                   os.path.join(rootdir, 'bin', prog))
+
+    os.mkdir(os.path.join(rootdir, 'lib'))
+    os.symlink(os.path.join(src_dir, 'synctool'),
+               os.path.join(rootdir, 'lib', 'synctool'))
+
+
+def _make_stand_ins(simdir):
+    '''write the shell scripts that start the stand-ins'''
+
+    os.mkdir(os.path.join(simdir, 'sim'))
+
+    pythonpath = '%s:%s' % (_src_dir(), _bench_dir())
+    for cmd in sorted(simnode.COMMANDS):
+        path = os.path.join(simdir, 'sim', cmd)
+        with open(path, 'w') as f:
+            f.write('#! /bin/sh\n'
+                    "PYTHONPATH='%s' exec '%s' -m synctool_bench.simnode "
+                    "'%s' %s \"$@\"\n" % (pythonpath, sys.executable,
+                                          simdir, cmd))
+        os.chmod(path, 0755)
+
+
+def _configure(simdir, rootdir):
+    '''point synctool.conf at the stand-ins'''
+
+    conf_file = os.path.join(rootdir, 'etc', 'synctool.conf')
+    with open(conf_file) as f:
+        lines = f.readlines()
+
+    # the master refuses to run anywhere but on the master node
+    lines = ['master %s\n' % socket.getfqdn() if x.startswith('master ')
+             else x for x in lines]
+
+    sim = os.path.join(simdir, 'sim')
+    lines.extend([
+        '\n',
+        'ssh_cmd %s/ssh -o ConnectTimeout=10 -x -q\n' % sim,
+        'rsync_cmd %s/rsync -ar --delete --delete-excluded -q\n' % sim,
+        'ping_cmd %s/ping -q -c 1 -t 1\n' % sim,
+    ])
+
+    with open(conf_file, 'w') as f:
+        f.writelines(lines)
+
+
+def make_cluster(simdir, num_nodes=NUM_NODES, scale=SCALE, spec=None):
+    '''set up a simulated cluster in simdir
+    Returns the dict of sizes of the generated repository
+    '''
+
+    sizes = generate.scaled_sizes(scale)
+    sizes['nodes'] = num_nodes
+
+    rootdir = os.path.join(simdir, 'root')
+    os.makedirs(rootdir)
+    generate.generate(rootdir, sizes)
+
+    _install(rootdir)
+    _make_stand_ins(simdir)
+    _configure(simdir, rootdir)
+
+    os.mkdir(os.path.join(simdir, 'nodes'))
+
+    if spec is None:
+        spec = {'default': {'latency': LATENCY}}
+    with open(os.path.join(simdir, 'spec.json'), 'w') as f:
+        json.dump(spec, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+    return sizes
+
+
+def _time_command(simdir, cmd_arr, numproc):
+    '''run command once
+    Returns tuple: (elapsed time, exit code)
+    '''
+
+    rootdir = os.path.join(simdir, 'root')
+    cmd_arr = ([os.path.join(rootdir, 'bin', cmd_arr[0]), '-N', str(numproc)]
+               + cmd_arr[1:])
+
+    with open(os.devnull, 'w') as devnull:
+        t_start = time.time()
+        exitcode = subprocess.call(cmd_arr, stdout=devnull, stderr=devnull)
+        elapsed = time.time() - t_start
+
+    return elapsed, exitcode
+
+
+def run(simdir, num_nodes, numprocs=None, commands=None, repeat=1):
+    '''time the commands against the simulated cluster
+    A command that exits non-zero is marked as failed, and has no timings
+    (nodes that are down do not make synctool exit non-zero)
+    Returns dict with the results, fit for writing as JSON
+    '''
+
+    if numprocs is None:
+        numprocs = NUM_PROC
+
+    if commands is None:
+        commands = [name for name, _ in SIM_COMMANDS]
+
+    # the last node in synctool.conf is ignored
+    active_nodes = num_nodes - 1
+
+    results = {}
+    for name, cmd_arr in SIM_COMMANDS:
+        if not name in commands:
+            continue
+
+        for numproc in numprocs:
+            timings = []
+            exitcode = 0
+            for _ in xrange(repeat):
+                elapsed, exitcode = _time_command(simdir, cmd_arr, numproc)
+                if exitcode != 0:
+                    break
+
+                timings.append(elapsed)
+
+            key = '%s_n%d' % (name, numproc)
+            if exitcode != 0:
+                results[key] = {
+                    'failed': True,
+                    'num_proc': numproc,
+                    'exit_code': exitcode,
+                }
+                print '%-20s FAILED  exit %d' % (key, exitcode)
+                continue
+
+            best = min(timings)
+            results[key] = {
+                'best': best,
+                'mean': sum(timings) / len(timings),
+                'runs': timings,
+                'num_proc': numproc,
+                'nodes_per_sec': active_nodes / best if best > 0 else 0.0,
+                'exit_code': exitcode,
+            }
+            print '%-20s best %9.4f  %8.1f nodes/s  exit %d' % (
+                key, best, results[key]['nodes_per_sec'], exitcode)
+
+    with open(os.path.join(simdir, 'spec.json')) as f:
+        spec = json.load(f)
+
+    return {
+        'synctool_version': synctool.param.VERSION,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'sizes': {'nodes': num_nodes},
+        'spec': spec,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def usage():
+    '''print usage information'''
+
+    print 'usage: python -m %s [options]' % PROGNAME
+    print '''options:
+  -h, --help            Display this information
+  -o, --output=FILE     Write results to FILE (default: synctool-sim.json)
+  -c, --compare=FILE    Compare results to an earlier run
+  -n, --nodes=NUM       Number of simulated nodes (default: %d)
+  -N, --numproc=LIST    Comma-separated list of NUM_PROC values to time
+                        (default: %s)
+  -C, --commands=LIST   Comma-separated list of commands to time
+                        (default: %s)
+  -l, --latency=SECS    Connection latency of the nodes (default: %.2f)
+  -j, --jitter=SECS     Random extra latency per node (default: 0)
+  -f, --fail=FRACTION   Fraction of nodes that are down (default: 0)
+  -H, --hang=NODES:SECS Let nodes hang for a number of seconds
+  -S, --spec=FILE       Read the node spec from JSON file
+  -r, --repeat=NUM      Run every command NUM times (default: 1)
+  -d, --dir=DIR         Set up the simulated cluster in DIR, and keep it
+''' % (NUM_NODES, ','.join([str(x) for x in NUM_PROC]),
+       ','.join([name for name, _ in SIM_COMMANDS]), LATENCY)
+
+
+def main():
+    '''run the program'''
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'ho:c:n:N:C:l:j:f:H:S:r:d:',
+                                   ['help', 'output=', 'compare=', 'nodes=',
+                                    'numproc=', 'commands=', 'latency=',
+                                    'jitter=', 'fail=', 'hang=', 'spec=',
+                                    'repeat=', 'dir='])
+    except getopt.GetoptError as reason:
+        print '%s: %s' % (PROGNAME, reason)
+        usage()
+        sys.exit(1)
+
+    if args:
+        usage()
+        sys.exit(1)
+
+    output = 'synctool-sim.json'
+    compare_file = None
+    num_nodes = NUM_NODES
+    numprocs = NUM_PROC
+    commands = None
+    default = {'latency': LATENCY}
+    nodes = {}
+    repeat = 1
+    simdir = None
+
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit(1)
+
+        try:
+            if opt in ('-o', '--output'):
+                output = arg
+            elif opt in ('-c', '--compare'):
+                compare_file = arg
+            elif opt in ('-n', '--nodes'):
+                num_nodes = int(arg)
+            elif opt in ('-N', '--numproc'):
+                numprocs = [int(x) for x in arg.split(',')]
+            elif opt in ('-C', '--commands'):
+                commands = arg.split(',')
+            elif opt in ('-l', '--latency'):
+                default['latency'] = float(arg)
+            elif opt in ('-j', '--jitter'):
+                default['jitter'] = float(arg)
+            elif opt in ('-f', '--fail'):
+                default['fail'] = float(arg)
+            elif opt in ('-H', '--hang'):
+                expr, secs = arg.rsplit(':', 1)
+                nodes.setdefault(expr, {})['hang'] = float(secs)
+            elif opt in ('-S', '--spec'):
+                with open(arg) as f:
+                    spec = json.load(f)
+                default.update(spec.get('default', {}))
+                nodes.update(spec.get('nodes', {}))
+            elif opt in ('-r', '--repeat'):
+                repeat = int(arg)
+            elif opt in ('-d', '--dir'):
+                simdir = os.path.abspath(arg)
+        except ValueError:
+            print "invalid argument for option '%s'" % opt
+            sys.exit(1)
+        except IOError as err:
+            print '%s: %s: %s' % (PROGNAME, arg, err.strerror)
+            sys.exit(1)
+
+    if num_nodes < 2 or repeat < 1 or min(numprocs) < 1:
+        print 'invalid value for nodes, numproc or repeat'
+        sys.exit(1)
+
+    if commands is not None:
+        known = [name for name, _ in SIM_COMMANDS]
+        for name in commands:
+            if not name in known:
+                print '%s: unknown command: %s' % (PROGNAME, name)
+                sys.exit(1)
+
+    output = os.path.abspath(output)
+    if compare_file:
+        compare_file = os.path.abspath(compare_file)
+
+    keep = simdir is not None
+    if simdir is None:
+        simdir = tempfile.mkdtemp(prefix='synctool-sim-')
+    elif os.path.exists(simdir):
+        print '%s: %s already exists' % (PROGNAME, simdir)
+        sys.exit(1)
+
+    try:
+        print 'setting up %d simulated nodes in %s' % (num_nodes, simdir)
+        make_cluster(simdir, num_nodes,
+                     spec={'default': default, 'nodes': nodes})
+
+        data = run(simdir, num_nodes, numprocs, commands, repeat)
+        bench.save(data, output)
+        print 'results written to %s' % output
+
+        slower = 0
+        if compare_file:
+            slower = bench.compare(data, compare_file)
+    finally:
+        if not keep:
+            shutil.rmtree(simdir, ignore_errors=True)
+
+    failed = [key for key, result in data['results'].items()
+              if result.get('failed')]
+    if failed:
+        print '%s: %d commands failed: %s' % (PROGNAME, len(failed),
+                                              ', '.join(sorted(failed)))
+        sys.exit(1)
+
+    if slower:
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
+
+# EOB
@@ -23,9 +23,11 @@ synctool_template.py synctool_list.py"
 
 LAUNCHER="synctool_launch.py"
 
-LIBS="__init__.py aggr.py config.py configparser.py lib.py multiplex.py
-nodeset.py object.py overlay.py parallel.py param.py pkgclass.py pwdgrp.py
-range.py syncstat.py unbuffered.py update.py upload.py"
+LIBS="__init__.py aggr.py config.py configcache.py configparser.py lib.py
+manifest.py multiplex.py nodeset.py object.py overlay.py parallel.py param.py
+pathindex.py pkgclass.py plan.py postqueue.py prefetch.py profiler.py pwdgrp.py
+range.py reactor.py report.py syncstat.py templatecache.py unbuffered.py
+update.py upload.py"
 
 MAIN_LIBS="__init__.py aggr.py client.py config.py master.py dsh_pkg.py
 client_pkg.py dsh_ping.py dsh_cp.py dsh.py template.py wrapper.py"
@@ -365,6 +367,8 @@ remove_overlay() {
 		rmdir "$INSTALL_ROOT/var/delete/all" 2>/dev/null
 		rmdir "$INSTALL_ROOT/var/delete" 2>/dev/null
 		rmdir "$INSTALL_ROOT/var/purge" 2>/dev/null
+		# the cache holds no data; it can be regenerated
+		rm -rf "$INSTALL_ROOT/var/cache"
 		rmdir "$INSTALL_ROOT/var" 2>/dev/null
 		rmdir "$INSTALL_ROOT/scripts" 2>/dev/null
 	fi
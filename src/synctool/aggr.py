@@ -10,24 +10,39 @@
 
 '''aggregate: group together output that is the same'''
 
+import os
+import hashlib
+import tempfile
 import subprocess
 
 from synctool.lib import stderr
+import synctool.param
 import synctool.range
 
+# output is kept in memory up to this many bytes;
+# beyond that, it is written to a temp file
+SPILL_THRESHOLD = 16 * 1024 * 1024
+
 
 def aggregate(f):
     '''group together input lines that are the same'''
 
-    lines = f.readlines()
-    if not lines:
-        return
+    # the output of every node is identified by a running digest,
+    # so nodes need not be compared to each other line by line
+    digest_per_node = {}
 
-    lines = [x.strip() for x in lines]
+    # lines are kept as (node, output) until the end, when the output
+    # of one node per group is printed
+    buffered = []
+    buffered_size = 0
+    spill = None
 
-    output_per_node = {}
+    while True:
+        line = f.readline()
+        if not line:
+            break
 
-    for line in lines:
+        line = line.strip()
         arr = line.split(':', 1)
 
         if len(arr) <= 1:
@@ -37,35 +52,71 @@ def aggregate(f):
         node = arr[0]
         output = arr[1]
 
-        if not node in output_per_node:
-            output_per_node[node] = [output,]
-        else:
-            output_per_node[node].append(output)
+        if not node in digest_per_node:
+            digest_per_node[node] = hashlib.md5()
+        digest_per_node[node].update(output + '\n')
 
-    nodes = output_per_node.keys()
-    if not nodes:
-        return
+        buffered.append((node, output))
+        buffered_size += len(line)
 
-    nodes.sort()
+        if buffered_size > SPILL_THRESHOLD:
+            if spill is None:
+                spill = _spill_file()
+            for node, output in buffered:
+                spill.write('%s:%s\n' % (node, output))
+            buffered = []
+            buffered_size = 0
 
-    while len(nodes) > 0:
-        node = nodes.pop(0)
+    if not digest_per_node:
+        return
 
-        out = output_per_node[node]
+    nodes_per_digest = {}
+    for node, digest in digest_per_node.iteritems():
+        key = digest.digest()
+        if not key in nodes_per_digest:
+            nodes_per_digest[key] = [node]
+        else:
+            nodes_per_digest[key].append(node)
 
-        nodelist = [node,]
+    # collect the output of the first node of every group
+    output_per_node = {}
+    for nodelist in nodes_per_digest.itervalues():
+        nodelist.sort()
+        output_per_node[nodelist[0]] = []
+
+    if spill is not None:
+        spill.seek(0)
+        for line in spill:
+            node, output = line[:-1].split(':', 1)
+            if node in output_per_node:
+                output_per_node[node].append(output)
+        spill.close()
+
+    for node, output in buffered:
+        if node in output_per_node:
+            output_per_node[node].append(output)
 
-        for node2 in nodes[:]:
-            if out == output_per_node[node2]:
-                nodelist.append(node2)
-                del output_per_node[node2]
-                nodes.remove(node2)
+    groups = nodes_per_digest.values()
+    groups.sort()
 
+    for nodelist in groups:
         print synctool.range.compress(nodelist) + ':'
-        for line in out:
+        for line in output_per_node[nodelist[0]]:
             print line
 
 
+def _spill_file():
+    '''Returns temp file for holding output'''
+
+    tempdir = synctool.param.TEMP_DIR
+    if not tempdir or not os.path.isdir(tempdir):
+        # let Python pick a directory
+        tempdir = None
+
+    # the file is deleted as soon as it is closed
+    return tempfile.TemporaryFile(prefix='synctool-aggr-', dir=tempdir)
+
+
 def run(cmd_arr):
     '''pipe the output through the aggregator
     Returns False on error, else True
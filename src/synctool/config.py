@@ -16,6 +16,7 @@ import os
 import sys
 import socket
 
+import synctool.configcache
 import synctool.configparser
 import synctool.lib
 from synctool.lib import stderr, error
@@ -31,7 +32,18 @@ def read_config():
         stderr("no such config file '%s'" % synctool.param.CONF_FILE)
         sys.exit(-1)
 
-    errors = synctool.configparser.read_config_file(synctool.param.CONF_FILE)
+    # a cache file is only there when config_cache was enabled
+    # when it was saved
+    if synctool.configcache.load():
+        errors = 0
+    else:
+        errors = synctool.configparser.read_config_file(
+                    synctool.param.CONF_FILE)
+        if not errors:
+            if synctool.param.CONFIG_CACHE:
+                synctool.configcache.save()
+            else:
+                synctool.configcache.remove()
 
     # overlay/ and delete/ must be under ROOTDIR
     if not os.path.isdir(synctool.param.OVERLAY_DIR):
@@ -89,6 +101,8 @@ def read_config():
     # initialize ALL_GROUPS
     synctool.param.ALL_GROUPS = make_all_groups()
 
+    make_group_index()
+
     if errors > 0:
         sys.exit(-1)
 
@@ -247,18 +261,55 @@ def get_my_groups():
     return []
 
 
+def make_group_index():
+    '''make the index of nodes by group, and of groups by node
+    This must be called again whenever NODES changes
+    '''
+
+    nodes_by_group = {}
+    groups_by_node = {}
+
+    for node, groups in synctool.param.NODES.iteritems():
+        groups_by_node[node] = frozenset(groups)
+
+        for g in groups:
+            if g in nodes_by_group:
+                nodes_by_group[g].append(node)
+            else:
+                nodes_by_group[g] = [node]
+
+    for g in nodes_by_group:
+        nodes_by_group[g] = frozenset(nodes_by_group[g])
+
+    synctool.param.NODES_BY_GROUP = nodes_by_group
+    synctool.param.GROUPS_BY_NODE = groups_by_node
+
+
 def get_nodes_in_groups(groups):
     '''returns a set of nodes that are in a set or list of groups'''
 
+    if synctool.param.NODES_BY_GROUP is None:
+        make_group_index()
+
     s = set()
 
     for g in groups:
-        for node in synctool.param.NODES.keys():
-            # NODES[node] is an ordered list (groups in order of importance)
-            # so we can not do neat tricks with combining sets here ...
-            if g in synctool.param.NODES[node]:
-                s.add(node)
+        if g in synctool.param.NODES_BY_GROUP:
+            s |= synctool.param.NODES_BY_GROUP[g]
 
     return s
 
+
+def is_ignored(nodename):
+    '''Returns True if the node is ignored, or any of its groups'''
+
+    if synctool.param.GROUPS_BY_NODE is None:
+        make_group_index()
+
+    if not nodename in synctool.param.GROUPS_BY_NODE:
+        return False
+
+    return not synctool.param.GROUPS_BY_NODE[nodename].isdisjoint(
+                synctool.param.IGNORE_GROUPS)
+
 # EOB
@@ -0,0 +1,213 @@
+#
+#   synctool.configcache.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''the config cache holds a snapshot of the settings that result from
+parsing synctool.conf, so that commands need not parse it over and over.
+It is kept in $SYNCTOOL/var/cache/config
+It is only written when config_cache is enabled in synctool.conf
+
+The snapshot is only used when
+ - all config files (including any included files) are unchanged
+ - the settings before parsing are the same as when the snapshot was made;
+   command-line options may have changed some settings already
+
+The file is written with marshal, which unlike pickle can not
+run any code when it is loaded
+'''
+
+import os
+import copy
+import errno
+import hashlib
+import marshal
+
+import synctool.configparser
+from synctool.lib import verbose
+import synctool.param
+
+# change this whenever the format of the cache changes
+CACHE_VERSION = 1
+
+# settings before parsing, and the key made from them
+PRE_STATE = None
+PRE_KEY = None
+
+
+def _cache_file():
+    '''Returns path of the cache file'''
+
+    return os.path.join(synctool.param.CACHE_DIR, 'config')
+
+
+def _settings():
+    '''Returns dict of all settings in synctool.param'''
+
+    d = {}
+    for name, value in vars(synctool.param).iteritems():
+        if name.isupper():
+            d[name] = value
+
+    return d
+
+
+def _canonical(value):
+    '''Returns value in a form that does not depend on the
+    order in which items were inserted into sets and dicts
+    '''
+
+    if isinstance(value, (set, frozenset)):
+        return sorted([_canonical(x) for x in value])
+
+    if isinstance(value, dict):
+        return sorted([(_canonical(k), _canonical(v))
+                       for k, v in value.iteritems()])
+
+    if isinstance(value, (list, tuple)):
+        return [_canonical(x) for x in value]
+
+    return value
+
+
+def _file_key(filename):
+    '''Returns tuple: (filename, mtime, size, md5 digest)
+    or None on error
+    '''
+
+    try:
+        statbuf = os.stat(filename)
+        f = open(filename, 'rb')
+    except (OSError, IOError):
+        return None
+
+    with f:
+        digest = hashlib.md5(f.read()).hexdigest()
+
+    return (filename, statbuf.st_mtime, statbuf.st_size, digest)
+
+
+def load():
+    '''load the settings from the cache
+    Returns True on success, False if the config must be parsed
+    '''
+
+    global PRE_STATE, PRE_KEY
+
+    # remember the settings before parsing, for save()
+    PRE_STATE = copy.deepcopy(_settings())
+    try:
+        PRE_KEY = hashlib.md5(marshal.dumps(
+                      _canonical(sorted(PRE_STATE.items())))).hexdigest()
+    except ValueError:
+        # can not be marshalled; do not use the cache
+        PRE_STATE = PRE_KEY = None
+        return False
+
+    filename = _cache_file()
+    try:
+        statbuf = os.stat(filename)
+    except OSError:
+        return False
+
+    # do not trust a cache file that somebody else could have written
+    if statbuf.st_uid != os.getuid() or statbuf.st_mode & 022 != 0:
+        verbose('not using config cache %s: suspicious owner or mode' %
+                filename)
+        return False
+
+    try:
+        with open(filename, 'rb') as f:
+            data = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        verbose('ignoring corrupt config cache %s' % filename)
+        return False
+
+    try:
+        version, synctool_version, pre_key, files, state = data
+    except (TypeError, ValueError):
+        verbose('ignoring corrupt config cache %s' % filename)
+        return False
+
+    if (version != CACHE_VERSION or
+            synctool_version != synctool.param.VERSION or
+            pre_key != PRE_KEY):
+        return False
+
+    if not files or files[0][0] != synctool.param.CONF_FILE:
+        return False
+
+    for key in files:
+        if _file_key(key[0]) != key:
+            verbose('config file %s changed' % key[0])
+            return False
+
+    for name, value in state.iteritems():
+        setattr(synctool.param, name, value)
+
+    verbose('loaded settings from config cache')
+    return True
+
+
+def remove():
+    '''remove the cache file, if any'''
+
+    try:
+        os.unlink(_cache_file())
+    except OSError:
+        pass
+
+
+def save():
+    '''save the settings after parsing the config file'''
+
+    if PRE_KEY is None:
+        return
+
+    files = []
+    for filename in synctool.configparser.CONFIG_FILES:
+        key = _file_key(filename)
+        if key is None:
+            return
+
+        files.append(key)
+
+    # only keep the settings that were changed by parsing
+    state = {}
+    for name, value in _settings().iteritems():
+        if not name in PRE_STATE or PRE_STATE[name] != value:
+            state[name] = value
+
+    try:
+        data = marshal.dumps((CACHE_VERSION, synctool.param.VERSION,
+                              PRE_KEY, files, state))
+    except ValueError:
+        return
+
+    # the cache is only an optimization; fail silently
+    # (for example, when not running as root)
+    try:
+        os.mkdir(synctool.param.CACHE_DIR, 0755)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            return
+
+    filename = _cache_file()
+    tmp_filename = '%s.%d' % (filename, os.getpid())
+    try:
+        with open(tmp_filename, 'wb') as f:
+            f.write(data)
+
+        os.rename(tmp_filename, filename)
+    except (IOError, OSError):
+        try:
+            os.unlink(tmp_filename)
+        except OSError:
+            pass
+
+# EOB
@@ -40,6 +40,10 @@ PERSIST_TIME = re.compile(r'^\d+$|'
 # to see if a parameter is being redefined
 SYMBOLS = {}
 
+# list of config files that were read, including included files
+# (used by the config cache)
+CONFIG_FILES = []
+
 
 class Symbol(object):
     '''structure that says where a symbol was first defined'''
@@ -71,6 +75,8 @@ def read_config_file(configfile):
                                                                 err.strerror))
         return 1
 
+    CONFIG_FILES.append(configfile)
+
     this_module = sys.modules['synctool.configparser']
 
     lineno = 0
@@ -330,6 +336,24 @@ def config_ssh_control_persist(arr, configfile, lineno):
     return 0
 
 
+def config_ssh_auto_multiplex(arr, configfile, lineno):
+    '''parse keyword: ssh_auto_multiplex'''
+
+    (err, synctool.param.AUTO_MULTIPLEX) = _config_boolean(
+                                                'ssh_auto_multiplex', arr[1],
+                                                configfile, lineno)
+    return err
+
+
+def config_ssh_share_session(arr, configfile, lineno):
+    '''parse keyword: ssh_share_session'''
+
+    (err, synctool.param.SHARE_SSH_SESSION) = _config_boolean(
+                                                'ssh_share_session', arr[1],
+                                                configfile, lineno)
+    return err
+
+
 def config_require_extension(arr, configfile, lineno):
     '''parse keyword: require_extension'''
 
@@ -362,6 +386,42 @@ def config_syslogging(arr, configfile, lineno):
     return err
 
 
+def config_config_cache(arr, configfile, lineno):
+    '''parse keyword: config_cache'''
+
+    (err, synctool.param.CONFIG_CACHE) = _config_boolean('config_cache',
+                                                arr[1], configfile, lineno)
+    return err
+
+
+def config_manifest(arr, configfile, lineno):
+    '''parse keyword: manifest'''
+
+    (err, synctool.param.MANIFEST) = _config_boolean('manifest', arr[1],
+                                                     configfile, lineno)
+    return err
+
+
+def config_template_cache(arr, configfile, lineno):
+    '''parse keyword: template_cache'''
+
+    (err, synctool.param.TEMPLATE_CACHE) = _config_boolean('template_cache',
+                                                arr[1], configfile, lineno)
+    return err
+
+
+def config_template_cache_env(arr, configfile, lineno):
+    '''parse keyword: template_cache_env'''
+
+    if len(arr) < 2:
+        stderr("%s:%d: 'template_cache_env' requires at least 1 argument: "
+               "the name of an environment variable" % (configfile, lineno))
+        return 1
+
+    synctool.param.TEMPLATE_CACHE_ENV.update(arr[1:])
+    return 0
+
+
 def config_ignore_dotfiles(arr, configfile, lineno):
     '''parse keyword: ignore_dotfiles'''
 
@@ -1037,6 +1097,45 @@ def config_pkg_cmd(arr, configfile, lineno):
     return err
 
 
+def config_client_num_proc(arr, configfile, lineno):
+    '''parse keyword: client_num_proc'''
+
+    (err, synctool.param.CLIENT_NUM_PROC) = _config_integer(
+                                                'client_num_proc', arr[1],
+                                                configfile, lineno)
+
+    if not err and synctool.param.CLIENT_NUM_PROC < 1:
+        stderr("%s:%d: invalid argument for client_num_proc" %
+               (configfile, lineno))
+        return 1
+
+    return err
+
+
+def config_post_num_proc(arr, configfile, lineno):
+    '''parse keyword: post_num_proc'''
+
+    (err, synctool.param.POST_NUM_PROC) = _config_integer(
+                                                'post_num_proc', arr[1],
+                                                configfile, lineno)
+
+    if not err and synctool.param.POST_NUM_PROC < 1:
+        stderr("%s:%d: invalid argument for post_num_proc" %
+               (configfile, lineno))
+        return 1
+
+    return err
+
+
+def config_event_driven(arr, configfile, lineno):
+    '''parse keyword: event_driven'''
+
+    (err, synctool.param.EVENT_DRIVEN) = _config_boolean('event_driven',
+                                                         arr[1], configfile,
+                                                         lineno)
+    return err
+
+
 def config_num_proc(arr, configfile, lineno):
     '''parse keyword: num_proc'''
 
@@ -18,6 +18,7 @@ import shlex
 import syslog
 
 import synctool.param
+import synctool.profiler
 
 # options (mostly) set by command-line arguments
 DRY_RUN = True
@@ -27,6 +28,10 @@ UNIX_CMD = False
 NO_POST = False
 MASTERLOG = False
 
+# size for doing I/O while comparing files
+# large blocks make for few read() calls on big files
+COMPARE_IO_SIZE = 256 * 1024
+
 # print nodename in output?
 # This option is pretty useless except in synctool-ssh it may be useful
 OPT_NODENAME = True
@@ -304,9 +309,36 @@ def log(msg):
         _masterlog(msg)
 
 
-def run_with_nodename(cmd_arr, nodename):
+def output_with_nodename(line, nodename):
+    '''show a line of output of a node, prefixed with the nodename
+    Log lines are passed to the master's syslog
+    '''
+
+    # if output is a log line, pass it to the master's syslog
+    if line[:15] == '%synctool-log% ':
+        if line[15:] == '--':
+            pass
+        else:
+            _masterlog('%s: %s' % (nodename, line[15:]))
+        return
+
+    if line[:19] == '%synctool-profile% ':
+        # profiling summary of synctool-client
+        line = 'profile: ' + line[19:]
+
+    # pass output on; simply use 'print' rather than 'stdout()'
+    if OPT_NODENAME:
+        print '%s: %s' % (nodename, line)
+    else:
+        # do not prepend the nodename of this node to the output
+        # if option --no-nodename was given
+        print line
+
+
+def run_with_nodename(cmd_arr, nodename, stdin=None):
     '''run command and show output with nodename
     It will run regardless of what DRY_RUN is
+    stdin is an optional filename to use as standard input
     Returns process return code or -1 on error
     '''
 
@@ -316,32 +348,23 @@ def run_with_nodename(cmd_arr, nodename):
     sys.stderr.flush()
 
     try:
-        proc = subprocess.Popen(cmd_arr, shell=False, bufsize=4096,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT)
-    except OSError as err:
+        if stdin is not None:
+            with open(stdin) as f:
+                proc = subprocess.Popen(cmd_arr, shell=False, bufsize=4096,
+                                        stdin=f, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT)
+        else:
+            proc = subprocess.Popen(cmd_arr, shell=False, bufsize=4096,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+    except (IOError, OSError) as err:
         stderr('failed to run command %s: %s' % (cmd_arr[0], err.strerror))
         return -1
 
     f = proc.stdout
     with f:
         for line in f:
-            line = line.rstrip()
-
-            # if output is a log line, pass it to the master's syslog
-            if line[:15] == '%synctool-log% ':
-                if line[15:] == '--':
-                    pass
-                else:
-                    _masterlog('%s: %s' % (nodename, line[15:]))
-            else:
-                # pass output on; simply use 'print' rather than 'stdout()'
-                if OPT_NODENAME:
-                    print '%s: %s' % (nodename, line)
-                else:
-                    # do not prepend the nodename of this node to the output
-                    # if option --no-nodename was given
-                    print line
+            output_with_nodename(line.rstrip(), nodename)
 
     proc.wait()
     if proc.returncode != 0:
@@ -350,9 +373,10 @@ def run_with_nodename(cmd_arr, nodename):
     return proc.returncode
 
 
-def shell_command(cmd):
+def shell_command(cmd, cwd=None):
     '''run a shell command
     Unless DRY_RUN is set
+    cwd is an optional directory to run the command in
     Returns: return code of shell command
     '''
 
@@ -379,7 +403,7 @@ def shell_command(cmd):
         sys.stderr.flush()
 
         try:
-            ret = subprocess.call(cmd, shell=True)
+            ret = subprocess.call(cmd, shell=True, cwd=cwd)
         except OSError as err:
             stderr("failed to run shell command '%s' : %s" % (prettypath(cmd),
                                                               err.strerror))
@@ -428,8 +452,10 @@ def exec_command(cmd_arr, silent=False):
     return ret
 
 
-def run_command(cmd):
-    '''run a shell command'''
+def run_command(cmd, cwd=None):
+    '''run a shell command
+    cwd is an optional directory to run the command in
+    '''
 
     # a command can have arguments
     arr = shlex.split(cmd)
@@ -445,7 +471,7 @@ def run_command(cmd):
         return
 
     # run the shell command
-    shell_command(cmd)
+    shell_command(cmd, cwd)
 
 
 def run_command_in_dir(dest_dir, cmd):
@@ -534,6 +560,52 @@ def mkdir_p(path, mode=0700):
     return True
 
 
+def compare_files(path1, path2, digest=None):
+    '''compare the contents of two files block by block,
+    stopping at the first difference
+    If digest is given, it is updated with the data read from path1;
+    it is only complete when the files are the same
+    Returns True if the same, False if different
+    May raise IOError; err.filename tells which file has a problem
+    '''
+
+    profiling = synctool.profiler.ENABLED
+
+    f1 = open(path1, 'rb')
+    with f1:
+        f2 = open(path2, 'rb')
+        with f2:
+            if profiling:
+                # the counts are approximate when comparing in threads
+                synctool.profiler.FILES_OPENED += 2
+
+            while True:
+                try:
+                    data1 = f1.read(COMPARE_IO_SIZE)
+                except IOError as err:
+                    err.filename = path1
+                    raise
+
+                try:
+                    data2 = f2.read(COMPARE_IO_SIZE)
+                except IOError as err:
+                    err.filename = path2
+                    raise
+
+                if profiling:
+                    synctool.profiler.BYTES_READ += len(data1) + len(data2)
+
+                if data1 != data2:
+                    # early exit; the rest of the file doesn't matter
+                    return False
+
+                if not data1:
+                    return True
+
+                if digest is not None:
+                    digest.update(data1)
+
+
 #
 #   functions for straightening out paths that were given by the user
 #
@@ -611,6 +683,51 @@ def strip_terse_path(path):
     return path
 
 
+def read_path_list(filename):
+    '''read list of full paths from file, one per line
+    Empty lines and lines starting with '#' are skipped
+    filename '-' reads from stdin
+    An empty list is an error, because it must not be mistaken
+    for a full run
+    Returns list of stripped paths, or None on error
+    '''
+
+    try:
+        if filename == '-':
+            lines = sys.stdin.readlines()
+        else:
+            with open(filename) as f:
+                lines = f.readlines()
+    except IOError as err:
+        error('failed to read %s: %s' % (filename, err.strerror))
+        return None
+
+    paths = []
+    lineno = 0
+    for line in lines:
+        lineno += 1
+        line = line.strip()
+        if not line or line[0] == '#':
+            continue
+
+        path = strip_path(line)
+        if path[0] != os.sep:
+            error('%s:%d: path must be a full path, starting with a slash' %
+                  (filename, lineno))
+            return None
+
+        paths.append(path)
+
+    if not paths:
+        if filename == '-':
+            error('no paths given on stdin')
+        else:
+            error('no paths in %s' % filename)
+        return None
+
+    return paths
+
+
 def prepare_path(path):
     '''strip path, and replace $SYNCTOOL by the installdir'''
 
@@ -22,9 +22,16 @@ import synctool.lib
 from synctool.lib import verbose, stdout, stderr, error, warning, terse
 from synctool.lib import unix_out, prettypath
 from synctool.main.wrapper import catch_signals
+import synctool.manifest
 import synctool.overlay
 import synctool.param
+import synctool.pathindex
+import synctool.plan
+import synctool.postqueue
+import synctool.prefetch
+import synctool.profiler
 import synctool.syncstat
+import synctool.templatecache
 
 # hardcoded name because otherwise we get "synctool_client.py"
 PROGNAME = 'synctool-client'
@@ -35,7 +42,13 @@ ACTION_DIFF = 1
 ACTION_ERASE_SAVED = 2
 ACTION_REFERENCE = 3
 
-SINGLE_FILES = []
+SINGLE_FILES = synctool.pathindex.PathIndex()
+
+# name of the plan made by the master (see synctool.plan)
+OPT_PLAN = None
+
+# files to compare in advance: (src_path, src_stat, dest_path, dest_stat)
+PREFETCH_OBJS = []
 
 
 def generate_template(obj, post_dict):
@@ -54,7 +67,8 @@ def generate_template(obj, post_dict):
         obj.ov_type = synctool.overlay.OV_IGNORE
         return True
 
-    if len(SINGLE_FILES) > 0 and obj.dest_path not in SINGLE_FILES:
+    if (len(SINGLE_FILES) > 0 and
+            SINGLE_FILES.match(obj.dest_path) is None):
         verbose('skipping template generation of %s' % obj.src_path)
         obj.ov_type = synctool.overlay.OV_IGNORE
         return True
@@ -68,7 +82,7 @@ def generate_template(obj, post_dict):
     newname += '._' + synctool.param.NODENAME
 
     statbuf = synctool.syncstat.SyncStat(newname)
-    if statbuf.exists():
+    if statbuf.exists() and not synctool.param.TEMPLATE_CACHE:
         verbose('template destination %s already exists' % newname)
 
         # modify the object; set new src and dest filenames
@@ -87,6 +101,27 @@ def generate_template(obj, post_dict):
 
     generator = post_dict[template]
 
+    cache_key = None
+    if synctool.param.TEMPLATE_CACHE:
+        cache_key = synctool.templatecache.key(obj.src_path, generator,
+                                               newname)
+        if (cache_key is not None and
+                synctool.templatecache.fetch(cache_key, newname)):
+            verbose('template output %s taken from cache' % newname)
+
+            obj.src_path = newname
+            obj.dest_path = os.path.basename(obj.dest_path)
+            return True
+
+        if statbuf.exists():
+            # the output is stale
+            verbose('  os.unlink(%s)' % newname)
+            try:
+                os.unlink(newname)
+            except OSError as err:
+                error('failed to remove %s: %s' % (newname, err.strerror))
+                return False
+
     # chdir to source directory
     # Note: the change dir is not really needed
     # but the documentation promises that .post scripts run in
@@ -116,9 +151,14 @@ def generate_template(obj, post_dict):
     unix_out('# run command %s' % os.path.basename(cmd_arr[0]))
 
     have_error = False
+    t_start = time.time()
     if synctool.lib.exec_command(cmd_arr) == -1:
         have_error = True
 
+    if synctool.profiler.ENABLED:
+        synctool.profiler.add_script(time.time() - t_start,
+                                      prettypath(generator))
+
     statbuf = synctool.syncstat.SyncStat(newname)
     if not statbuf.exists():
         if not have_error:
@@ -133,6 +173,8 @@ def generate_template(obj, post_dict):
             verbose('error: expected output %s was not generated' % newname)
     else:
         verbose('found generated output %s' % newname)
+        if cache_key is not None and not have_error:
+            synctool.templatecache.store(cache_key, newname)
 
     os.umask(077)
 
@@ -161,9 +203,11 @@ def generate_template(obj, post_dict):
 
 
 def purge_files():
-    '''run the purge function'''
+    '''run the purge function
+    All purge dirs of a group are copied by a single rsync
+    '''
 
-    paths = []
+    group_paths = []
     purge_groups = os.listdir(synctool.param.PURGE_DIR)
 
     # find the source purge paths that we need to copy
@@ -174,6 +218,7 @@ def purge_files():
             if not os.path.isdir(purge_root):
                 continue
 
+            paths = []
             for path, subdirs, files in os.walk(purge_root):
                 # rsync only purge dirs that actually contain files
                 # otherwise rsync --delete would wreak havoc
@@ -188,25 +233,28 @@ def purge_files():
                             prettypath(purge_root))
                     return
 
-                # paths has (src_dir, dest_dir)
-                paths.append((path, path[len(purge_root):]))
+                # paths has dirs relative to purge_root
+                paths.append(path[len(purge_root) + 1:])
 
                 # do not recurse into this dir any deeper
                 del subdirs[:]
 
+            if paths:
+                group_paths.append((purge_root, paths))
+
     cmd_rsync, opts_string = _make_rsync_purge_cmd()
 
     # call rsync to copy the purge dirs
-    for src, dest in paths:
-        # trailing slash on source path is important for rsync
-        src += os.sep
-        dest += os.sep
-
+    for purge_root, paths in group_paths:
         cmd_arr = cmd_rsync[:]
-        cmd_arr.append(src)
-        cmd_arr.append(dest)
-
-        verbose('running rsync%s%s %s' % (opts_string, prettypath(src), dest))
+        for path in paths:
+            # with --relative, rsync copies the part after '/./'
+            # trailing slash on source path is important for rsync
+            cmd_arr.append(os.path.join(purge_root, '.', path) + os.sep)
+        cmd_arr.append(os.sep)
+
+        verbose('running rsync%s%s/./{%d dirs} %s' %
+                (opts_string, prettypath(purge_root), len(paths), os.sep))
         _run_rsync_purge(cmd_arr)
 
 
@@ -242,14 +290,20 @@ def _make_rsync_purge_cmd():
     if not '--delete' in cmd_rsync:
         cmd_rsync.append('--delete')
 
+    # copy many purge dirs at once, to the same paths under the root
+    # but leave the attributes of their parent dirs alone
+    cmd_rsync.append('--relative')
+    cmd_rsync.append('--no-implied-dirs')
+
     # show the -i and --delete option (in verbose mode)
-    opts += '-i --delete '
+    opts += '-i --delete -R '
     return cmd_rsync, opts
 
 
 def _run_rsync_purge(cmd_arr):
     '''run rsync for purging
     cmd_arr holds already prepared rsync command + arguments
+    The output is handled line by line, as rsync produces it
     Returns: None
     '''
 
@@ -265,40 +319,51 @@ def _run_rsync_purge(cmd_arr):
         error('failed to run command %s: %s' % (cmd_arr[0], err.strerror))
         return
 
-    out, _ = proc.communicate()
+    with proc.stdout:
+        for line in iter(proc.stdout.readline, ''):
+            _purge_output(line, cmd_arr[-1])
+
+    proc.wait()
+
+
+def _purge_output(line, dest_dir):
+    '''handle a line of rsync itemized output'''
 
     if synctool.lib.VERBOSE:
-        print out
+        print line,
 
-    out = out.split('\n')
-    for line in out:
-        line = line.strip()
-        if not line:
-            continue
+    line = line.strip()
+    if not line:
+        return
 
-        code, filename = line.split(' ', 1)
+    if not ' ' in line:
+        stderr(line)
+        return
 
-        if code[:6] == 'ERROR:' or code[:8] == 'WARNING:':
-            # output rsync errors and warnings
-            stderr(line)
-            continue
+    code, filename = line.split(' ', 1)
 
-        if filename == './':
-            # rsync has a habit of displaying ugly "./" path
-            # cmd_arr[-1] is the destination path
-            path = cmd_arr[-1]
-        else:
-            # cmd_arr[-1] is the destination path
-            path = os.path.join(cmd_arr[-1], filename)
-
-        if code[0] == '*':
-            # rsync has a message for us
-            # most likely "deleting"
-            msg = code[1:]
-            msg = msg.strip()
-            stdout('%s %s (purge)' % (msg, prettypath(path)))
-        else:
-            stdout('%s mismatch (purge)' % prettypath(path))
+    if code[:6] == 'ERROR:' or code[:8] == 'WARNING:':
+        # output rsync errors and warnings
+        stderr(line)
+        return
+
+    # "*deleting" is padded with spaces
+    filename = filename.lstrip()
+
+    if filename == './':
+        # rsync has a habit of displaying ugly "./" path
+        path = dest_dir
+    else:
+        path = os.path.join(dest_dir, filename)
+
+    if code[0] == '*':
+        # rsync has a message for us
+        # most likely "deleting"
+        msg = code[1:]
+        msg = msg.strip()
+        stdout('%s %s (purge)' % (msg, prettypath(path)))
+    else:
+        stdout('%s mismatch (purge)' % prettypath(path))
 
 
 def _overlay_callback(obj, pre_dict, post_dict):
@@ -310,15 +375,56 @@ def _overlay_callback(obj, pre_dict, post_dict):
         return generate_template(obj, post_dict), False
 
     verbose('checking %s' % obj.print_src())
-    fixup = obj.check()
+    if synctool.profiler.ENABLED:
+        t_start = time.time()
+        fixup = obj.check()
+        synctool.profiler.add_check(time.time() - t_start, obj.print_src())
+    else:
+        fixup = obj.check()
+
     updated = obj.fix(fixup, pre_dict, post_dict)
     return True, updated
 
 
+def _prefetch_callback(obj, pre_dict, post_dict):
+    '''collect regular files that need their contents compared
+    Returns pair: True (continue), False (not updated)
+    '''
+
+    if obj.ov_type == synctool.overlay.OV_TEMPLATE:
+        # templates are generated during the real run
+        return True, False
+
+    if (not obj.src_stat.is_file() or not obj.dest_stat.is_file() or
+            obj.src_stat.size != obj.dest_stat.size):
+        return True, False
+
+    if (synctool.param.MANIFEST and
+            synctool.manifest.lookup(obj.src_path, obj.dest_path,
+                                     obj.src_stat, obj.dest_stat) is not None):
+        return True, False
+
+    PREFETCH_OBJS.append((obj.src_path, obj.src_stat,
+                          obj.dest_path, obj.dest_stat))
+    return True, False
+
+
 def overlay_files():
     '''run the overlay function'''
 
+    if synctool.param.CLIENT_NUM_PROC > 1:
+        # compare file contents in parallel before doing the real run
+        del PREFETCH_OBJS[:]
+        synctool.overlay.visit(synctool.param.OVERLAY_DIR,
+                               _prefetch_callback, silent=True)
+        verbose('comparing %d files using %d threads' %
+                (len(PREFETCH_OBJS), synctool.param.CLIENT_NUM_PROC))
+        synctool.prefetch.compare(PREFETCH_OBJS,
+                                  synctool.param.CLIENT_NUM_PROC)
+        del PREFETCH_OBJS[:]
+
     synctool.overlay.visit(synctool.param.OVERLAY_DIR, _overlay_callback)
+    synctool.postqueue.run()
 
 
 def _delete_callback(obj, pre_dict, post_dict):
@@ -341,7 +447,7 @@ def _delete_callback(obj, pre_dict, post_dict):
     if obj.dest_stat.exists():
         vnode = obj.vnode_dest_obj()
         vnode.harddelete()
-        obj.run_script(post_dict)
+        obj.queue_script(post_dict)
         return True, True
 
     return True, False
@@ -351,6 +457,7 @@ def delete_files():
     '''run the delete/ dir'''
 
     synctool.overlay.visit(synctool.param.DELETE_DIR, _delete_callback)
+    synctool.postqueue.run()
 
 
 def _erase_saved_callback(obj, pre_dict, post_dict):
@@ -388,7 +495,7 @@ def visit_purge_single(callback):
     purge_groups = os.listdir(synctool.param.PURGE_DIR)
 
     # use a copy of SINGLE_FILES, because the callback will remove items
-    for dest in SINGLE_FILES[:]:
+    for dest in list(SINGLE_FILES):
         filepath = dest
         if filepath[0] == os.sep:
             filepath = filepath[1:]
@@ -412,16 +519,12 @@ def visit_purge_single(callback):
 def _match_single(path):
     '''Returns True if (terse) path is in SINGLE_FILES, else False'''
 
-    if path in SINGLE_FILES:
-        SINGLE_FILES.remove(path)
-        return True
-
-    idx = synctool.lib.terse_match_many(path, SINGLE_FILES)
-    if idx >= 0:
-        del SINGLE_FILES[idx]
-        return True
+    entry = SINGLE_FILES.match(path)
+    if entry is None:
+        return False
 
-    return False
+    SINGLE_FILES.remove(entry)
+    return True
 
 
 def _single_overlay_callback(obj, pre_dict, post_dict):
@@ -502,7 +605,8 @@ def single_files():
     '''check/update a list of single files'''
 
     synctool.overlay.visit(synctool.param.OVERLAY_DIR,
-                           _single_overlay_callback)
+                           _single_overlay_callback,
+                           want_dir=SINGLE_FILES.want_dir)
 
     # For files that were not found, look in the purge/ tree
     # Any overlay-ed files have already been removed from SINGLE_FILES
@@ -513,7 +617,10 @@ def single_files():
         # there are still single files left
         # maybe they are in the delete tree?
         synctool.overlay.visit(synctool.param.DELETE_DIR,
-                               _single_delete_callback)
+                               _single_delete_callback,
+                               want_dir=SINGLE_FILES.want_dir)
+
+    synctool.postqueue.run()
 
     for filename in SINGLE_FILES:
         stderr('%s is not in the overlay tree' % filename)
@@ -554,13 +661,15 @@ def single_erase_saved():
     '''erase single backup files'''
 
     synctool.overlay.visit(synctool.param.OVERLAY_DIR,
-                           _single_erase_saved_callback)
+                           _single_erase_saved_callback,
+                           want_dir=SINGLE_FILES.want_dir)
 
     if len(SINGLE_FILES) > 0:
         # there are still single files left
         # maybe they are in the delete tree?
         synctool.overlay.visit(synctool.param.DELETE_DIR,
-                               _single_erase_saved_callback)
+                               _single_erase_saved_callback,
+                               want_dir=SINGLE_FILES.want_dir)
 
     for filename in SINGLE_FILES:
         stderr('%s is not in the overlay tree' % filename)
@@ -570,10 +679,9 @@ def _reference_callback(obj, pre_dict, post_dict):
     '''callback for reference_files()'''
 
     if obj.ov_type == synctool.overlay.OV_TEMPLATE:
-        if obj.dest_path in SINGLE_FILES:
+        if _match_single(obj.dest_path):
             # this template generates the file
             print obj.print_src()
-            SINGLE_FILES.remove(obj.dest_path)
             if not SINGLE_FILES:
                 return False, False
 
@@ -591,7 +699,8 @@ def _reference_callback(obj, pre_dict, post_dict):
 def reference_files():
     '''show which source file in the repository synctool uses'''
 
-    synctool.overlay.visit(synctool.param.OVERLAY_DIR, _reference_callback)
+    synctool.overlay.visit(synctool.param.OVERLAY_DIR, _reference_callback,
+                           want_dir=SINGLE_FILES.want_dir)
 
     # look in the purge/ tree, too
     visit_purge_single(_reference_callback)
@@ -630,7 +739,8 @@ def _diff_callback(obj, pre_dict, post_dict):
 def diff_files():
     '''display a diff of the single files'''
 
-    synctool.overlay.visit(synctool.param.OVERLAY_DIR, _diff_callback)
+    synctool.overlay.visit(synctool.param.OVERLAY_DIR, _diff_callback,
+                           want_dir=SINGLE_FILES.want_dir)
 
     # look in the purge/ tree, too
     visit_purge_single(_diff_callback)
@@ -709,9 +819,13 @@ def usage():
     print '''  -d, --diff=FILE       Show diff for file
   -1, --single=PATH     Update a single file
   -r, --ref=PATH        Show which source file synctool chooses
+      --files-from=FILE Read paths for --single, --diff or --ref from FILE
+                        ('-' reads from stdin)
   -e, --erase-saved     Erase *.saved backup files
   -f, --fix             Perform updates (otherwise, do dry-run)
+  -N, --numproc=NUM     Number of threads for comparing files
       --no-post         Do not run any .post scripts
+      --profile         Show time spent per phase
   -F, --fullpath        Show full paths instead of shortened ones
   -T, --terse           Show terse, shortened paths
       --color           Use colored output (only for terse mode)
@@ -728,17 +842,18 @@ Note that synctool does a dry run unless you specify --fix
 def get_options():
     '''parse command-line options'''
 
-    global SINGLE_FILES
+    global SINGLE_FILES, OPT_PLAN
 
     # check for dangerous common typo's on the command-line
     be_careful_with_getopt()
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'hc:d:1:r:efFTvq',
+        opts, args = getopt.getopt(sys.argv[1:], 'hc:d:1:r:efN:FTvq',
             ['help', 'conf=', 'diff=', 'single=', 'ref=',
-            'erase-saved', 'fix', 'no-post', 'fullpath',
+            'erase-saved', 'fix', 'no-post', 'numproc=', 'fullpath',
             'terse', 'color', 'no-color', 'masterlog', 'nodename=',
-            'verbose', 'quiet', 'unix', 'version'])
+            'plan=', 'files-from=', 'verbose', 'quiet', 'unix', 'version',
+            'profile'])
     except getopt.GetoptError as reason:
         print '%s: %s' % (PROGNAME, reason)
         usage()
@@ -792,7 +907,9 @@ def get_options():
     errors = 0
 
     action = ACTION_DEFAULT
-    SINGLE_FILES = []
+    SINGLE_FILES = synctool.pathindex.PathIndex()
+    opt_profile = False
+    files_from = None
 
     # these are only used for checking the validity of option combinations
     opt_diff = False
@@ -818,6 +935,19 @@ def get_options():
             synctool.lib.NO_POST = True
             continue
 
+        if opt in ('-N', '--numproc'):
+            try:
+                synctool.param.CLIENT_NUM_PROC = int(arg)
+            except ValueError:
+                print "option '%s' requires a numeric value" % opt
+                sys.exit(1)
+
+            if synctool.param.CLIENT_NUM_PROC < 1:
+                print 'invalid value for numproc'
+                sys.exit(1)
+
+            continue
+
         if opt == '--color':
             synctool.param.COLORIZE = True
             continue
@@ -848,6 +978,15 @@ def get_options():
             synctool.param.NODENAME = arg
             continue
 
+        if opt == '--plan':
+            # used by the master to pass the resolved overlay plan
+            OPT_PLAN = arg
+            continue
+
+        if opt == '--profile':
+            opt_profile = True
+            continue
+
         if opt in ('-d', '--diff'):
             opt_diff = True
             action = ACTION_DIFF
@@ -860,8 +999,7 @@ def get_options():
                 error('filename must be a full path, starting with a slash')
                 sys.exit(1)
 
-            if not filename in SINGLE_FILES:
-                SINGLE_FILES.append(filename)
+            SINGLE_FILES.add(filename)
             continue
 
         if opt in ('-1', '--single'):
@@ -875,8 +1013,7 @@ def get_options():
                 error('filename must be a full path, starting with a slash')
                 sys.exit(1)
 
-            if not filename in SINGLE_FILES:
-                SINGLE_FILES.append(filename)
+            SINGLE_FILES.add(filename)
             continue
 
         if opt in ('-r', '--ref', '--reference'):
@@ -891,8 +1028,7 @@ def get_options():
                 error('filename must be a full path, starting with a slash')
                 sys.exit(1)
 
-            if not filename in SINGLE_FILES:
-                SINGLE_FILES.append(filename)
+            SINGLE_FILES.add(filename)
             continue
 
         if opt in ('-e', '--erase-saved'):
@@ -900,6 +1036,10 @@ def get_options():
             action = ACTION_ERASE_SAVED
             continue
 
+        if opt == '--files-from':
+            files_from = arg
+            continue
+
         error("unknown command line option '%s'" % opt)
         errors += 1
 
@@ -907,8 +1047,22 @@ def get_options():
         usage()
         sys.exit(1)
 
+    if files_from is not None:
+        paths = synctool.lib.read_path_list(files_from)
+        if paths is None:
+            sys.exit(1)
+
+        for filename in paths:
+            SINGLE_FILES.add(filename)
+
+        # the paths are for --single, unless another action was given
+        if action == ACTION_DEFAULT:
+            opt_single = True
+
     option_combinations(opt_diff, opt_single, opt_reference, opt_erase_saved,
                         opt_upload, opt_suffix, opt_fix)
+
+    synctool.profiler.init(opt_profile)
     return action
 
 
@@ -981,6 +1135,10 @@ def main():
     os.environ['SYNCTOOL_NODE'] = synctool.param.NODENAME
     os.environ['SYNCTOOL_ROOT'] = synctool.param.ROOTDIR
 
+    if OPT_PLAN:
+        # without a plan, the overlay trees are walked
+        synctool.plan.load(OPT_PLAN)
+
     unix_out('umask 077')
     unix_out('')
     os.umask(077)
@@ -998,12 +1156,28 @@ def main():
             erase_saved()
 
     elif len(SINGLE_FILES) > 0:
-        single_files()
+        with synctool.profiler.Phase('single'):
+            single_files()
 
     else:
-        purge_files()
-        overlay_files()
-        delete_files()
+        with synctool.profiler.Phase('purge'):
+            purge_files()
+
+        with synctool.profiler.Phase('overlay'):
+            overlay_files()
+
+        with synctool.profiler.Phase('delete'):
+            delete_files()
+
+        # a full run visited all files; forget about any others
+        synctool.manifest.save(prune=True)
+        if synctool.param.TEMPLATE_CACHE and not synctool.lib.NO_POST:
+            synctool.templatecache.prune()
+
+    # save checksums that were taken during --single, --diff runs
+    synctool.manifest.save()
+
+    synctool.profiler.finish()
 
     unix_out('# EOB')
 
@@ -67,10 +67,9 @@ def list_all_nodes():
     nodes.sort()
 
     for node in nodes:
-        ignored = set(synctool.config.get_groups(node))
-        ignored &= synctool.param.IGNORE_GROUPS
+        ignored = synctool.config.is_ignored(node)
 
-        if OPT_FILTER_IGNORED and len(ignored) > 0:
+        if OPT_FILTER_IGNORED and ignored:
             continue
 
         if OPT_IPADDRESS:
@@ -85,7 +84,7 @@ def list_all_nodes():
             else:
                 node += ' yes'
 
-        if len(ignored) > 0:
+        if ignored:
             node += ' (ignored)'
 
         print node
@@ -179,10 +178,9 @@ def list_nodegroups(grouplist):
     arr.sort()
 
     for node in arr:
-        ignored = set(synctool.config.get_groups(node))
-        ignored &= synctool.param.IGNORE_GROUPS
+        ignored = synctool.config.is_ignored(node)
 
-        if OPT_FILTER_IGNORED and len(ignored) > 0:
+        if OPT_FILTER_IGNORED and ignored:
             continue
 
         if OPT_IPADDRESS:
@@ -197,7 +195,7 @@ def list_nodegroups(grouplist):
             else:
                 node += ' yes'
 
-        if len(ignored) > 0:
+        if ignored:
             node += ' (ignored)'
 
         print node
@@ -24,6 +24,7 @@ import synctool.multiplex
 import synctool.nodeset
 import synctool.parallel
 import synctool.param
+import synctool.reactor
 import synctool.unbuffered
 
 # hardcoded name because otherwise we get "dsh.py"
@@ -98,11 +99,18 @@ def run_dsh(address_list, remote_cmd_arr):
 
     REMOTE_CMD_ARR = remote_cmd_arr
 
-    synctool.parallel.do(worker_ssh, address_list)
+    # start any missing ssh master connections (if configured)
+    synctool.multiplex.auto_master([(addr,
+                                     NODESET.get_nodename_from_address(addr))
+                                    for addr in address_list])
+
+    synctool.reactor.do(worker_ssh, address_list)
 
 
 def worker_ssh(addr):
-    '''worker process: sync script and run ssh+command to the node'''
+    '''sync script and run ssh+command to the node
+    This is a job for synctool.reactor
+    '''
 
     # Note that this func even runs ssh to the local node if
     # the master is also managed by synctool
@@ -138,7 +146,7 @@ def worker_ssh(addr):
         cmd_arr.append('--')
         cmd_arr.append('%s' % REMOTE_CMD_ARR[0])
         cmd_arr.append('%s:%s' % (addr, REMOTE_CMD_ARR[0]))
-        synctool.lib.run_with_nodename(cmd_arr, nodename)
+        yield synctool.reactor.Command(cmd_arr, nodename)
 
     cmd_str = ' '.join(REMOTE_CMD_ARR)
 
@@ -163,9 +171,9 @@ def worker_ssh(addr):
         print nodename + ': ',
         synctool.lib.exec_command(ssh_cmd_arr)
     else:
-        # run_with_nodename() shows the nodename, but
-        # does not expect any prompts while running the cmd
-        synctool.lib.run_with_nodename(ssh_cmd_arr, nodename)
+        # the output is shown with the nodename, but
+        # it does not expect any prompts while running the cmd
+        yield synctool.reactor.Command(ssh_cmd_arr, nodename)
 
 
 def start_multiplex(address_list):
@@ -22,8 +22,8 @@ from synctool.lib import stdout, error, unix_out
 import synctool.multiplex
 from synctool.main.wrapper import catch_signals
 import synctool.nodeset
-import synctool.parallel
 import synctool.param
+import synctool.reactor
 import synctool.unbuffered
 
 # hardcoded name because otherwise we get "dsh_cp.py"
@@ -92,11 +92,18 @@ def run_remote_copy(address_list, files):
     if DSH_CP_OPTIONS:
         DSH_CP_CMD_ARR.extend(shlex.split(DSH_CP_OPTIONS))
 
-    synctool.parallel.do(worker_dsh_cp, address_list)
+    # start any missing ssh master connections (if configured)
+    synctool.multiplex.auto_master([(addr,
+                                     NODESET.get_nodename_from_address(addr))
+                                    for addr in address_list])
+
+    synctool.reactor.do(worker_dsh_cp, address_list)
 
 
 def worker_dsh_cp(addr):
-    '''do remote copy to node'''
+    '''do remote copy to node
+    This is a job for synctool.reactor
+    '''
 
     nodename = NODESET.get_nodename_from_address(addr)
     if nodename == synctool.param.NODENAME:
@@ -130,7 +137,7 @@ def worker_dsh_cp(addr):
     stdout(msg)
 
     if not synctool.lib.DRY_RUN:
-        synctool.lib.run_with_nodename(dsh_cp_cmd_arr, nodename)
+        yield synctool.reactor.Command(dsh_cp_cmd_arr, nodename)
     else:
         unix_out(' '.join(dsh_cp_cmd_arr) + '    # dry run')
 
@@ -23,8 +23,8 @@ from synctool.lib import verbose, error
 import synctool.multiplex
 from synctool.main.wrapper import catch_signals
 import synctool.nodeset
-import synctool.parallel
 import synctool.param
+import synctool.reactor
 import synctool.unbuffered
 
 # hardcoded name because otherwise we get "dsh_pkg.py"
@@ -54,11 +54,18 @@ def run_remote_pkg(address_list):
         if '-T' in SSH_CMD_ARR:
             SSH_CMD_ARR.remove('-T')
 
-    synctool.parallel.do(worker_pkg, address_list)
+    # start any missing ssh master connections (if configured)
+    synctool.multiplex.auto_master([(addr,
+                                     NODESET.get_nodename_from_address(addr))
+                                    for addr in address_list])
+
+    synctool.reactor.do(worker_pkg, address_list)
 
 
 def worker_pkg(addr):
-    '''runs ssh + synctool-pkg to the nodes in parallel'''
+    '''runs ssh + synctool-pkg to the nodes in parallel
+    This is a job for synctool.reactor
+    '''
 
     nodename = NODESET.get_nodename_from_address(addr)
 
@@ -85,9 +92,9 @@ def worker_pkg(addr):
         print nodename + ': ',
         synctool.lib.exec_command(cmd_arr)
     else:
-        # run_with_nodename() shows the nodename, but
-        # does not expect any prompts while running the cmd
-        synctool.lib.run_with_nodename(cmd_arr, nodename)
+        # the output is shown with the nodename, but
+        # it does not expect any prompts while running the cmd
+        yield synctool.reactor.Command(cmd_arr, nodename)
 
 
 def rearrange_options():
@@ -16,7 +16,10 @@ import os
 import sys
 import getopt
 import shlex
+import shutil
+import hashlib
 import tempfile
+import time
 
 import synctool.aggr
 import synctool.config
@@ -27,8 +30,10 @@ import synctool.multiplex
 from synctool.main.wrapper import catch_signals
 import synctool.nodeset
 import synctool.overlay
-import synctool.parallel
 import synctool.param
+import synctool.plan
+import synctool.reactor
+import synctool.report
 import synctool.syncstat
 import synctool.unbuffered
 import synctool.update
@@ -43,45 +48,129 @@ OPT_SKIP_RSYNC = False
 OPT_AGGREGATE = False
 OPT_CHECK_UPDATE = False
 OPT_DOWNLOAD = False
+OPT_REPORT = False
 
 PASS_ARGS = None
 MASTER_OPTS = None
 
 UPLOAD_FILE = None
 
+# paths given with --files-from, and the file that passes them to the nodes
+FILES_FROM_PATHS = None
+FILES_FROM = None
+
+# rsync filter files are kept here during a run
+FILTER_DIR = None
+# dict of filter filenames by group signature
+FILTERS = {}
+# dict of plan names by nodename (see synctool.plan)
+PLANS = {}
+# sets of group dirs in the repository:
+#   (overlay, delete, purge, purge groups in error)
+REPO_GROUPS = None
+
 
 def run_remote_synctool(address_list):
     '''run synctool on target nodes'''
 
-    synctool.parallel.do(worker_synctool, address_list)
+    if synctool.param.SHARE_SSH_SESSION:
+        # detect the ssh version once, before forking the workers
+        synctool.multiplex.detect_ssh()
+
+    # start any missing ssh master connections (if configured)
+    node_list = []
+    for addr in address_list:
+        nodename = NODESET.get_nodename_from_address(addr)
+        # the master node itself is not contacted over ssh
+        if nodename != synctool.param.NODENAME:
+            node_list.append((addr, nodename))
+
+    synctool.multiplex.auto_master(node_list)
+
+    if not OPT_SKIP_RSYNC:
+        make_plans(address_list)
+
+        if not make_rsync_filters(address_list):
+            cleanup_rsync_filters()
+            sys.exit(-1)
+
+    if FILES_FROM_PATHS is not None and not make_files_from():
+        cleanup_rsync_filters()
+        sys.exit(-1)
+
+    if OPT_REPORT and not synctool.report.start():
+        cleanup_rsync_filters()
+        cleanup_files_from()
+        sys.exit(-1)
+
+    synctool.reactor.do(worker_synctool, address_list)
+
+    cleanup_rsync_filters()
+    cleanup_files_from()
+    synctool.report.finish()
 
 
 def worker_synctool(addr):
-    '''run rsync of ROOTDIR to the nodes and ssh+synctool, in parallel'''
+    '''run rsync of ROOTDIR to the nodes and ssh+synctool, in parallel
+    This is a job for synctool.reactor
+    '''
 
     nodename = NODESET.get_nodename_from_address(addr)
 
+    # timings for the report
+    rec = {'address': addr}
+    t_start = time.time()
+
     if nodename == synctool.param.NODENAME:
-        run_local_synctool()
+        rec['client_exit'] = yield run_local_synctool()
+        rec['client_time'] = rec['total_time'] = time.time() - t_start
+        if OPT_REPORT:
+            synctool.report.record(nodename, rec)
         return
 
+    # rsync ROOTDIR/dirs/ to the node
+    # if "it wants it"
+    do_rsync = not (OPT_SKIP_RSYNC or nodename in synctool.param.NO_RSYNC)
+    if do_rsync:
+        # get rsync filter to include the correct dirs
+        filter_filename = rsync_include_filter(nodename)
+        if filter_filename is None:
+            # error message already printed
+            return
+
     # use ssh connection multiplexing (if possible)
     use_multiplex = synctool.multiplex.use_mux(nodename, addr)
 
+    # without a master connection, rsync and synctool-client would
+    # each do an ssh handshake; let them share a single session instead
+    use_session = False
+    if (not use_multiplex and do_rsync and
+            synctool.param.SHARE_SSH_SESSION):
+        cmd_arr = synctool.multiplex.start_session_cmd(nodename, addr)
+        if cmd_arr is not None:
+            t_phase = time.time()
+            exitcode = yield synctool.reactor.Command(cmd_arr, nodename,
+                                                      quiet=True)
+            rec['session_time'] = time.time() - t_phase
+            use_session = (exitcode == 0 and
+                           synctool.multiplex.session_started(nodename))
+
     ssh_cmd_arr = shlex.split(synctool.param.SSH_CMD)
     if use_multiplex:
         synctool.multiplex.ssh_args(ssh_cmd_arr, nodename)
+    elif use_session:
+        synctool.multiplex.session_args(ssh_cmd_arr, nodename)
 
-    # rsync ROOTDIR/dirs/ to the node
-    # if "it wants it"
-    if not (OPT_SKIP_RSYNC or nodename in synctool.param.NO_RSYNC):
+    if do_rsync:
         verbose('running rsync $SYNCTOOL/ to node %s' % nodename)
 
-        # make rsync filter to include the correct dirs
-        tmp_filename = rsync_include_filter(nodename)
-
         cmd_arr = shlex.split(synctool.param.RSYNC_CMD)
-        cmd_arr.append('--filter=. %s' % tmp_filename)
+        cmd_arr.append('--filter=. %s' % filter_filename)
+
+        if OPT_REPORT:
+            # rsync logs the number of bytes transferred
+            cmd_arr.append('--log-file=%s' %
+                           synctool.report.rsync_logfile(nodename))
 
         # add "-e ssh_cmd" to rsync command
         cmd_arr.extend(['-e', ' '.join(ssh_cmd_arr)])
@@ -98,14 +187,9 @@ def worker_synctool(addr):
                     synctool.param.ROOTDIR)
             sys.exit(-1)
 
-        synctool.lib.run_with_nodename(cmd_arr, nodename)
-
-        # delete temp file
-        try:
-            os.unlink(tmp_filename)
-        except OSError:
-            # silently ignore unlink error
-            pass
+        t_phase = time.time()
+        rec['rsync_exit'] = yield synctool.reactor.Command(cmd_arr, nodename)
+        rec['rsync_time'] = time.time() - t_phase
 
     # run 'ssh node synctool_cmd'
     cmd_arr = ssh_cmd_arr[:]
@@ -113,145 +197,271 @@ def worker_synctool(addr):
     cmd_arr.append(addr)
     cmd_arr.extend(shlex.split(synctool.param.SYNCTOOL_CMD))
     cmd_arr.append('--nodename=%s' % nodename)
+    if do_rsync and nodename in PLANS:
+        cmd_arr.append('--plan=%s' % PLANS[nodename])
     cmd_arr.extend(PASS_ARGS)
 
     verbose('running synctool on node %s' % nodename)
-    synctool.lib.run_with_nodename(cmd_arr, nodename)
+    t_phase = time.time()
+    rec['client_exit'] = yield synctool.reactor.Command(cmd_arr, nodename,
+                                                        stdin=FILES_FROM)
+    rec['client_time'] = time.time() - t_phase
+
+    if use_session:
+        cmd_arr = synctool.multiplex.end_session_cmd(nodename, addr)
+        if cmd_arr is not None:
+            yield synctool.reactor.Command(cmd_arr, nodename, quiet=True)
+
+    rec['total_time'] = time.time() - t_start
+    if OPT_REPORT:
+        synctool.report.record(nodename, rec)
 
 
 def run_local_synctool():
-    '''run synctool on the master node itself'''
+    '''Returns command for running synctool on the master node itself'''
 
-    cmd_arr = shlex.split(synctool.param.SYNCTOOL_CMD) + PASS_ARGS
+    cmd_arr = shlex.split(synctool.param.SYNCTOOL_CMD)
+    if synctool.param.NODENAME in PLANS:
+        cmd_arr.append('--plan=%s' % PLANS[synctool.param.NODENAME])
+    cmd_arr.extend(PASS_ARGS)
 
     verbose('running synctool on node %s' % synctool.param.NODENAME)
-    synctool.lib.run_with_nodename(cmd_arr, synctool.param.NODENAME)
+    return synctool.reactor.Command(cmd_arr, synctool.param.NODENAME,
+                                    stdin=FILES_FROM)
 
 
-def rsync_include_filter(nodename):
-    '''create temp file with rsync filter rules
-    Include only those dirs that apply for this node
-    Returns filename of the filter file
+def _group_dirs(overlaydir):
+    '''Returns set of group dirs directly under overlaydir'''
+
+    groups = set()
+    for entry in os.listdir(overlaydir):
+        if os.path.isdir(os.path.join(overlaydir, entry)):
+            groups.add(entry)
+
+    return groups
+
+
+def _purge_group_dirs():
+    '''Returns pair of sets of groups under purge/:
+    (groups that have something to purge, groups in error)
     '''
 
-    try:
-        (fd, filename) = tempfile.mkstemp(prefix='synctool-',
-                                          dir=synctool.param.TEMP_DIR)
-    except OSError as err:
-        error('failed to create temp file: %s' % err.strerror)
-        sys.exit(-1)
+    groups = set()
+    bad_groups = set()
+    for g in _group_dirs(synctool.param.PURGE_DIR):
+        purge_root = os.path.join(synctool.param.PURGE_DIR, g)
+
+        for path, _, files in os.walk(purge_root):
+            if path == purge_root:
+                # guard against user mistakes;
+                # danger of destroying the entire filesystem
+                # if it would rsync --delete the root
+                if len(files) > 0:
+                    bad_groups.add(g)
+                    break
+            else:
+                groups.add(g)
+                break
 
-    try:
-        f = os.fdopen(fd, 'w')
-    except OSError as err:
-        error('failed to open temp file: %s' % err.strerror)
-        sys.exit(-1)
+    return groups, bad_groups
 
-    # include $SYNCTOOL/var/ but exclude
-    # the top overlay/ and delete/ dir
-    with f:
-        f.write('# synctool rsync filter')
 
-        # set mygroups for this nodename
-        synctool.param.NODENAME = nodename
-        synctool.param.MY_GROUPS = synctool.config.get_my_groups()
+def make_files_from():
+    '''write the paths given with --files-from to a temp file
+    The clients read the list from stdin
+    Returns False on error
+    '''
 
-        # slave nodes get a copy of the entire tree
-        # all other nodes use a specific rsync filter
-        if not nodename in synctool.param.SLAVES:
-            if not (_write_overlay_filter(f) and
-                    _write_delete_filter(f) and
-                    _write_purge_filter(f)):
-                # an error occurred;
-                # delete temp file and exit
-                f.close()
-                try:
-                    os.unlink(filename)
-                except OSError:
-                    # silently ignore unlink error
-                    pass
+    global FILES_FROM
 
-                sys.exit(-1)
+    try:
+        fd, FILES_FROM = tempfile.mkstemp(prefix='synctool-files-',
+                                          dir=synctool.param.TEMP_DIR)
+        with os.fdopen(fd, 'w') as f:
+            for path in FILES_FROM_PATHS:
+                f.write(path + '\n')
+    except (IOError, OSError) as err:
+        error('failed to write temp file: %s' % err.strerror)
+        cleanup_files_from()
+        return False
 
-        # Note: sbin/*.pyc is excluded to keep major differences in
-        # Python versions (on master vs. client node) from clashing
-        f.write('- /sbin/*.pyc\n'
-                '- /lib/synctool/*.pyc\n'
-                '- /lib/synctool/pkg/*.pyc\n')
+    return True
 
-    # Note: remind to delete the temp file later
 
-    return filename
+def cleanup_files_from():
+    '''delete the temp file made by make_files_from()'''
 
+    if FILES_FROM is None:
+        return
 
-def _write_rsync_filter(f, overlaydir, label):
-    '''helper function for writing rsync filter'''
+    try:
+        os.unlink(FILES_FROM)
+    except OSError:
+        pass
 
-    f.write('+ /var/%s/\n' % label)
 
-    groups = os.listdir(overlaydir)
+def make_plans(address_list):
+    '''make the plans for all nodes in address_list
+    This is done before forking, like the rsync filters
+    Without plans, the nodes walk the overlay trees themselves
+    '''
 
-    # add only the group dirs that apply
-    for g in synctool.param.MY_GROUPS:
-        if g in groups:
-            d = os.path.join(overlaydir, g)
-            if os.path.isdir(d):
-                f.write('+ /var/%s/%s/\n' % (label, g))
+    global PLANS
 
-    f.write('- /var/%s/*\n' % label)
+    nodenames = [NODESET.get_nodename_from_address(addr)
+                 for addr in address_list]
+    plans = synctool.plan.make_plans(nodenames)
+    if plans is not None:
+        PLANS = plans
 
 
-def _write_overlay_filter(f):
-    '''write rsync filter rules for overlay/ tree
+def make_rsync_filters(address_list):
+    '''create the rsync filter files for all nodes in address_list
+    Nodes that have the same groups in the repository get the same
+    filter, so there are typically only a few filter files
+    This is done before forking, so that all workers share the filters
+    The files are kept in FILTER_DIR until cleanup_rsync_filters()
     Returns False on error
     '''
 
-    _write_rsync_filter(f, synctool.param.OVERLAY_DIR, 'overlay')
+    global FILTER_DIR, REPO_GROUPS
+
+    # the repository is scanned only once per run
+    overlay_groups = _group_dirs(synctool.param.OVERLAY_DIR)
+    delete_groups = _group_dirs(synctool.param.DELETE_DIR)
+    purge_groups, bad_purge_groups = _purge_group_dirs()
+
+    REPO_GROUPS = (overlay_groups, delete_groups, purge_groups,
+                   bad_purge_groups)
+
+    try:
+        FILTER_DIR = tempfile.mkdtemp(prefix='synctool-',
+                                      dir=synctool.param.TEMP_DIR)
+    except OSError as err:
+        error('failed to create temp dir: %s' % err.strerror)
+        return False
+
+    for addr in address_list:
+        nodename = NODESET.get_nodename_from_address(addr)
+        if (nodename == synctool.param.NODENAME or
+                nodename in synctool.param.NO_RSYNC):
+            continue
+
+        # the filter is None for nodes with errors
+        # workers will skip those nodes
+        rsync_include_filter(nodename)
+
+    verbose('made %d rsync filters for %d distinct group signatures' %
+            (len(set(FILTERS.values()) - set([None])), len(FILTERS)))
     return True
 
 
-def _write_delete_filter(f):
-    '''write rsync filter rules for delete/ tree
-    Returns False on error
+def cleanup_rsync_filters():
+    '''delete the rsync filter files'''
+
+    if FILTER_DIR is None:
+        return
+
+    shutil.rmtree(FILTER_DIR, ignore_errors=True)
+
+
+def _filter_signature(nodename):
+    '''Returns the key for the rsync filter of nodename
+    Only the groups that are present in the repository matter
     '''
 
-    _write_rsync_filter(f, synctool.param.DELETE_DIR, 'delete')
-    return True
+    if nodename in synctool.param.SLAVES:
+        # slave nodes get a copy of the entire tree
+        return (True, (), None)
 
+    groups = synctool.param.NODES.get(nodename, [])
+    return (False, tuple([g for g in groups
+                          if any(g in x for x in REPO_GROUPS)]),
+            PLANS.get(nodename))
 
-def _write_purge_filter(f):
-    '''write rsync filter rules for purge/ tree
-    Returns False on error
+
+def rsync_include_filter(nodename):
+    '''get file with rsync filter rules
+    Include only those dirs that apply for this node
+    Returns filename of the filter file, or None on error
     '''
 
-    f.write('+ /var/purge/\n')
+    signature = _filter_signature(nodename)
+    if signature in FILTERS:
+        return FILTERS[signature]
 
-    purge_groups = os.listdir(synctool.param.PURGE_DIR)
+    is_slave, groups, plan = signature
 
-    # add only the group dirs that apply
-    for g in synctool.param.MY_GROUPS:
-        if g in purge_groups:
-            purge_root = os.path.join(synctool.param.PURGE_DIR, g)
-            if not os.path.isdir(purge_root):
-                continue
+    # include $SYNCTOOL/var/ but exclude
+    # the top overlay/ and delete/ dir
+    rules = ['# synctool rsync filter\n']
+
+    # all other nodes than slaves use a specific rsync filter
+    if not is_slave:
+        (overlay_groups, delete_groups, purge_groups,
+         bad_purge_groups) = REPO_GROUPS
+
+        for g in groups:
+            if g in bad_purge_groups:
+                warning('cowardly refusing to purge the root directory')
+                stderr('please remove any files directly under %s/' %
+                       prettypath(os.path.join(synctool.param.PURGE_DIR,
+                                               g)))
+                FILTERS[signature] = None
+                return None
+
+        _write_rsync_filter(rules, groups, overlay_groups, 'overlay')
+        _write_rsync_filter(rules, groups, delete_groups, 'delete')
+        _write_rsync_filter(rules, groups, purge_groups, 'purge')
+
+        # include only the plan of this node
+        rules.append('+ /var/plan/\n')
+        if plan is not None:
+            rules.append('+ /var/plan/%s\n' % plan)
+        rules.append('- /var/plan/*\n')
+
+    # Note: sbin/*.pyc is excluded to keep major differences in
+    # Python versions (on master vs. client node) from clashing
+    rules.append('- /sbin/*.pyc\n'
+                 '- /lib/synctool/*.pyc\n'
+                 '- /lib/synctool/pkg/*.pyc\n')
+
+    # the cache dir belongs to the node itself;
+    # do not send the master's cache, and do not delete the node's
+    rules.append('H /var/cache/\n'
+                 'P /var/cache/\n')
+
+    data = ''.join(rules)
+
+    # identical filters share the same file
+    filename = os.path.join(FILTER_DIR, hashlib.md5(data).hexdigest())
+    if not os.path.exists(filename):
+        try:
+            f = open(filename, 'w')
+        except IOError as err:
+            error('failed to create temp file: %s' % err.strerror)
+            return None
 
-            for path, _, files in os.walk(purge_root):
-                if path == purge_root:
-                    # guard against user mistakes;
-                    # danger of destroying the entire filesystem
-                    # if it would rsync --delete the root
-                    if len(files) > 0:
-                        warning('cowardly refusing to purge the root '
-                                'directory')
-                        stderr('please remove any files directly '
-                               'under %s/' % prettypath(purge_root))
-                        return False
-                else:
-                    f.write('+ /var/purge/%s/' % g)
-                    break
+        with f:
+            f.write(data)
 
-    f.write('- /var/purge/*\n')
-    return True
+    FILTERS[signature] = filename
+    return filename
+
+
+def _write_rsync_filter(rules, groups, repo_groups, label):
+    '''helper function for writing rsync filter
+    Append rules to list 'rules'
+    '''
+
+    rules.append('+ /var/%s/\n' % label)
+
+    # add only the group dirs that apply
+    for g in groups:
+        if g in repo_groups:
+            rules.append('+ /var/%s/%s/\n' % (label, g))
+
+    rules.append('- /var/%s/*\n' % label)
 
 
 def make_tempdir():
@@ -413,6 +623,8 @@ def usage():
   -d, --diff=FILE             Show diff for file
   -1, --single=PATH           Update a single file
   -r, --ref=PATH              Show which source file synctool chooses
+      --files-from=FILE       Read paths for --single, --diff or --ref
+                              from FILE ('-' reads from stdin)
   -u, --upload=PATH           Pull a remote file into the overlay tree
   -s, --suffix=GROUP          Give group suffix for the uploaded file
   -o, --overlay=GROUP         Upload file to $overlay/group/
@@ -425,6 +637,8 @@ def usage():
       --color                 Use colored output (only for terse mode)
       --no-color              Do not color output
   -S, --skip-rsync            Do not sync the repository
+      --report                Report timings of the slowest nodes
+      --profile               Show time spent per phase on the nodes
       --version               Show current version number
       --check-update          Check for availibility of newer version
       --download              Download latest version
@@ -443,8 +657,8 @@ def get_options():
     '''parse command-line options'''
 
     global PASS_ARGS, OPT_SKIP_RSYNC, OPT_AGGREGATE
-    global OPT_CHECK_UPDATE, OPT_DOWNLOAD, MASTER_OPTS
-    global UPLOAD_FILE
+    global OPT_CHECK_UPDATE, OPT_DOWNLOAD, OPT_REPORT, MASTER_OPTS
+    global UPLOAD_FILE, FILES_FROM_PATHS
 
     # check for typo's on the command-line;
     # things like "-diff" will trigger "-f" => "--fix"
@@ -457,8 +671,8 @@ def get_options():
             'exclude=', 'exclude-group=', 'diff=', 'single=', 'ref=',
             'upload=', 'suffix=', 'overlay=', 'purge=', 'erase-saved', 'fix',
             'no-post', 'numproc=', 'fullpath', 'terse', 'color', 'no-color',
-            'quiet', 'aggregate', 'unix', 'skip-rsync',
-            'version', 'check-update', 'download'])
+            'quiet', 'aggregate', 'unix', 'skip-rsync', 'report', 'profile',
+            'version', 'check-update', 'download', 'files-from='])
     except getopt.GetoptError as reason:
         print '%s: %s' % (PROGNAME, reason)
 #        usage()
@@ -600,6 +814,13 @@ def get_options():
         if opt in ('-e', '--erase-saved'):
             opt_erase_saved = True
 
+        if opt == '--files-from':
+            # the list is read only once, and passed on to the nodes
+            FILES_FROM_PATHS = synctool.lib.read_path_list(arg)
+            if FILES_FROM_PATHS is None:
+                sys.exit(1)
+            continue
+
         if opt in ('-q', '--quiet'):
             synctool.lib.QUIET = True
 
@@ -648,6 +869,10 @@ def get_options():
             OPT_SKIP_RSYNC = True
             continue
 
+        if opt == '--report':
+            OPT_REPORT = True
+            continue
+
         if opt == '--check-update':
             OPT_CHECK_UPDATE = True
             continue
@@ -684,6 +909,13 @@ def get_options():
             print 'option --suffix and --purge can not be combined'
             sys.exit(1)
 
+    if FILES_FROM_PATHS is not None:
+        PASS_ARGS.append('--files-from=-')
+
+        # the paths are for --single, unless another action was given
+        if not (opt_diff or opt_reference or opt_erase_saved):
+            opt_single = True
+
     # enable logging at the master node
     PASS_ARGS.append('--masterlog')
 
@@ -725,7 +957,20 @@ def main():
         sys.exit(0)
 
     if OPT_AGGREGATE:
-        if not synctool.aggr.run(MASTER_OPTS):
+        if FILES_FROM_PATHS is not None:
+            # the paths were already read (maybe from stdin);
+            # pass them on to the child process in a temp file
+            make_tempdir()
+            if not make_files_from():
+                sys.exit(-1)
+
+            for idx in xrange(1, len(MASTER_OPTS) - 1):
+                if MASTER_OPTS[idx] == '--files-from':
+                    MASTER_OPTS[idx + 1] = FILES_FROM
+
+        ok = synctool.aggr.run(MASTER_OPTS)
+        cleanup_files_from()
+        if not ok:
             sys.exit(-1)
 
         sys.exit(0)
@@ -11,12 +11,14 @@
 '''synctool-template is a helper program for generating templates
 - auto replace "@VAR@" in the input text
 - You can do the same thing with m4 or sed, but this one is nice and easy
+- in batch mode, it generates many files in one go
 '''
 
 import os
 import sys
 import re
 import getopt
+import shlex
 
 from synctool.main.wrapper import catch_signals
 
@@ -26,6 +28,9 @@ PROGNAME = 'synctool-template'
 SPELLCHECK = re.compile(r'[A-Z_][A-Z0-9_]*')
 PATTERN = re.compile(r'\@([A-Z_][A-Z0-9_]*)\@')
 
+# compiled templates by filename, for batch mode
+COMPILED = {}
+
 
 def spellcheck(name):
     '''Check for valid spelling of name
@@ -42,21 +47,57 @@ def spellcheck(name):
     return True
 
 
-def subst(line):
-    '''replace all occurrences of "@VAR@" with the value,
-    where VAR is any environment variable
-    Returns the resulting line of text
+def compile_template(text):
+    '''split template text into literal text and variables
+    Returns list of strings: the odd elements are variable names
+    '''
+
+    return PATTERN.split(text)
+
+
+def render(parts, f, env=None):
+    '''write compiled template to file f
+    Variables that are not set are written as "@VAR@"
+    '''
+
+    if env is None:
+        env = os.environ
+
+    for idx, part in enumerate(parts):
+        if idx & 1:
+            if part in env:
+                f.write(env[part])
+            else:
+                f.write('@%s@' % part)
+        elif part:
+            f.write(part)
+
+
+def _load(filename):
+    '''Returns compiled template of file, or None on error
+    The compiled template is kept for reuse in batch mode
     '''
 
-    for var in PATTERN.findall(line):
-        if var in os.environ:
-            line = line.replace('@' + var + '@', os.environ[var])
+    if filename in COMPILED:
+        return COMPILED[filename]
+
+    try:
+        with open(filename) as f:
+            text = f.read()
+    except IOError as err:
+        print "%s: failed to open '%s': %s" % (PROGNAME, filename,
+                                               err.strerror)
+        return None
 
-    return line
+    parts = compile_template(text)
+    COMPILED[filename] = parts
+    return parts
 
 
 def template(filename):
-    '''generate the output from template file'''
+    '''generate the output from template file
+    The input is read, and the output is written, line by line
+    '''
 
     if not filename:
         print '%s: error: invalid filename' % PROGNAME
@@ -72,46 +113,135 @@ def template(filename):
                                                    err.strerror)
             sys.exit(-1)
 
+    with f:
+        # a variable never spans lines, so each line compiles by itself
+        # Note: readline() does not use the read-ahead buffer of
+        # 'for line in f', so a pipe is processed as it comes in
+        for line in iter(f.readline, ''):
+            render(compile_template(line), sys.stdout)
+
+
+def batch(manifest):
+    '''generate the outputs listed in the manifest file
+    Every line holds: template output [VAR=VALUE ..]
+    Returns number of errors
+    '''
+
+    if manifest == '-':
+        f = sys.stdin
+    else:
+        try:
+            f = open(manifest)
+        except IOError as err:
+            print "%s: failed to open '%s': %s" % (PROGNAME, manifest,
+                                                   err.strerror)
+            return 1
+
+    errors = 0
+    lineno = 0
     with f:
         for line in f:
-            sys.stdout.write(subst(line))
+            lineno += 1
+            try:
+                arr = shlex.split(line, comments=True)
+            except ValueError:
+                arr = None
+
+            if not arr:
+                if arr is None:
+                    print '%s: %s:%d: syntax error' % (PROGNAME, manifest,
+                                                       lineno)
+                    errors += 1
+                continue
+
+            if not _batch_entry(arr, manifest, lineno):
+                errors += 1
+
+    return errors
+
+
+def _batch_entry(arr, manifest, lineno):
+    '''generate one output for batch()
+    Returns False on error
+    '''
+
+    if len(arr) < 2 or arr[0] == '-':
+        print ('%s: %s:%d: expected template and output filename' %
+               (PROGNAME, manifest, lineno))
+        return False
+
+    env = os.environ
+    if len(arr) > 2:
+        env = dict(os.environ)
+        for arg in arr[2:]:
+            try:
+                (key, value) = arg.split('=', 1)
+            except ValueError:
+                key = None
+
+            if key is None or not spellcheck(key):
+                print ('%s: %s:%d: syntax error: expected VAR=VALUE' %
+                       (PROGNAME, manifest, lineno))
+                return False
+
+            env[key] = value
+
+    parts = _load(arr[0])
+    if parts is None:
+        return False
+
+    output = arr[1]
+    try:
+        with open(output, 'w') as f:
+            render(parts, f, env)
+    except IOError as err:
+        print "%s: failed to write '%s': %s" % (PROGNAME, output,
+                                                err.strerror)
+        return False
+
+    return True
 
 
 def usage():
     '''print usage information'''
 
     print '''%s [-v VAR=VALUE] <input filename>
+%s [-v VAR=VALUE] --batch=FILE
 options:
   -h, --help               Display this information
   -v, --var VAR=VALUE      Set variable VAR to VALUE
+  -b, --batch=FILE         Generate all outputs listed in FILE
 
 synctool-template replaces all occurrences of "@VAR@" in the input text
 with "VALUE" and prints the result to stdout. VAR may be given on the
 command-line, but may also be an existing environment variable
-''' % PROGNAME
+
+In batch mode, every line of FILE holds a template, an output filename,
+and optionally variables for this output only:
+  template output [VAR=VALUE ..]
+FILE '-' reads the list from stdin
+''' % (PROGNAME, PROGNAME)
 
 
 def get_options():
-    '''parse command-line options'''
+    '''parse command-line options
+    Returns pair: input filename, batch filename
+    One of them is None
+    '''
 
     if len(sys.argv) <= 1:
         usage()
         sys.exit(1)
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'hv:', ['help', 'var='])
+        opts, args = getopt.getopt(sys.argv[1:], 'hv:b:',
+                                   ['help', 'var=', 'batch='])
     except getopt.GetoptError as reason:
         print '%s: %s' % (PROGNAME, reason)
         usage()
         sys.exit(1)
 
-    if not args:
-        print '%s: missing input filename' % PROGNAME
-        sys.exit(1)
-
-    if len(args) > 1:
-        print '%s: too many arguments' % PROGNAME
-        sys.exit(1)
+    batch_file = None
 
     for opt, optarg in opts:
         if opt in ('-h', '--help', '-?'):
@@ -134,6 +264,16 @@ def get_options():
                 # put it in the environment
                 os.environ[key] = value
 
+        if opt in ('-b', '--batch'):
+            batch_file = optarg
+
+    if batch_file is not None:
+        if args:
+            print '%s: too many arguments' % PROGNAME
+            sys.exit(1)
+
+        return None, batch_file
+
     if not args:
         print '%s: missing input file' % PROGNAME
         sys.exit(1)
@@ -143,14 +283,18 @@ def get_options():
         sys.exit(1)
 
     # return the input filename
-    return args[0]
+    return args[0], None
 
 
 @catch_signals
 def main():
     '''do it'''
 
-    INPUT_FILE = get_options()
-    template(INPUT_FILE)
+    INPUT_FILE, BATCH_FILE = get_options()
+    if BATCH_FILE is not None:
+        if batch(BATCH_FILE) > 0:
+            sys.exit(-1)
+    else:
+        template(INPUT_FILE)
 
 # EOB
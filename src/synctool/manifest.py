@@ -0,0 +1,215 @@
+#
+#   synctool.manifest.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''the manifest remembers the checksums of source files in the repository
+and of their destinations. When neither file changed since the last run
+(same size, mtime, ctime, and inode number), the checksums are taken from the
+manifest and the files need not be read again.
+
+The manifest is kept in $SYNCTOOL/var/cache/manifest
+It is a plain text file with one tab-separated entry per line:
+  src_path dest_path src_size src_mtime src_ctime src_ino src_md5
+                     dest_size dest_mtime dest_ctime dest_ino dest_md5
+'''
+
+import os
+import time
+import errno
+
+import synctool.lib
+from synctool.lib import verbose, error
+import synctool.param
+
+# do not trust entries for files that were modified this recently;
+# they may still change within the resolution of the mtime
+RACY_SECONDS = 2
+
+# dict of entries by source path:
+#   ENTRIES[src_path] -> tuple of fields
+ENTRIES = {}
+
+# set of source paths that were looked at during this run
+USED = set()
+
+LOADED = False
+DIRTY = False
+
+
+def _manifest_file():
+    '''Returns path of the manifest file'''
+
+    return os.path.join(synctool.param.CACHE_DIR, 'manifest')
+
+
+def load():
+    '''read manifest file
+    A missing or corrupt manifest is not an error;
+    it simply means that all files will be checksummed
+    '''
+
+    global LOADED
+
+    if LOADED:
+        return
+
+    LOADED = True
+
+    filename = _manifest_file()
+    try:
+        f = open(filename, 'r')
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            error('failed to read manifest %s: %s' % (filename,
+                                                      err.strerror))
+        return
+
+    with f:
+        for line in f:
+            arr = line.rstrip('\n').split('\t')
+            if len(arr) != 12:
+                verbose('ignoring corrupt manifest %s' % filename)
+                ENTRIES.clear()
+                return
+
+            try:
+                entry = (arr[1],
+                         int(arr[2]), float(arr[3]), float(arr[4]),
+                         int(arr[5]), arr[6],
+                         int(arr[7]), float(arr[8]), float(arr[9]),
+                         int(arr[10]), arr[11])
+            except ValueError:
+                verbose('ignoring corrupt manifest %s' % filename)
+                ENTRIES.clear()
+                return
+
+            ENTRIES[arr[0]] = entry
+
+    verbose('loaded %d entries from manifest' % len(ENTRIES))
+
+
+def save(prune=False):
+    '''write manifest file, if it changed
+    If prune is True, drop entries that were not used in this run
+    '''
+
+    global DIRTY
+
+    if not LOADED:
+        return
+
+    if prune:
+        for src_path in ENTRIES.keys():
+            if not src_path in USED:
+                del ENTRIES[src_path]
+                DIRTY = True
+
+    if not DIRTY:
+        return
+
+    if not synctool.lib.mkdir_p(synctool.param.CACHE_DIR):
+        # error message already printed
+        return
+
+    filename = _manifest_file()
+    tmp_filename = '%s.%d' % (filename, os.getpid())
+    try:
+        f = open(tmp_filename, 'w')
+    except IOError as err:
+        error('failed to write manifest %s: %s' % (tmp_filename,
+                                                   err.strerror))
+        return
+
+    with f:
+        for src_path, entry in ENTRIES.iteritems():
+            (dest_path, src_size, src_mtime, src_ctime, src_ino, src_md5,
+             dest_size, dest_mtime, dest_ctime, dest_ino, dest_md5) = entry
+            f.write('%s\t%s\t%d\t%r\t%r\t%d\t%s\t%d\t%r\t%r\t%d\t%s\n' %
+                    (src_path, dest_path, src_size, src_mtime, src_ctime,
+                     src_ino, src_md5, dest_size, dest_mtime, dest_ctime,
+                     dest_ino, dest_md5))
+
+    try:
+        os.rename(tmp_filename, filename)
+    except OSError as err:
+        error('failed to rename %s to %s: %s' % (tmp_filename, filename,
+                                                 err.strerror))
+        try:
+            os.unlink(tmp_filename)
+        except OSError:
+            pass
+        return
+
+    DIRTY = False
+
+
+def lookup(src_path, dest_path, src_stat, dest_stat):
+    '''look up the checksums for src_path and dest_path
+    src_stat and dest_stat are SyncStat objects
+    Returns pair of MD5 hex digests: src_md5, dest_md5
+    or None if not in the manifest or if any of the files changed
+    '''
+
+    load()
+
+    USED.add(src_path)
+
+    if not src_path in ENTRIES:
+        return None
+
+    (m_dest_path, src_size, src_mtime, src_ctime, src_ino, src_md5,
+     dest_size, dest_mtime, dest_ctime, dest_ino,
+     dest_md5) = ENTRIES[src_path]
+
+    # the ctime is checked too, because unlike the mtime,
+    # it can not be set back (like 'touch -r' or 'cp -p' do)
+    if (m_dest_path != dest_path or
+        src_size != src_stat.size or src_mtime != src_stat.mtime or
+        src_ctime != src_stat.ctime or src_ino != src_stat.ino or
+        dest_size != dest_stat.size or dest_mtime != dest_stat.mtime or
+        dest_ctime != dest_stat.ctime or dest_ino != dest_stat.ino):
+        return None
+
+    return src_md5, dest_md5
+
+
+def store(src_path, dest_path, src_stat, dest_stat, src_md5, dest_md5):
+    '''enter checksums of src_path and dest_path into the manifest'''
+
+    global DIRTY
+
+    load()
+
+    USED.add(src_path)
+
+    # path names with tabs or newlines do not fit in the file format
+    if ('\t' in src_path or '\n' in src_path or
+        '\t' in dest_path or '\n' in dest_path):
+        return
+
+    # files that were modified just now may change again
+    # without their mtime or ctime changing
+    now = time.time()
+    if (now - src_stat.mtime < RACY_SECONDS or
+        now - src_stat.ctime < RACY_SECONDS or
+        now - dest_stat.mtime < RACY_SECONDS or
+        now - dest_stat.ctime < RACY_SECONDS):
+        if src_path in ENTRIES:
+            del ENTRIES[src_path]
+            DIRTY = True
+        return
+
+    ENTRIES[src_path] = (dest_path,
+                         src_stat.size, src_stat.mtime, src_stat.ctime,
+                         src_stat.ino, src_md5,
+                         dest_stat.size, dest_stat.mtime, dest_stat.ctime,
+                         dest_stat.ino, dest_md5)
+    DIRTY = True
+
+# EOB
@@ -12,6 +12,7 @@
 
 import os
 import re
+import time
 import shlex
 import subprocess
 
@@ -23,6 +24,21 @@ import synctool.syncstat
 SSH_VERSION = None
 MATCH_SSH_VERSION = re.compile(r'^OpenSSH\_(\d+)\.(\d+)')
 
+# timeout in seconds for shared sessions that are left behind;
+# normally they are closed right away
+SESSION_PERSIST = 60
+
+# name of the state file of the connection pool, under TEMP_DIR/sshmux/
+POOL_STATE = '.pool'
+
+# seconds between polls for master connections to come up
+POLL_INTERVAL = 0.1
+# the interval between 'ssh -O check' calls for a node doubles
+# each time the master is not ready, up to this many seconds
+MAX_CHECK_INTERVAL = 2.0
+# seconds to wait for a master connection to come up
+START_TIMEOUT = 60
+
 
 def _make_control_path(nodename):
     '''Returns a control pathname for nodename
@@ -115,6 +131,235 @@ def ssh_args(ssh_cmd_arr, nodename):
     ssh_cmd_arr.extend(['-o', 'ControlPath=' + control_path])
 
 
+def _session_control_path(nodename):
+    '''Returns a control pathname for a shared session to nodename
+    or None on error
+    The pid makes sure that it does not clash with the control path
+    of a master connection started by dsh -M
+    '''
+
+    return _make_control_path('%s.%d' % (nodename, os.getpid()))
+
+
+def start_session_cmd(nodename, remote_addr):
+    '''Returns command for starting a short-lived master connection
+    to node, that is shared by the commands that run on it by means
+    of session_args(), or None if not possible
+    Run it with its output discarded; the master process lives on in
+    the background, and readers of its output would hang
+    Afterwards, check with session_started() and close the connection
+    again with end_session_cmd()
+    '''
+
+    if detect_ssh() < 39:
+        # not OpenSSH, or too old to do multiplexing
+        return None
+
+    control_path = _session_control_path(nodename)
+    if not control_path:
+        # error message already printed
+        return None
+
+    verbose('starting shared ssh session to %s' % nodename)
+
+    # -f puts ssh in the background after authentication,
+    # so the control path is there by the time it exits
+    cmd_arr = shlex.split(synctool.param.SSH_CMD)
+    cmd_arr.extend(['-M', '-N', '-n', '-f',
+                    '-o', 'ControlPath=' + control_path])
+
+    # the timeout is a safety net in case we never get to close
+    # the session ourselves
+    if SSH_VERSION >= 56:
+        cmd_arr.extend(['-o', 'ControlPersist=%d' % SESSION_PERSIST])
+
+    cmd_arr.append('--')
+    cmd_arr.append(remote_addr)
+    return cmd_arr
+
+
+def session_started(nodename):
+    '''Returns True if the shared session to node is there'''
+
+    control_path = _session_control_path(nodename)
+    if not control_path:
+        # error message already printed
+        return False
+
+    return synctool.syncstat.SyncStat(control_path).is_sock()
+
+
+def session_args(ssh_cmd_arr, nodename):
+    '''add arguments to ssh_cmd_arr for sharing the session started
+    with start_session_cmd()
+    If the master connection is not there, ssh simply makes
+    a new connection
+    '''
+
+    control_path = _session_control_path(nodename)
+    if not control_path:
+        # error message already printed
+        return
+
+    ssh_cmd_arr.extend(['-o', 'ControlPath=' + control_path])
+
+
+def end_session_cmd(nodename, remote_addr):
+    '''Returns command that terminates the shared session to node,
+    or None if there is none
+    '''
+
+    control_path = _session_control_path(nodename)
+    if not control_path:
+        # error message already printed
+        return None
+
+    if not os.path.exists(control_path):
+        return None
+
+    verbose('closing shared ssh session to %s' % nodename)
+
+    cmd_arr = shlex.split(synctool.param.SSH_CMD)
+    cmd_arr.extend(['-N', '-n',
+                    '-O', 'exit',
+                    '-o', 'ControlPath=' + control_path,
+                    '--', remote_addr])
+    return cmd_arr
+
+
+def _check_control_path(control_path, remote_addr):
+    '''Returns True if the master connection behind control_path
+    is alive
+    '''
+
+    if not synctool.syncstat.SyncStat(control_path).is_sock():
+        return False
+
+    cmd_arr = shlex.split(synctool.param.SSH_CMD)
+    cmd_arr.extend(['-N', '-n', '-O', 'check',
+                    '-o', 'ControlPath=' + control_path, '--', remote_addr])
+
+    with open(os.devnull, 'w') as devnull:
+        try:
+            exitcode = subprocess.call(cmd_arr, shell=False, stdout=devnull,
+                                       stderr=devnull)
+        except OSError as err:
+            error('failed to execute %s: %s' % (cmd_arr[0], err.strerror))
+            return False
+
+    return exitcode == 0
+
+
+def _start_masters(node_list, persist, quiet=False):
+    '''start ssh master connections to all nodes in node_list,
+    at most NUM_PROC at a time
+    node_list is a list of pairs: (addr, nodename)
+    Argument 'persist' is the SSH ControlPersist parameter, or None
+    If quiet is True, the output of ssh is discarded
+
+    A master connection is ready as soon as its control path answers
+    to 'ssh -O check'; there is no need to wait for ssh to go into
+    the background. A master that is not ready within START_TIMEOUT
+    seconds is terminated, and counts as failed
+
+    Returns list of tuples: (nodename, ok, elapsed time, proc)
+    where proc is the ssh process if it is still running, or None
+    '''
+
+    ssh_cmd_arr = shlex.split(synctool.param.SSH_CMD)
+    ssh_cmd_arr.extend(['-M', '-N', '-n'])
+    if not persist is None:
+        ssh_cmd_arr.extend(['-o', 'ControlPersist=' + persist])
+
+    if quiet:
+        devnull = open(os.devnull, 'w')
+    else:
+        devnull = None
+
+    results = []
+    pending = node_list[:]
+    # list of running: [addr, nodename, control_path, proc, start time,
+    #                   time of next check, check interval]
+    running = []
+
+    while pending or running:
+        while pending and len(running) < synctool.param.NUM_PROC:
+            addr, nodename = pending.pop(0)
+
+            control_path = _make_control_path(nodename)
+            if not control_path:
+                # error message already printed
+                results.append((nodename, False, 0.0, None))
+                continue
+
+            verbose('creating master control path to %s' % nodename)
+
+            cmd_arr = ssh_cmd_arr[:]
+            cmd_arr.extend(['-o', 'ControlPath=' + control_path,
+                            '--', addr])
+
+            # start in background
+            unix_out(' '.join(cmd_arr))
+            try:
+                proc = subprocess.Popen(cmd_arr, shell=False, stdout=devnull,
+                                        stderr=devnull)
+            except OSError as err:
+                error('failed to execute %s: %s' % (cmd_arr[0],
+                                                    err.strerror))
+                results.append((nodename, False, 0.0, None))
+                continue
+
+            t0 = time.time()
+            running.append([addr, nodename, control_path, proc, t0, t0,
+                            POLL_INTERVAL])
+
+        time.sleep(POLL_INTERVAL)
+
+        now = time.time()
+        for item in running[:]:
+            addr, nodename, control_path, proc, t0, next_check, interval = item
+
+            if not proc.poll() is None:
+                # ssh exited; either it went into the background
+                # (ControlPersist) or it failed
+                ok = (proc.returncode == 0 and
+                      _check_control_path(control_path, addr))
+                proc = None
+
+            elif now - t0 >= START_TIMEOUT:
+                if quiet:
+                    verbose('timeout starting ssh master to %s' % nodename)
+                else:
+                    error('timeout starting ssh master to %s' % nodename)
+                proc.terminate()
+                proc.wait()
+                ok = False
+                proc = None
+
+            elif now < next_check:
+                continue
+
+            elif _check_control_path(control_path, addr):
+                ok = True
+
+            else:
+                # not ready yet; back off
+                # the control path shows up only after authentication,
+                # so there is no 'ssh -O check' until it exists
+                if synctool.syncstat.SyncStat(control_path).is_sock():
+                    item[6] = min(interval * 2, MAX_CHECK_INTERVAL)
+                item[5] = now + item[6]
+                continue
+
+            results.append((nodename, ok, now - t0, proc))
+            running.remove(item)
+
+    if devnull is not None:
+        devnull.close()
+
+    return results
+
+
 def setup_master(node_list, persist):
     '''setup master connections to all nodes in node_list
     node_list is a list of pairs: (addr, nodename)
@@ -127,18 +372,11 @@ def setup_master(node_list, persist):
         error('unsupported version of ssh')
         return False
 
-    if persist == 'none':
+    if persist == 'none' or SSH_VERSION < 56:
         persist = None
 
-    procs = []
-
-    ssh_cmd_arr = shlex.split(synctool.param.SSH_CMD)
-    ssh_cmd_arr.extend(['-M', '-N', '-n'])
-    if SSH_VERSION >= 56 and not persist is None:
-        ssh_cmd_arr.extend(['-o', 'ControlPersist=' + persist])
-
-    verbose('spawning ssh master connections')
     errors = 0
+    start_list = []
     for addr, nodename in node_list:
         control_path = _make_control_path(nodename)
         if not control_path:
@@ -168,33 +406,36 @@ def setup_master(node_list, persist):
             verbose('control path %s already exists' % control_path)
             continue
 
-        # start ssh in master mode to create a new control path
-        verbose('creating master control path to %s' % nodename)
+        start_list.append((addr, nodename))
 
-        cmd_arr = ssh_cmd_arr[:]
-        cmd_arr.extend(['-o', 'ControlPath=' + control_path, '--', addr])
+    verbose('spawning ssh master connections')
+    results = _start_masters(start_list, persist)
 
-        # start in background
-        unix_out(' '.join(cmd_arr))
-        try:
-            proc = subprocess.Popen(cmd_arr, shell=False)
-        except OSError as err:
-            error('failed to execute %s: %s' % (cmd_arr[0], err.strerror))
+    procs = []
+    started = 0
+    for nodename, ok, elapsed, proc in results:
+        if ok:
+            started += 1
+            verbose('ssh master to %s started in %.3f seconds' %
+                    (nodename, elapsed))
+        else:
+            error('failed to start ssh master to %s' % nodename)
             errors += 1
-            continue
 
-        procs.append(proc)
+        if not proc is None:
+            procs.append(proc)
 
     # print some info to the user about what's going on
-    if len(procs) > 0:
-        if SSH_VERSION < 56 or persist is None:
+    if len(results) > 0:
+        if persist is None and len(procs) > 0:
             print '''waiting for ssh master processes to terminate
 Meanwhile, you may background this process or continue working
 in another terminal
 '''
-        else:
+        elif started > 0:
             print 'ssh master processes started'
 
+        # with ControlPersist, ssh goes into the background by itself
         for proc in procs:
             if errors > 0:
                 proc.terminate()
@@ -207,6 +448,205 @@ in another terminal
     return errors == 0
 
 
+def _pool_state_file():
+    '''Returns path of the state file of the connection pool
+    or None on error
+    '''
+
+    control_dir = os.path.join(synctool.param.TEMP_DIR, 'sshmux')
+    if not synctool.lib.mkdir_p(control_dir):
+        # error message already printed
+        return None
+
+    return os.path.join(control_dir, POOL_STATE)
+
+
+def _load_pool_state():
+    '''Returns dict of master connections in the pool:
+    nodename -> (addr, start time)
+    '''
+
+    pool = {}
+
+    filename = _pool_state_file()
+    if not filename:
+        # error message already printed
+        return pool
+
+    try:
+        f = open(filename, 'r')
+    except IOError:
+        # no state file yet
+        return pool
+
+    with f:
+        for line in f:
+            arr = line.split()
+            if len(arr) != 3:
+                continue
+
+            try:
+                pool[arr[0]] = (arr[1], int(arr[2]))
+            except ValueError:
+                continue
+
+    return pool
+
+
+def _save_pool_state(pool):
+    '''write state file of the connection pool'''
+
+    filename = _pool_state_file()
+    if not filename:
+        # error message already printed
+        return
+
+    tmp_filename = '%s.%d' % (filename, os.getpid())
+    try:
+        f = open(tmp_filename, 'w')
+    except IOError as err:
+        error('failed to write %s: %s' % (tmp_filename, err.strerror))
+        return
+
+    with f:
+        for nodename in sorted(pool.keys()):
+            addr, started = pool[nodename]
+            f.write('%s %s %d\n' % (nodename, addr, started))
+
+    try:
+        os.rename(tmp_filename, filename)
+    except OSError as err:
+        error('failed to rename %s to %s: %s' % (tmp_filename, filename,
+                                                 err.strerror))
+        try:
+            os.unlink(tmp_filename)
+        except OSError:
+            pass
+
+
+def _run_all(cmd_list):
+    '''run the commands in cmd_list, NUM_PROC at a time
+    Output is discarded; ssh masters that go into the background
+    must not hold on to our stdout
+    Returns list of exit codes, -1 if the command could not run
+    '''
+
+    exitcodes = [-1] * len(cmd_list)
+    running = []
+
+    with open(os.devnull, 'r+') as devnull:
+        for idx, cmd_arr in enumerate(cmd_list):
+            if len(running) >= synctool.param.NUM_PROC:
+                i, proc = running.pop(0)
+                exitcodes[i] = proc.wait()
+
+            unix_out(' '.join(cmd_arr))
+            try:
+                proc = subprocess.Popen(cmd_arr, shell=False, stdin=devnull,
+                                        stdout=devnull, stderr=devnull)
+            except OSError as err:
+                error('failed to execute %s: %s' % (cmd_arr[0],
+                                                    err.strerror))
+                continue
+
+            running.append((idx, proc))
+
+        for i, proc in running:
+            exitcodes[i] = proc.wait()
+
+    return exitcodes
+
+
+def auto_master(node_list):
+    '''make sure there are master connections to all nodes in node_list,
+    starting any missing ones in parallel
+    node_list is a list of pairs: (addr, nodename)
+    Master connections are kept in a pool, so that following commands
+    can use them too. Dead ones are reaped and replaced
+    '''
+
+    if not synctool.param.AUTO_MULTIPLEX:
+        return
+
+    # allow this only on the master node because of security considerations
+    if synctool.param.MASTER != synctool.param.HOSTNAME:
+        return
+
+    persist = synctool.param.CONTROL_PERSIST
+    if persist == 'none' or detect_ssh() < 56:
+        # without ControlPersist, the masters would not go away by
+        # themselves; only dsh -M should start those
+        verbose('not starting ssh master connections: '
+                'ControlPersist not available')
+        return
+
+    pool = _load_pool_state()
+
+    # health-check all sockets in the pool and those of the given nodes
+    # in one go; control commands do not touch the network
+    check = {}
+    for nodename, (addr, _) in pool.items():
+        check[nodename] = addr
+    for addr, nodename in node_list:
+        check[nodename] = addr
+
+    check_nodes = []
+    cmd_list = []
+    for nodename, addr in check.items():
+        control_path = _make_control_path(nodename)
+        if not control_path:
+            # error message already printed
+            return
+
+        if not synctool.syncstat.SyncStat(control_path).is_sock():
+            if nodename in pool:
+                del pool[nodename]
+            continue
+
+        cmd_arr = shlex.split(synctool.param.SSH_CMD)
+        cmd_arr.extend(['-N', '-n', '-O', 'check',
+                        '-o', 'ControlPath=' + control_path, '--', addr])
+        check_nodes.append(nodename)
+        cmd_list.append(cmd_arr)
+
+    alive = set()
+    for nodename, exitcode in zip(check_nodes, _run_all(cmd_list)):
+        if exitcode == 0:
+            alive.add(nodename)
+            continue
+
+        # reap stale socket
+        verbose('removing stale control path for %s' % nodename)
+        try:
+            os.unlink(_make_control_path(nodename))
+        except OSError:
+            pass
+
+        if nodename in pool:
+            del pool[nodename]
+
+    # start masters for the nodes that have none
+    start_list = []
+    for addr, nodename in node_list:
+        if not nodename in alive:
+            start_list.append((addr, nodename))
+
+    if start_list:
+        verbose('starting %d ssh master connections' % len(start_list))
+
+    addrs = dict([(nodename, addr) for addr, nodename in node_list])
+    now = int(time.time())
+    for nodename, ok, _, _ in _start_masters(start_list, persist, True):
+        if ok:
+            pool[nodename] = (addrs[nodename], now)
+        else:
+            # not fatal; the node will be contacted without multiplexing
+            verbose('failed to start ssh master connection to %s' %
+                    nodename)
+
+    _save_pool_state(pool)
+
+
 def detect_ssh():
     '''detect ssh version
     Set global SSH_VERSION to 2-digit int number:
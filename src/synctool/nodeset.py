@@ -38,9 +38,10 @@ class NodeSet(object):
     def __init__(self):
         '''initialize instance'''
 
-        self.nodelist = set()
+        # node ranges are kept as intervals rather than expanded
+        self.nodelist = synctool.range.RangeSet()
         self.grouplist = set()
-        self.exclude_nodes = set()
+        self.exclude_nodes = synctool.range.RangeSet()
         self.exclude_groups = set()
         self.namemap = {}
 
@@ -49,10 +50,7 @@ class NodeSet(object):
 
 #        self.nodelist = set()
         for node in synctool.range.split_nodelist(nodelist):
-            if '[' in node:
-                self.nodelist |= set(synctool.range.expand(node))
-            else:
-                self.nodelist.add(node)
+            self.nodelist.add(node)
 
     def add_group(self, grouplist):
         '''add a group to the nodeset'''
@@ -69,10 +67,7 @@ class NodeSet(object):
 
 #        self.exclude_nodes = set()
         for node in synctool.range.split_nodelist(nodelist):
-            if '[' in node:
-                self.exclude_nodes |= set(synctool.range.expand(node))
-            else:
-                self.exclude_nodes.add(node)
+            self.exclude_nodes.add(node)
 
     def exclude_group(self, grouplist):
         '''remove a group from the nodeset'''
@@ -92,18 +87,20 @@ class NodeSet(object):
             if not synctool.param.DEFAULT_NODESET:
                 return []
 
-            self.nodelist = synctool.param.DEFAULT_NODESET
+            self.nodelist = synctool.range.RangeSet(
+                                synctool.param.DEFAULT_NODESET)
 
-        # check if the nodes exist at all
+        # check if the excluded nodes exist at all
         # the user may have given bogus names
-        all_nodes = set(synctool.config.get_all_nodes())
-        unknown = (self.nodelist | self.exclude_nodes) - all_nodes
+        # The nodes in nodelist are checked as they are emitted below,
+        # so that the ranges are expanded only once
+        unknown = [x for x in self.exclude_nodes
+                   if not x in synctool.param.NODES]
         if len(unknown) > 0:
             # it's nice to display "the first" unknown node
             # (at least, for numbered nodes)
-            arr = list(unknown)
-            arr.sort()
-            stderr("no such node '%s'" % arr[0])
+            unknown.sort()
+            stderr("no such node '%s'" % unknown[0])
             return None
 
         # check if the groups exist at all
@@ -113,35 +110,53 @@ class NodeSet(object):
             stderr("no such group '%s'" % group)
             return None
 
-        self.nodelist |= synctool.config.get_nodes_in_groups(self.grouplist)
+        self.nodelist.update(synctool.config.get_nodes_in_groups(
+                                self.grouplist))
 
-        self.exclude_nodes |= synctool.config.get_nodes_in_groups(
-                                self.exclude_groups)
+        self.exclude_nodes.update(synctool.config.get_nodes_in_groups(
+                                    self.exclude_groups))
 
         # remove excluded nodes from nodelist
-        self.nodelist -= self.exclude_nodes
+        self.nodelist.difference_update(self.exclude_nodes)
 
         if not self.nodelist:
             return []
 
         addrs = []
 
-        ignored_nodes = self.nodelist & synctool.param.IGNORE_GROUPS
-        self.nodelist -= ignored_nodes
+        ignored_nodes = self.nodelist.intersection(
+                            synctool.param.IGNORE_GROUPS)
+        for node in ignored_nodes:
+            if not node in synctool.param.NODES:
+                stderr("no such node '%s'" % node)
+                return None
+
+        self.nodelist.difference_update(ignored_nodes)
 
+        # ignoring a group results in also ignoring the node
+        group_ignored = self.nodelist.intersection(
+                            synctool.config.get_nodes_in_groups(
+                                synctool.param.IGNORE_GROUPS))
+        for node in group_ignored:
+            verbose('node %s is ignored due to an ignored group' % node)
+
+        ignored_nodes |= group_ignored
+
+        # make sure we do not have duplicates
+        seen = set()
         for node in self.nodelist:
-            # ignoring a group results in also ignoring the node
-            my_groups = set(synctool.config.get_groups(node))
-            my_groups &= synctool.param.IGNORE_GROUPS
-            if len(my_groups) > 0:
-                verbose('node %s is ignored due to an ignored group' % node)
-                ignored_nodes.add(node)
+            if not node in synctool.param.NODES:
+                stderr("no such node '%s'" % node)
+                return None
+
+            if node in group_ignored:
                 continue
 
             addr = synctool.config.get_node_ipaddress(node)
             self.namemap[addr] = node
 
-            if not addr in addrs:    # make sure we do not have duplicates
+            if not addr in seen:
+                seen.add(addr)
                 addrs.append(addr)
 
         # print message about ignored nodes
@@ -200,7 +215,7 @@ def make_default_nodeset():
             # error message already printed
             errors += 1
         else:
-            synctool.param.DEFAULT_NODESET = nodeset.nodelist
+            synctool.param.DEFAULT_NODESET = set(nodeset.nodelist)
 
     if errors > 0:
         sys.exit(-1)
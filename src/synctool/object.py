@@ -11,19 +11,73 @@
 '''a SyncObject is a source file + matching destination path and attributes'''
 
 import os
+import sys
 import stat
 import time
-import shutil
+import errno
+import fcntl
 import hashlib
+import tempfile
 
 import synctool.lib
 from synctool.lib import verbose, stdout, error, terse, unix_out, log
 from synctool.lib import dryrun_msg, prettypath
+import synctool.manifest
 import synctool.param
+import synctool.postqueue
+import synctool.prefetch
+import synctool.profiler
 import synctool.syncstat
 
-# size for doing I/O while checksumming files
-IO_SIZE = 16 * 1024
+# size of buffer for copying files
+COPY_IO_SIZE = 1024 * 1024
+
+# ioctl that clones a file, sharing the data blocks (Linux: FICLONE)
+FICLONE = 0x40049409
+# set to False when the filesystem does not support cloning
+CLONE_FILES = sys.platform.startswith('linux')
+
+# directories that are known to exist; see VNode.mkdir_basepath()
+MADE_DIRS = set()
+
+
+def _clone_file(src_fd, dest_fd):
+    '''clone the file as a reflink
+    Returns True on success, False if the data must be copied
+    '''
+
+    global CLONE_FILES
+
+    if not CLONE_FILES:
+        return False
+
+    try:
+        fcntl.ioctl(dest_fd, FICLONE, src_fd)
+    except IOError:
+        # not supported, or src and dest are on different filesystems
+        # don't try again
+        CLONE_FILES = False
+        return False
+
+    return True
+
+
+def copy_fd(src_fd, dest_fd):
+    '''copy contents of open file src_fd to dest_fd
+    May raise OSError
+    '''
+
+    if _clone_file(src_fd, dest_fd):
+        return
+
+    while True:
+        data = os.read(src_fd, COPY_IO_SIZE)
+        if not data:
+            break
+
+        while data:
+            n = os.write(dest_fd, data)
+            data = data[n:]
 
 
 class VNode(object):
@@ -97,18 +151,23 @@ class VNode(object):
                 pass
 
     def mkdir_basepath(self):
-        '''call mkdir -p to create leading path'''
+        '''call mkdir -p to create leading path
+        Directories that were seen before are not checked again
+        '''
 
         if synctool.lib.DRY_RUN:
             return
 
         basedir = os.path.dirname(self.name)
+        if basedir in MADE_DIRS:
+            return
 
         # be a bit quiet about it
         if synctool.lib.VERBOSE or synctool.lib.UNIX_CMD:
             verbose('making directory %s' % prettypath(basedir))
 
-        synctool.lib.mkdir_p(basedir)
+        if synctool.lib.mkdir_p(basedir):
+            MADE_DIRS.add(basedir)
 
     def compare(self, src_path, dest_stat):
         '''compare content
@@ -145,10 +204,15 @@ class VNode(object):
             try:
                 os.chown(self.name, self.stat.uid, self.stat.gid)
             except OSError as err:
-                error('failed to chown %s.%s %s : %s' %
-                      (self.stat.ascii_uid(), self.stat.ascii_gid(),
-                       self.name, err.strerror))
-                terse(synctool.lib.TERSE_FAIL, 'owner %s' % self.name)
+                self._owner_failed(err)
+
+    def _owner_failed(self, err):
+        '''print message that setting the owner failed'''
+
+        error('failed to chown %s.%s %s : %s' %
+              (self.stat.ascii_uid(), self.stat.ascii_gid(),
+               self.name, err.strerror))
+        terse(synctool.lib.TERSE_FAIL, 'owner %s' % self.name)
 
     def set_permissions(self):
         '''set access permission bits equal to source'''
@@ -160,9 +224,14 @@ class VNode(object):
             try:
                 os.chmod(self.name, self.stat.mode & 07777)
             except OSError as err:
-                error('failed to chmod %04o %s : %s' %
-                      (self.stat.mode & 07777, self.name, err.strerror))
-                terse(synctool.lib.TERSE_FAIL, 'mode %s' % self.name)
+                self._mode_failed(err)
+
+    def _mode_failed(self, err):
+        '''print message that setting the permissions failed'''
+
+        error('failed to chmod %04o %s : %s' %
+              (self.stat.mode & 07777, self.name, err.strerror))
+        terse(synctool.lib.TERSE_FAIL, 'mode %s' % self.name)
 
     def set_times(self, atime, mtime):
         '''set access and mod times'''
@@ -205,85 +274,226 @@ class VNodeFile(VNode):
             unix_out('# updating file %s' % self.name)
             return False
 
-        return self._compare_checksums(src_path)
+        return self._compare_contents(src_path, dest_stat)
 
-    def _compare_checksums(self, src_path):
-        '''compare checksum of src_path and dest: self.name
+    def _compare_contents(self, src_path, dest_stat):
+        '''compare contents of src_path and dest: self.name
+        The files are compared block by block, stopping at the first
+        difference. Checksums are only calculated when the manifest
+        is used; an unchanged file may then be skipped altogether
         Return True if the same'''
 
-        try:
-            f1 = open(src_path, 'rb')
-        except IOError as err:
-            error('failed to open %s : %s' % (src_path, err.strerror))
-            # return True because we can't fix an error in src_path
-            return True
+        if synctool.param.MANIFEST:
+            sums = synctool.manifest.lookup(src_path, self.name, self.stat,
+                                            dest_stat)
+            if sums is not None:
+                verbose('  checksums of %s taken from manifest' % self.name)
+                if sums[0] == sums[1]:
+                    return True
 
-        sum1 = hashlib.md5()
-        sum2 = hashlib.md5()
+                self._report_mismatch()
+                return False
+
+        # the files may already have been compared in advance
+        result = synctool.prefetch.lookup(src_path, self.name, self.stat,
+                                          dest_stat)
+        if result is not None:
+            same, md5 = result
+        else:
+            if synctool.param.MANIFEST:
+                # fill the manifest along the way
+                digest = hashlib.md5()
+            else:
+                digest = None
 
-        with f1:
             try:
-                f2 = open(self.name, 'rb')
+                same = synctool.lib.compare_files(src_path, self.name,
+                                                  digest)
             except IOError as err:
-                error('failed to open %s : %s' % (self.name, err.strerror))
+                error('failed to read file %s : %s' % (err.filename,
+                                                       err.strerror))
+                if err.filename == src_path:
+                    # return True because we can't fix an error in src_path
+                    return True
+
                 return False
 
-            with f2:
-                ended = False
-                while not ended and (sum1.digest() == sum2.digest()):
-                    try:
-                        data1 = f1.read(IO_SIZE)
-                    except IOError as err:
-                        error('failed to read file %s: %s' % (src_path,
-                                                              err.strerror))
-                        return False
+            if digest is not None and same:
+                md5 = digest.hexdigest()
+            else:
+                md5 = None
+
+        if not same:
+            self._report_mismatch()
+            return False
 
-                    if not data1:
-                        ended = True
-                    else:
-                        sum1.update(data1)
+        if synctool.param.MANIFEST and md5 is not None:
+            # the files are the same, so they have the same checksum
+            synctool.manifest.store(src_path, self.name, self.stat,
+                                    dest_stat, md5, md5)
 
-                    try:
-                        data2 = f2.read(IO_SIZE)
-                    except IOError as err:
-                        error('failed to read file %s: %s' % (self.name,
-                                                              err.strerror))
-                        return False
+        return True
 
-                    if not data2:
-                        ended = True
-                    else:
-                        sum2.update(data2)
+    def _report_mismatch(self):
+        '''print message that file contents differ'''
 
-        if sum1.digest() != sum2.digest():
-            if synctool.lib.DRY_RUN:
-                stdout('%s mismatch (MD5 checksum)' % self.name)
+        if synctool.lib.DRY_RUN:
+            stdout('%s mismatch (file contents)' % self.name)
+        else:
+            stdout('%s updated (contents mismatch)' % self.name)
+
+        unix_out('# updating file %s' % self.name)
+        terse(synctool.lib.TERSE_SYNC, self.name)
+
+    def fix(self):
+        '''repair the existing file
+        The file is copied to a temp file in the same directory,
+        which gets its owner and permissions before it is renamed
+        into place; the destination is never left half-written
+        '''
+
+        if self.exists:
+            statbuf = synctool.syncstat.SyncStat(self.name)
+            if statbuf.is_file() or statbuf.is_link():
+                # the rename replaces the old file in one go
+                if synctool.param.BACKUP_COPIES:
+                    self.link_saved()
+
+            # a directory or other type of entry can not be renamed over
+            elif synctool.param.BACKUP_COPIES:
+                self.move_saved()
+            elif statbuf.is_dir():
+                VNodeDir(self.name, self.stat, True).quiet_delete()
             else:
-                stdout('%s updated (MD5 mismatch)' % self.name)
+                self.quiet_delete()
 
-            unix_out('# updating file %s' % self.name)
-            terse(synctool.lib.TERSE_SYNC, self.name)
-            return False
+        self.mkdir_basepath()
+        self.create()
 
-        return True
+    def link_saved(self):
+        '''keep existing file as .saved, by making a hard link
+        Unlike move_saved(), this leaves the file in place, so that
+        it can be replaced by the new file in a single rename
+        '''
+
+        # do not save files that already are .saved
+        _, ext = os.path.splitext(self.name)
+        if ext == '.saved':
+            return
+
+        saved = '%s.saved' % self.name
+        verbose(dryrun_msg('saving %s as %s' % (self.name, saved)))
+        unix_out('ln -f %s %s' % (self.name, saved))
+
+        if not synctool.lib.DRY_RUN:
+            # link under a temp name first, and rename it over
+            # any old .saved file
+            tmp_saved = '%s.%d' % (saved, os.getpid())
+            verbose('  os.link(%s, %s)' % (self.name, saved))
+            try:
+                os.link(self.name, tmp_saved)
+                os.rename(tmp_saved, saved)
+            except OSError as err:
+                error('failed to save %s as %s : %s' % (self.name, saved,
+                                                        err.strerror))
+                terse(synctool.lib.TERSE_FAIL, 'save %s' % saved)
+                try:
+                    os.unlink(tmp_saved)
+                except OSError:
+                    pass
 
     def create(self):
-        '''copy file'''
+        '''copy file, including owner and permissions'''
 
         if not self.exists:
             terse(synctool.lib.TERSE_NEW, self.name)
 
         verbose(dryrun_msg('  copy %s %s' % (self.src_path, self.name)))
         unix_out('cp %s %s' % (self.src_path, self.name))
+        verbose(dryrun_msg('  os.chown(%s, %d, %d)' %
+                           (self.name, self.stat.uid, self.stat.gid)))
+        unix_out('chown %s.%s %s' % (self.stat.ascii_uid(),
+                                     self.stat.ascii_gid(), self.name))
+        verbose(dryrun_msg('  os.chmod(%s, %04o)' %
+                           (self.name, self.stat.mode & 07777)))
+        unix_out('chmod 0%o %s' % (self.stat.mode & 07777, self.name))
 
         if not synctool.lib.DRY_RUN:
+            self._install()
+
+    def _mkstemp(self):
+        '''make temp file next to the destination
+        Returns pair: fd, path
+        May raise OSError
+        '''
+
+        dirname, basename = os.path.split(self.name)
+        try:
+            return tempfile.mkstemp(prefix='.%s.' % basename, dir=dirname)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+        # the directory was removed after it was made; try again
+        MADE_DIRS.discard(dirname)
+        synctool.lib.mkdir_p(dirname)
+        return tempfile.mkstemp(prefix='.%s.' % basename, dir=dirname)
+
+    def _install(self):
+        '''copy the file via a temp file
+        Returns True on success, False on error
+        '''
+
+        try:
+            src_fd = os.open(self.src_path, os.O_RDONLY)
+        except OSError as err:
+            error('failed to copy %s to %s: %s' %
+                  (prettypath(self.src_path), self.name, err.strerror))
+            terse(synctool.lib.TERSE_FAIL, self.name)
+            return False
+
+        try:
             try:
-                # copy file
-                shutil.copy(self.src_path, self.name)
-            except IOError as err:
+                fd, tmp_path = self._mkstemp()
+            except OSError as err:
                 error('failed to copy %s to %s: %s' %
                       (prettypath(self.src_path), self.name, err.strerror))
                 terse(synctool.lib.TERSE_FAIL, self.name)
+                return False
+
+            try:
+                copy_fd(src_fd, fd)
+
+                # set owner before mode, as chown clears setuid bits
+                try:
+                    os.fchown(fd, self.stat.uid, self.stat.gid)
+                except OSError as err:
+                    self._owner_failed(err)
+
+                try:
+                    os.fchmod(fd, self.stat.mode & 07777)
+                except OSError as err:
+                    self._mode_failed(err)
+            finally:
+                os.close(fd)
+
+            os.rename(tmp_path, self.name)
+
+        except OSError as err:
+            error('failed to copy %s to %s: %s' %
+                  (prettypath(self.src_path), self.name, err.strerror))
+            terse(synctool.lib.TERSE_FAIL, self.name)
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+            return False
+
+        finally:
+            os.close(src_fd)
+
+        return True
 
 
 class VNodeDir(VNode):
@@ -333,6 +543,9 @@ class VNodeDir(VNode):
         terse(synctool.lib.TERSE_DELETE, self.name + os.sep)
 
         if not synctool.lib.DRY_RUN:
+            # the dir, or any subdir, may no longer exist
+            MADE_DIRS.clear()
+
             verbose('  os.rmdir(%s)' % self.name)
             try:
                 os.rmdir(self.name)
@@ -346,6 +559,8 @@ class VNodeDir(VNode):
         '''silently delete directory; only called by fix()'''
 
         if not synctool.lib.DRY_RUN and not synctool.param.BACKUP_COPIES:
+            MADE_DIRS.clear()
+
             verbose('  os.rmdir(%s)' % self.name)
             try:
                 os.rmdir(self.name)
@@ -756,15 +971,15 @@ class SyncObject(object):
                                       self.dest_path))
             vnode.set_permissions()
 
-        # run .post script, if needed
-        # Note: for dirs, it is run from overlay._walk_subtree()
+        # queue .post script, if needed
+        # Note: for dirs, it is queued from overlay._visit_entries()
         if need_run and not self.src_stat.is_dir():
-            self.run_script(post_dict)
+            self.queue_script(post_dict)
 
         return True
 
     def run_script(self, scripts_dict):
-        '''run a .pre/.post script, if any'''
+        '''run a .pre script, if any'''
 
         if synctool.lib.NO_POST:
             return
@@ -778,6 +993,7 @@ class SyncObject(object):
         # so the script runs with the umask set by the sysadmin
         os.umask(synctool.param.ORIG_UMASK)
 
+        t_start = time.time()
         if self.dest_stat.is_dir():
             # run in the directory itself
             synctool.lib.run_command_in_dir(self.dest_path, script)
@@ -785,8 +1001,32 @@ class SyncObject(object):
             # run in the directory where the file is
             synctool.lib.run_command_in_dir(os.path.dirname(self.dest_path),
                                             script)
+        if synctool.profiler.ENABLED:
+            synctool.profiler.add_script(time.time() - t_start,
+                                      synctool.lib.prettypath(script))
+
         os.umask(077)
 
+    def queue_script(self, scripts_dict):
+        '''queue a .post script, if any, to run at the end of the phase
+        (see synctool.postqueue)
+        '''
+
+        if synctool.lib.NO_POST:
+            return
+
+        if not self.dest_path in scripts_dict:
+            return
+
+        script = scripts_dict[self.dest_path]
+
+        if self.dest_stat.is_dir():
+            # run in the directory itself
+            synctool.postqueue.add(script, self.dest_path)
+        else:
+            # run in the directory where the file is
+            synctool.postqueue.add(script, os.path.dirname(self.dest_path))
+
     def vnode_obj(self):
         '''create vnode object for this SyncObject'''
 
@@ -869,8 +1109,8 @@ class SyncObject(object):
         # This is only used for purge/
         # check() has already determined that the files are the same
         # Now only check the timestamp ...
-        # Note that SyncStat objects do not know the timestamps;
-        # they are not cached only to save memory
+        # Note that SyncStat objects do not know the atime;
+        # it is not cached only to save memory
         # So now we have to os.stat() again to get the times; it is
         # not a big problem because this func is used for purge_single only
 
@@ -52,6 +52,9 @@ OV_TEMPLATE_POST = 4
 OV_NO_EXT = 5
 OV_IGNORE = 6
 
+# resolved plans by overlay dir; see make_plan() and synctool.plan
+PLANS = {}
+
 
 def _sort_by_importance(item1, item2):
     '''item is a tuple (x, importance)'''
@@ -59,7 +62,7 @@ def _sort_by_importance(item1, item2):
     return cmp(item1[1], item2[1])
 
 
-def _toplevel(overlay):
+def _toplevel(overlay, silent=False):
     '''Returns sorted list of fullpath directories under overlay/'''
 
     arr = []
@@ -68,8 +71,9 @@ def _toplevel(overlay):
         try:
             importance = synctool.param.MY_GROUPS.index(entry)
         except ValueError:
-            verbose('%s/ is not one of my groups, skipping' %
-                    prettypath(fullpath))
+            if not silent:
+                verbose('%s/ is not one of my groups, skipping' %
+                        prettypath(fullpath))
             continue
 
         arr.append((fullpath, importance))
@@ -87,7 +91,7 @@ def _group_all():
     return len(synctool.param.MY_GROUPS) - 1
 
 
-def _split_extension(filename, src_dir):
+def _split_extension(filename, src_dir, silent=False):
     '''filename in the overlay tree, without leading path
     src_dir is passed for the purpose of printing error messages
     Returns tuple: SyncObject, importance
@@ -123,6 +127,9 @@ def _split_extension(filename, src_dir):
     try:
         importance = synctool.param.MY_GROUPS.index(ext)
     except ValueError:
+        if silent:
+            return None, -1
+
         if not ext in synctool.param.ALL_GROUPS:
             src_path = os.path.join(src_dir, filename)
             if synctool.param.TERSE:
@@ -207,18 +214,20 @@ def _sort_by_importance_post_first(item1, item2):
     return cmp(importance1, importance2)
 
 
-def _walk_subtree(src_dir, dest_dir, duplicates, callback):
-    '''walk subtree under overlay/group/
+def _scan_dir(src_dir, dest_dir, duplicates, silent=False):
+    '''list the entries in src_dir, and decide which ones are used
     duplicates is a set that keeps us from selecting any duplicate matches
-    Returns pair of booleans: ok, dir was updated
+    silent suppresses messages about ignored entries
+    Returns list of tuples: (SyncObject, is_dir, is_duplicate)
+    in the order in which they must be visited
     '''
 
-#    verbose('_walk_subtree(%s)' % src_dir)
-
     arr = []
     for entry in os.listdir(src_dir):
         if entry in synctool.param.IGNORE_FILES:
-            verbose('ignoring %s' % prettypath(os.path.join(src_dir, entry)))
+            if not silent:
+                verbose('ignoring %s' % prettypath(os.path.join(src_dir,
+                                                                entry)))
             continue
 
         # check any ignored files with wildcards
@@ -227,14 +236,15 @@ def _walk_subtree(src_dir, dest_dir, duplicates, callback):
         for wildcard_entry in synctool.param.IGNORE_FILES_WITH_WILDCARDS:
             if fnmatch.fnmatchcase(entry, wildcard_entry):
                 wildcard_match = True
-                verbose('ignoring %s (pattern match)' %
-                        prettypath(os.path.join(src_dir, entry)))
+                if not silent:
+                    verbose('ignoring %s (pattern match)' %
+                            prettypath(os.path.join(src_dir, entry)))
                 break
 
         if wildcard_match:
             continue
 
-        obj, importance = _split_extension(entry, src_dir)
+        obj, importance = _split_extension(entry, src_dir, silent)
         if not obj:
             continue
 
@@ -244,83 +254,56 @@ def _walk_subtree(src_dir, dest_dir, duplicates, callback):
     # this ensures that post_dict will have the required script when needed
     arr.sort(_sort_by_importance_post_first)
 
-    pre_dict = {}
-    post_dict = {}
-    dir_changed = False
+    entries = []
+    pre_scripts = set()
+    post_scripts = set()
 
     for obj, importance in arr:
         obj.make(src_dir, dest_dir)
 
         if obj.ov_type == OV_PRE:
-            # register the .pre script and continue
-            if obj.dest_path in pre_dict:
-                continue
-
-            pre_dict[obj.dest_path] = obj.src_path
-            continue
-
-        if obj.ov_type == OV_POST:
-            # register the .post script and continue
-            if obj.dest_path in post_dict:
-                continue
-
-            post_dict[obj.dest_path] = obj.src_path
+            if not obj.dest_path in pre_scripts:
+                pre_scripts.add(obj.dest_path)
+                entries.append((obj, False, False))
             continue
 
         if obj.ov_type == OV_TEMPLATE_POST:
-            # register the template generator and continue
             # put the dest for the template in the overlay (source) dir
             obj.dest_path = os.path.join(os.path.dirname(obj.src_path),
                                          os.path.basename(obj.dest_path))
-            if obj.dest_path in post_dict:
-                continue
 
-            post_dict[obj.dest_path] = obj.src_path
+        if obj.ov_type in (OV_POST, OV_TEMPLATE_POST):
+            if not obj.dest_path in post_scripts:
+                post_scripts.add(obj.dest_path)
+                entries.append((obj, False, False))
             continue
 
         if obj.src_stat.is_dir():
             if synctool.param.IGNORE_DOTDIRS:
                 name = os.path.basename(obj.src_path)
                 if name[0] == '.':
-                    verbose('ignoring dotdir %s' % obj.print_src())
+                    if not silent:
+                        verbose('ignoring dotdir %s' % obj.print_src())
                     continue
 
-            updated = False
-            if not obj.dest_path in duplicates:
-                # this is the most important source for this dir
-                duplicates.add(obj.dest_path)
-
-                # run callback on the directory itself
-                # this will create or fix directory entry if needed
-                # a .pre script may be run
-                # a .post script should not be run
-                ok, updated = callback(obj, pre_dict, {})
-                if not ok:
-                    # quick exit
-                    return False, dir_changed
-
-            # recurse down into the directory
-            # with empty pre_dict and post_dict parameters
-            ok, updated2 = _walk_subtree(obj.src_path, obj.dest_path,
-                                         duplicates, callback)
-            if not ok:
-                # quick exit
-                return False, dir_changed
-
-            # we still need to run the .post script on the dir (if any)
-            if updated or updated2:
-                obj.run_script(post_dict)
-
-            # finished checking directory
+            # the subtree is visited even when there already was
+            # a more important source for this dir
+            is_duplicate = obj.dest_path in duplicates
+            duplicates.add(obj.dest_path)
+            entries.append((obj, True, is_duplicate))
             continue
 
         if synctool.param.IGNORE_DOTFILES:
             name = os.path.basename(obj.src_path)
             if name[0] == '.':
-                verbose('ignoring dotfile %s' % obj.print_src())
+                if not silent:
+                    verbose('ignoring dotfile %s' % obj.print_src())
                 continue
 
         if synctool.param.REQUIRE_EXTENSION and obj.ov_type == OV_NO_EXT:
+            if silent:
+                continue
+
             if synctool.param.TERSE:
                 terse(synctool.lib.TERSE_ERROR, 'no group on %s' %
                                                 obj.src_path)
@@ -333,6 +316,64 @@ def _walk_subtree(src_dir, dest_dir, duplicates, callback):
             continue
 
         duplicates.add(obj.dest_path)
+        entries.append((obj, False, False))
+
+    return entries
+
+
+def _visit_entries(entries, src_dir, dest_dir, callback, recurse,
+                   want_dir=None):
+    '''call callback for the entries of a directory, as made by _scan_dir()
+    entries is a list of tuples: (SyncObject, is_dir, is_duplicate, arg)
+    For directories, recurse(obj, arg) visits the subtree,
+    unless want_dir(dest_path) says that it is of no interest
+    Returns pair of booleans: ok, dir was updated
+    '''
+
+    pre_dict = {}
+    post_dict = {}
+    dir_changed = False
+
+    for obj, is_dir, is_duplicate, arg in entries:
+        if obj.ov_type == OV_PRE:
+            # register the .pre script and continue
+            pre_dict[obj.dest_path] = obj.src_path
+            continue
+
+        if obj.ov_type in (OV_POST, OV_TEMPLATE_POST):
+            # register the .post script or template generator and continue
+            post_dict[obj.dest_path] = obj.src_path
+            continue
+
+        if is_dir:
+            updated = False
+            if not is_duplicate:
+                # this is the most important source for this dir
+                # run callback on the directory itself
+                # this will create or fix directory entry if needed
+                # a .pre script may be run
+                # a .post script should not be run
+                ok, updated = callback(obj, pre_dict, {})
+                if not ok:
+                    # quick exit
+                    return False, dir_changed
+
+            # recurse down into the directory
+            # with empty pre_dict and post_dict parameters
+            if want_dir is None or want_dir(obj.dest_path):
+                ok, updated2 = recurse(obj, arg)
+                if not ok:
+                    # quick exit
+                    return False, dir_changed
+            else:
+                updated2 = False
+
+            # we still need to run the .post script on the dir (if any)
+            if updated or updated2:
+                obj.queue_script(post_dict)
+
+            # finished checking directory
+            continue
 
         ok, updated = callback(obj, pre_dict, post_dict)
         if not ok:
@@ -359,17 +400,117 @@ def _walk_subtree(src_dir, dest_dir, duplicates, callback):
     return True, dir_changed
 
 
-def visit(overlay, callback):
+def _walk_subtree(src_dir, dest_dir, duplicates, callback, silent=False,
+                  want_dir=None):
+    '''walk subtree under overlay/group/
+    duplicates is a set that keeps us from selecting any duplicate matches
+    silent suppresses messages about ignored entries
+    Returns pair of booleans: ok, dir was updated
+    '''
+
+    def _recurse(obj, arg):
+        '''walk the subtree of a directory entry'''
+
+        return _walk_subtree(obj.src_path, obj.dest_path, duplicates,
+                             callback, silent, want_dir)
+
+    entries = [(obj, is_dir, is_duplicate, None)
+               for obj, is_dir, is_duplicate in _scan_dir(src_dir, dest_dir,
+                                                          duplicates, silent)]
+    return _visit_entries(entries, src_dir, dest_dir, callback, _recurse,
+                          want_dir)
+
+
+def _plan_subtree(src_dir, dest_dir, duplicates, silent=False):
+    '''Returns the plan for the subtree under overlay/group/
+    The plan is a list of tuples:
+      (src name, dest name, ov_type, is_dir, is_duplicate, subplan)
+    '''
+
+    plan = []
+    for obj, is_dir, is_duplicate in _scan_dir(src_dir, dest_dir,
+                                               duplicates, silent):
+        if is_dir:
+            subplan = _plan_subtree(obj.src_path, obj.dest_path, duplicates,
+                                    silent)
+        else:
+            subplan = None
+
+        plan.append((os.path.basename(obj.src_path),
+                     os.path.basename(obj.dest_path), obj.ov_type,
+                     is_dir, is_duplicate, subplan))
+
+    return plan
+
+
+def _replay_subtree(plan, src_dir, dest_dir, callback, want_dir=None):
+    '''visit the subtree under overlay/group/ as laid out in plan
+    Returns pair of booleans: ok, dir was updated
+    '''
+
+    entries = []
+    for src_name, dest_name, ov_type, is_dir, is_duplicate, subplan in plan:
+        obj = SyncObject(src_name, dest_name, ov_type)
+        obj.make(src_dir, dest_dir)
+        if ov_type == OV_TEMPLATE_POST:
+            obj.dest_path = os.path.join(src_dir, dest_name)
+
+        entries.append((obj, is_dir, is_duplicate, subplan))
+
+    def _recurse(obj, subplan):
+        '''replay the subtree of a directory entry'''
+
+        return _replay_subtree(subplan, obj.src_path, obj.dest_path,
+                               callback, want_dir)
+
+    return _visit_entries(entries, src_dir, dest_dir, callback, _recurse,
+                          want_dir)
+
+
+def make_plan(overlay, silent=False):
+    '''resolve the overlay tree for MY_GROUPS
+    Returns the plan: list of tuples (group dir, plan of its subtree)
+    which can be replayed by visit() when it is put into PLANS
+    '''
+
+    duplicates = set()
+
+    plan = []
+    for d in _toplevel(overlay, silent):
+        plan.append((os.path.basename(d),
+                     _plan_subtree(d, os.sep, duplicates, silent)))
+
+    return plan
+
+
+def visit(overlay, callback, silent=False, want_dir=None):
     '''visit all entries in the overlay tree
     overlay is either synctool.param.OVERLAY_DIR or synctool.param.DELETE_DIR
     callback will called with arguments: (SyncObject, pre_dict, post_dict)
     callback must return a two booleans: ok, updated
+    silent suppresses messages about ignored entries; use it when
+    the tree is visited more than once
+    want_dir is an optional function that tells whether a destination
+    directory is of interest; other subtrees are skipped
+    If there is a plan for the tree in PLANS, it is replayed
+    rather than walking the tree
     '''
 
+    if overlay in PLANS:
+        for group, plan in PLANS[overlay]:
+            ok, _ = _replay_subtree(plan, os.path.join(overlay, group),
+                                    os.sep, callback, want_dir)
+            if not ok:
+                # quick exit
+                break
+
+        return
+
     duplicates = set()
 
-    for d in _toplevel(overlay):
-        ok, _ = _walk_subtree(d, os.sep, duplicates, callback)
+    for d in _toplevel(overlay, silent):
+        ok, _ = _walk_subtree(d, os.sep, duplicates, callback, silent,
+                              want_dir)
         if not ok:
             # quick exit
             break
@@ -17,30 +17,126 @@ import os
 import sys
 import errno
 import time
+import mmap
+import struct
 
-from synctool.lib import error
+from synctool.lib import verbose, error
 from synctool.main.wrapper import catch_signals
 import synctool.param
 
 ALL_PIDS = set()
 
+# the shared work area starts with the index of the next work item,
+# followed by a slot per work item that holds its wall time
+COUNTER_FMT = 'L'
+COUNTER_SIZE = struct.calcsize(COUNTER_FMT)
+TIMING_FMT = 'd'
+TIMING_SIZE = struct.calcsize(TIMING_FMT)
+
+
+class WorkQueue(object):
+    '''work queue that is shared among forked worker processes
+    Workers take the next item as soon as they are done with the
+    previous one, so a slow node doesn't hold up any other work
+    '''
+
+    def __init__(self, len_work):
+        '''initialize instance'''
+
+        self.len_work = len_work
+
+        # anonymous mmap is shared with the children after fork()
+        self.area = mmap.mmap(-1, COUNTER_SIZE + len_work * TIMING_SIZE)
+        struct.pack_into(COUNTER_FMT, self.area, 0, 0)
+        for idx in xrange(len_work):
+            struct.pack_into(TIMING_FMT, self.area,
+                             COUNTER_SIZE + idx * TIMING_SIZE, -1.0)
+
+        # a pipe holding a single token byte acts as mutex
+        self.lock_rd, self.lock_wr = os.pipe()
+        os.write(self.lock_wr, '.')
+
+    def _lock(self):
+        '''grab the token'''
+
+        while True:
+            try:
+                os.read(self.lock_rd, 1)
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                raise
+            break
+
+    def _unlock(self):
+        '''put the token back'''
+
+        os.write(self.lock_wr, '.')
+
+    def next_item(self):
+        '''Returns index of the next work item, or -1 when done'''
+
+        self._lock()
+        try:
+            (idx,) = struct.unpack_from(COUNTER_FMT, self.area, 0)
+            if idx >= self.len_work:
+                return -1
+
+            struct.pack_into(COUNTER_FMT, self.area, 0, idx + 1)
+        finally:
+            self._unlock()
+
+        return idx
+
+    def set_timing(self, idx, elapsed):
+        '''record wall time of work item
+        No lock needed; every slot is written by a single worker only
+        '''
+
+        struct.pack_into(TIMING_FMT, self.area,
+                         COUNTER_SIZE + idx * TIMING_SIZE, elapsed)
+
+    def timings(self):
+        '''Returns list of wall times per work item
+        Items that did not run have a wall time of None
+        '''
+
+        arr = []
+        for idx in xrange(self.len_work):
+            (elapsed,) = struct.unpack_from(TIMING_FMT, self.area,
+                                            COUNTER_SIZE + idx * TIMING_SIZE)
+            if elapsed < 0:
+                elapsed = None
+            arr.append(elapsed)
+
+        return arr
+
+    def close(self):
+        '''release resources'''
+
+        os.close(self.lock_rd)
+        os.close(self.lock_wr)
+        self.area.close()
+
 
 def do(func, work):
-    '''run func in parallel'''
+    '''run func in parallel
+    Returns list of wall times (in seconds) per work item
+    '''
 
     if synctool.param.SLEEP_TIME != 0:
         synctool.param.NUM_PROC = 1
 
-    # 'part' becomes amount of work for each rank to do
     len_work = len(work)
+    if not len_work:
+        return []
+
     if len_work <= synctool.param.NUM_PROC:
         num_proc = len_work
-        part = 1
     else:
         num_proc = synctool.param.NUM_PROC
-        part = len_work / num_proc
-        if len_work % num_proc != 0:
-            part += 1
+
+    queue = WorkQueue(len_work)
 
     # spawn pool of workers
     for rank in xrange(num_proc):
@@ -48,11 +144,11 @@ def do(func, work):
             pid = os.fork()
         except OSError as err:
             error('failed to fork(): %s' % err.strerror)
-            return
+            break
 
         if pid == 0:
             # child process
-            worker(rank, func, work, part)
+            worker(rank, func, work, queue)
             sys.exit(0)
 
         # parent process
@@ -61,21 +157,27 @@ def do(func, work):
     # wait for all workers to exit
     join()
 
+    timings = queue.timings()
+    queue.close()
+    return timings
+
 
 @catch_signals
-def worker(rank, func, work, part):
-    '''run func to do part of work for parallel rank'''
+def worker(rank, func, work, queue):
+    '''run func on work items, taking them from the queue'''
 
-    # determine which chunk of work to do
-    lower = part * rank
-    upper = part * (rank + 1)
-    len_work = len(work)
-    if upper > len_work:
-        upper = len_work
+    while True:
+        idx = queue.next_item()
+        if idx < 0:
+            break
 
-    # run all work items in sequence
-    for item in work[lower:upper]:
+        item = work[idx]
+        t_start = time.time()
         func(item)
+        elapsed = time.time() - t_start
+        queue.set_timing(idx, elapsed)
+        verbose('[%d] %s took %.3f seconds' % (rank, item, elapsed))
+
         # this is for option --zzz
         if synctool.param.SLEEP_TIME > 0:
             time.sleep(synctool.param.SLEEP_TIME)
@@ -113,7 +215,8 @@ if __name__ == '__main__':
             time.sleep(0.1245)
 
         synctool.param.NUM_PROC = 3
-        do(hello, range(10))
+        timings = do(hello, range(10))
+        print 'timings:', timings
 
 #    synctool.param.SLEEP_TIME = 2
     main()
@@ -35,6 +35,7 @@ DELETE_LEN = 0
 PURGE_DIR = None
 PURGE_LEN = 0
 SCRIPT_DIR = None
+CACHE_DIR = None
 TEMP_DIR = '/tmp/synctool'
 HOSTNAME = None
 NODENAME = None
@@ -50,9 +51,14 @@ PKG_CMD = None
 PACKAGE_MANAGER = None
 
 NUM_PROC = 16       # use sensible default
+EVENT_DRIVEN = False    # run commands from a single process
+CLIENT_NUM_PROC = 1 # threads for comparing files on the client
+POST_NUM_PROC = 1   # .post scripts that may run at the same time
 SLEEP_TIME = 0
 
 CONTROL_PERSIST = '1h'
+SHARE_SSH_SESSION = False   # one ssh handshake for rsync + synctool-client
+AUTO_MULTIPLEX = False      # start ssh master connections on demand
 REQUIRE_EXTENSION = True
 BACKUP_COPIES = True
 SYSLOGGING = True
@@ -63,6 +69,15 @@ IGNORE_DOTDIRS = False
 IGNORE_FILES = set()
 IGNORE_FILES_WITH_WILDCARDS = []
 
+# keep a parsed copy of the config in CACHE_DIR
+CONFIG_CACHE = False
+# keep a manifest of checksums in CACHE_DIR
+MANIFEST = False
+# keep the output of template generators in CACHE_DIR
+TEMPLATE_CACHE = False
+# environment variables, besides SYNCTOOL_*, that the cached output depends on
+TEMPLATE_CACHE_ENV = set()
+
 # default_nodeset parameter in the config file
 # warning: make_default_nodeset() is only called by commands that are
 # supposed to run on the master node
@@ -83,6 +98,15 @@ SLAVES = set()
 #
 NODES = {}
 
+# index of NODES, made by synctool.config.make_group_index()
+# dict of sets of nodes by group, and of sets of groups by node
+#
+#   NODES_BY_GROUP[group] -> frozenset of nodes
+#   GROUPS_BY_NODE[node] -> frozenset of groups
+#
+NODES_BY_GROUP = None
+GROUPS_BY_NODE = None
+
 # dict of ipaddresses by nodename
 #
 #   IPADDRESSES[node] -> ipaddress
@@ -159,7 +183,7 @@ def init():
 
     global ROOTDIR, CONF_FILE
     global VAR_DIR, VAR_LEN, OVERLAY_DIR, OVERLAY_LEN, DELETE_DIR, DELETE_LEN
-    global PURGE_DIR, PURGE_LEN, SCRIPT_DIR, ORIG_UMASK
+    global PURGE_DIR, PURGE_LEN, SCRIPT_DIR, CACHE_DIR, ORIG_UMASK
 
     base = os.path.abspath(os.path.dirname(sys.argv[0]))
     if not base:
@@ -178,6 +202,7 @@ def init():
     PURGE_DIR = os.path.join(VAR_DIR, 'purge')
     PURGE_LEN = len(PURGE_DIR) + 1
     SCRIPT_DIR = os.path.join(ROOTDIR, 'scripts')
+    CACHE_DIR = os.path.join(VAR_DIR, 'cache')
 
     # the following only makes sense for synctool-client, but OK
 
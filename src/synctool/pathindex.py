@@ -0,0 +1,171 @@
+#
+#   synctool.pathindex.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''index of destination paths, as given with --single, --diff, --ref
+and --upload. The paths may be terse paths like "//etc/.../file".
+Full paths are looked up in a dict; terse paths are looked up in a
+trie of path components, starting at the end of the path, after which
+only the beginning of the path needs to be compared.
+The index also tells which directories may hold any of the paths,
+so that overlay.visit() can skip all other subtrees
+'''
+
+import os
+
+
+class PathIndex(object):
+    '''set of destination paths, some of which may be terse'''
+
+    def __init__(self, paths=None):
+        '''initialize instance'''
+
+        # all paths in the order in which they were added
+        self.order = []
+        # paths that have not been matched yet
+        self.remaining = set()
+        # full path -> path as given
+        self.exact = {}
+        # trie node: (dict of child nodes by path component,
+        #             list of (seq, prefix, terse path))
+        self.trie = ({}, [])
+        # dirs that may hold any of the paths
+        self.dirs = set()
+        # dirs under which a terse path may match anything
+        self.prefix_dirs = set()
+
+        if paths is not None:
+            for path in paths:
+                self.add(path)
+
+    def add(self, path):
+        '''add path to the index'''
+
+        if path in self.remaining:
+            return
+
+        seq = len(self.order)
+        self.order.append(path)
+        self.remaining.add(path)
+
+        if path[:2] != os.sep + os.sep:
+            self._add_exact(path, path)
+            return
+
+        idx = path.find(os.sep + '...' + os.sep)
+        if idx == -1:
+            # a very short terse path
+            self._add_exact(path[1:], path)
+            return
+
+        prefix = path[1:idx + 1]
+        suffix = path[idx + 4:]
+
+        node = self.trie
+        for comp in reversed(suffix.split(os.sep)[1:]):
+            node = node[0].setdefault(comp, ({}, []))
+        node[1].append((seq, prefix, path))
+
+        if prefix[-1:] == os.sep:
+            prefix_dir = prefix[:-1] or os.sep
+        else:
+            prefix_dir = os.path.dirname(prefix)
+
+        self.prefix_dirs.add(prefix_dir)
+        self._add_dir(prefix_dir)
+
+    def _add_exact(self, full_path, path):
+        '''add full path'''
+
+        if not full_path in self.exact:
+            self.exact[full_path] = path
+
+        self._add_dir(os.path.dirname(full_path))
+
+    def _add_dir(self, dirname):
+        '''add dir and all of its parents'''
+
+        while not dirname in self.dirs:
+            self.dirs.add(dirname)
+            parent = os.path.dirname(dirname)
+            if parent == dirname:
+                break
+
+            dirname = parent
+
+    def match(self, path):
+        '''Returns the indexed path that path matches, or None
+        Full paths take precedence over terse paths
+        '''
+
+        if path in self.exact and self.exact[path] in self.remaining:
+            return self.exact[path]
+
+        best = None
+        node = self.trie
+        for comp in reversed(path.split(os.sep)[1:]):
+            if not comp in node[0]:
+                break
+
+            node = node[0][comp]
+            for seq, prefix, terse_path in node[1]:
+                if (path[:len(prefix)] == prefix and
+                        terse_path in self.remaining and
+                        (best is None or seq < best[0])):
+                    best = (seq, terse_path)
+
+        if best is None:
+            return None
+
+        return best[1]
+
+    def remove(self, path):
+        '''remove path, as given, from the index'''
+
+        self.remaining.discard(path)
+
+    def want_dir(self, dirname):
+        '''Returns True if dirname may hold any of the paths'''
+
+        if dirname in self.dirs:
+            return True
+
+        while True:
+            if dirname in self.prefix_dirs:
+                return True
+
+            parent = os.path.dirname(dirname)
+            if parent == dirname:
+                return False
+
+            dirname = parent
+
+    def __contains__(self, path):
+        '''Returns True if path, as given, is in the index'''
+
+        return path in self.remaining
+
+    def __iter__(self):
+        '''iterate over the paths that have not been matched'''
+
+        for path in self.order:
+            if path in self.remaining:
+                yield path
+
+    def __len__(self):
+        '''Returns number of paths that have not been matched'''
+
+        return len(self.remaining)
+
+    def __nonzero__(self):
+        '''Returns True if any paths have not been matched'''
+
+        return len(self.remaining) > 0
+
+# EOB
@@ -0,0 +1,211 @@
+#
+#   synctool.plan.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''the master resolves the overlay and delete trees in advance:
+which source is chosen for every destination, and which .pre and .post
+scripts apply. Such a plan only depends on the groups of the node that
+are used in the repository, so nodes with the same groups share a plan.
+Plans are kept in $SYNCTOOL/var/plan/ and are copied to the nodes along
+with the repository; synctool-client --plan replays the plan rather
+than listing all directories in the repository
+
+The files are written with marshal, like the config cache
+'''
+
+import os
+import errno
+import hashlib
+import marshal
+
+import synctool.config
+from synctool.lib import verbose, error
+import synctool.overlay
+import synctool.param
+
+# change this whenever the format of the plan changes
+PLAN_VERSION = 1
+
+
+def plan_dir():
+    '''Returns path of the directory holding the plans'''
+
+    return os.path.join(synctool.param.VAR_DIR, 'plan')
+
+
+def _extensions(filename):
+    '''Returns list of group extensions in filename'''
+
+    groups = []
+    name, ext = os.path.splitext(filename)
+    if ext in ('.pre', '.post'):
+        name, ext = os.path.splitext(name)
+
+    if ext[:2] == '._' and len(ext) > 2:
+        groups.append(ext[2:])
+
+    return groups
+
+
+def used_groups():
+    '''Returns set of groups that are used in the overlay and delete trees,
+    either as group dir or as extension
+    '''
+
+    groups = set(['all'])
+
+    for overlay in (synctool.param.OVERLAY_DIR, synctool.param.DELETE_DIR):
+        try:
+            entries = os.listdir(overlay)
+        except OSError:
+            continue
+
+        groups.update(entries)
+
+        for entry in entries:
+            for _, dirs, files in os.walk(os.path.join(overlay, entry)):
+                for name in dirs:
+                    groups.update(_extensions(name))
+                for name in files:
+                    groups.update(_extensions(name))
+
+    return groups
+
+
+def signature(groups, used):
+    '''Returns tuple of the groups that matter for the plan
+    Only their order matters, so the plan is the same for all
+    nodes that have these groups in the same order
+    '''
+
+    return tuple([g for g in groups if g in used])
+
+
+def _plan_name(sig):
+    '''Returns filename for the plan with signature sig'''
+
+    return hashlib.md5('\n'.join(sig)).hexdigest()
+
+
+def make_plans(nodenames):
+    '''make the plans for all nodes
+    Returns dict: nodename -> filename of the plan (without path)
+    or None on error
+    '''
+
+    used = used_groups()
+
+    directory = plan_dir()
+    try:
+        os.mkdir(directory, 0755)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            error('failed to create %s: %s' % (directory, err.strerror))
+            return None
+
+    orig_my_groups = synctool.param.MY_GROUPS
+    sorted_used = sorted(used)
+
+    plans = {}
+    by_node = {}
+    try:
+        for nodename in nodenames:
+            sig = signature(synctool.config.get_groups(nodename), used)
+            if not sig in plans:
+                # messages about the repository are shown only once
+                synctool.param.MY_GROUPS = list(sig)
+                data = (PLAN_VERSION, synctool.param.VERSION, sig,
+                        sorted_used,
+                        synctool.overlay.make_plan(
+                            synctool.param.OVERLAY_DIR, len(plans) > 0),
+                        synctool.overlay.make_plan(
+                            synctool.param.DELETE_DIR, True))
+
+                name = _plan_name(sig)
+                if not _write(os.path.join(directory, name), data):
+                    return None
+
+                plans[sig] = name
+
+            by_node[nodename] = plans[sig]
+    finally:
+        synctool.param.MY_GROUPS = orig_my_groups
+
+    # remove the plans of earlier runs
+    names = set(plans.values())
+    for name in os.listdir(directory):
+        if not name in names:
+            try:
+                os.unlink(os.path.join(directory, name))
+            except OSError:
+                pass
+
+    verbose('made %d plans for %d nodes' % (len(plans), len(by_node)))
+    return by_node
+
+
+def _write(filename, data):
+    '''write plan to file
+    Returns False on error
+    '''
+
+    tmp_filename = '%s.%d' % (filename, os.getpid())
+    try:
+        with open(tmp_filename, 'wb') as f:
+            marshal.dump(data, f)
+
+        os.rename(tmp_filename, filename)
+    except (IOError, OSError) as err:
+        error('failed to write plan %s: %s' % (filename, err.strerror))
+        try:
+            os.unlink(tmp_filename)
+        except OSError:
+            pass
+
+        return False
+
+    return True
+
+
+def load(name):
+    '''load plan for this node
+    The plan is only used when it was made for the groups of this node
+    Returns True on success, False if the trees must be walked
+    '''
+
+    filename = os.path.join(plan_dir(), os.path.basename(name))
+    try:
+        with open(filename, 'rb') as f:
+            data = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        verbose('not using plan %s' % filename)
+        return False
+
+    try:
+        (version, synctool_version, sig, used, overlay_plan,
+         delete_plan) = data
+    except (TypeError, ValueError):
+        verbose('ignoring corrupt plan %s' % filename)
+        return False
+
+    if version != PLAN_VERSION or synctool_version != synctool.param.VERSION:
+        verbose('not using plan %s: version mismatch' % filename)
+        return False
+
+    if signature(synctool.param.MY_GROUPS, set(used)) != sig:
+        verbose('not using plan %s: it was made for other groups' %
+                filename)
+        return False
+
+    synctool.overlay.PLANS[synctool.param.OVERLAY_DIR] = overlay_plan
+    synctool.overlay.PLANS[synctool.param.DELETE_DIR] = delete_plan
+    verbose('using plan %s' % filename)
+    return True
+
+# EOB
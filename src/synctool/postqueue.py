@@ -0,0 +1,165 @@
+#
+#   synctool.postqueue.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''.post scripts are queued rather than run right away, and run() runs
+them at the end of a phase. A script that is triggered many times for
+the same directory (for example, by a symlinked .post script for every
+file in it) runs only once.
+
+With post_num_proc > 1, scripts run in parallel when their directories
+are unrelated. Scripts for the same directory, or for a directory and
+any of its subdirectories, still run one after another, in the order
+in which they were triggered.
+'''
+
+import os
+import time
+import threading
+import Queue
+
+import synctool.lib
+from synctool.lib import verbose, unix_out
+import synctool.param
+import synctool.profiler
+
+# list of (script, work_dir) in the order in which they were triggered
+QUEUE = []
+
+# set of (real path of script, work_dir) that are in the queue
+QUEUED = set()
+
+
+def add(script, work_dir):
+    '''queue script to run in work_dir'''
+
+    key = (os.path.realpath(script), work_dir)
+    if key in QUEUED:
+        verbose('  %s already queued for %s' %
+                (synctool.lib.prettypath(script), work_dir))
+        return
+
+    QUEUED.add(key)
+    QUEUE.append((script, work_dir))
+
+
+def _related(dir1, dir2):
+    '''Returns True if dir1 and dir2 are the same, or if either one
+    is a subdirectory of the other
+    '''
+
+    if dir1 == dir2 or dir1 == os.sep or dir2 == os.sep:
+        return True
+
+    return (dir1.startswith(dir2 + os.sep) or
+            dir2.startswith(dir1 + os.sep))
+
+
+def _chains(scripts):
+    '''split list of (script, work_dir) into chains of scripts
+    that must run in order; the chains may run in parallel
+    Returns list of lists of (script, work_dir)
+    '''
+
+    # chains hold (index, script, work_dir)
+    chains = []
+    for idx, (script, work_dir) in enumerate(scripts):
+        chain = [(idx, script, work_dir)]
+        others = []
+        for other in chains:
+            if any(_related(work_dir, x[2]) for x in other):
+                chain.extend(other)
+            else:
+                others.append(other)
+
+        chain.sort()
+        others.append(chain)
+        chains = others
+
+    # the chain holding the first script goes first
+    chains.sort()
+    return [[(x[1], x[2]) for x in chain] for chain in chains]
+
+
+def _run_script(script, work_dir):
+    '''run the script in work_dir
+    The working directory is passed to the child process rather than
+    changed with os.chdir(), so this is safe to call from threads
+    '''
+
+    verbose('  cwd: %s' % work_dir)
+    unix_out('cd %s' % work_dir)
+
+    t_start = time.time()
+    synctool.lib.run_command(script, cwd=work_dir)
+    if synctool.profiler.ENABLED:
+        synctool.profiler.add_script(time.time() - t_start,
+                                     synctool.lib.prettypath(script))
+
+    unix_out('cd -')
+    unix_out('')
+
+
+def _worker(queue):
+    '''run chains of scripts, taken from the queue'''
+
+    while True:
+        try:
+            chain = queue.get_nowait()
+        except Queue.Empty:
+            break
+
+        for script, work_dir in chain:
+            _run_script(script, work_dir)
+
+
+def run():
+    '''run all queued scripts'''
+
+    if not QUEUE:
+        return
+
+    scripts = QUEUE[:]
+    del QUEUE[:]
+    QUEUED.clear()
+
+    if synctool.lib.NO_POST:
+        return
+
+    # temporarily restore original umask
+    # so the scripts run with the umask set by the sysadmin
+    os.umask(synctool.param.ORIG_UMASK)
+
+    chains = _chains(scripts)
+    num_threads = min(synctool.param.POST_NUM_PROC, len(chains))
+    if num_threads <= 1 or synctool.lib.DRY_RUN:
+        for script, work_dir in scripts:
+            _run_script(script, work_dir)
+    else:
+        verbose('running %d .post scripts in %d chains with %d threads' %
+                (len(scripts), len(chains), num_threads))
+        queue = Queue.Queue()
+        for chain in chains:
+            queue.put(chain)
+
+        threads = []
+        for _ in xrange(num_threads):
+            t = threading.Thread(target=_worker, args=(queue,))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        for t in threads:
+            # join with a timeout so that Ctrl-C still works
+            while t.isAlive():
+                t.join(1.0)
+
+    os.umask(077)
+
+# EOB
@@ -0,0 +1,109 @@
+#
+#   synctool.prefetch.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''compare files in advance using a pool of threads
+Comparing file contents is mostly waiting for I/O, so a number of
+threads can keep the disks busy while the overlay tree is walked.
+The results are picked up by VNodeFile.compare() during the real run.
+Results are only used when neither file changed in the meantime,
+so .pre and .post scripts touching files do no harm.
+'''
+
+import hashlib
+import threading
+import Queue
+
+import synctool.lib
+import synctool.param
+
+# dict of results by destination path:
+#   RESULTS[dest_path] -> (src_path, src_key, dest_key, same, md5)
+# where a key is a tuple (size, mtime, ctime, inode number)
+RESULTS = {}
+
+
+def _stat_key(stat):
+    '''Returns tuple that identifies the version of a file'''
+
+    return (stat.size, stat.mtime, stat.ctime, stat.ino)
+
+
+def compare(objs, num_threads):
+    '''compare list of (src_path, src_stat, dest_path, dest_stat)
+    using num_threads threads
+    '''
+
+    if not objs:
+        return
+
+    queue = Queue.Queue()
+    for item in objs:
+        queue.put(item)
+
+    threads = []
+    for _ in xrange(min(num_threads, len(objs))):
+        t = threading.Thread(target=_worker, args=(queue,))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    for t in threads:
+        # join with a timeout so that Ctrl-C still works
+        while t.isAlive():
+            t.join(1.0)
+
+
+def _worker(queue):
+    '''compare files taken from queue until it is empty'''
+
+    while True:
+        try:
+            src_path, src_stat, dest_path, dest_stat = queue.get_nowait()
+        except Queue.Empty:
+            break
+
+        if synctool.param.MANIFEST:
+            digest = hashlib.md5()
+        else:
+            digest = None
+
+        try:
+            same = synctool.lib.compare_files(src_path, dest_path, digest)
+        except IOError:
+            # leave it; the error will be reported during the real run
+            continue
+
+        if digest is not None and same:
+            md5 = digest.hexdigest()
+        else:
+            md5 = None
+
+        # assignment of a dict item is atomic
+        RESULTS[dest_path] = (src_path, _stat_key(src_stat),
+                              _stat_key(dest_stat), same, md5)
+
+
+def lookup(src_path, dest_path, src_stat, dest_stat):
+    '''look up the result of comparing src_path and dest_path
+    Returns tuple: (same, md5)
+    or None if not compared or if any of the files changed
+    '''
+
+    if not dest_path in RESULTS:
+        return None
+
+    r_src_path, src_key, dest_key, same, md5 = RESULTS[dest_path]
+    if (r_src_path != src_path or src_key != _stat_key(src_stat) or
+            dest_key != _stat_key(dest_stat)):
+        return None
+
+    return same, md5
+
+# EOB
@@ -0,0 +1,176 @@
+#
+#   synctool.profiler.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''profiling of synctool-client
+Enable with option --profile, or by setting environment variable
+SYNCTOOL_PROFILE. It records the wall and CPU time per phase,
+the number of stat calls, opened files and bytes read, and
+the slowest checks and scripts.
+If SYNCTOOL_PROFILE_DUMP is set to a filename, cProfile data
+is written to that file
+
+When run from the master, the summary is printed with a magic prefix
+so that the master can pick it up
+'''
+
+import os
+import time
+import heapq
+import threading
+
+import synctool.lib
+
+ENABLED = False
+
+# number of checks and scripts shown in the summary
+TOP_N = 5
+
+# list of (phase, wall time, cpu time, cpu time of child processes)
+PHASES = []
+
+# counters; only updated when ENABLED
+STAT_CALLS = 0
+FILES_OPENED = 0
+BYTES_READ = 0
+
+# heaps of (elapsed, name), holding the slowest ones
+SLOWEST_CHECKS = []
+SLOWEST_SCRIPTS = []
+# .post scripts may run in threads
+SLOWEST_LOCK = threading.Lock()
+
+# cProfile object (if dumping profile data)
+PROFILER = None
+
+
+def init(enable=False):
+    '''enable profiling if so requested'''
+
+    global ENABLED, PROFILER
+
+    if os.environ.get('SYNCTOOL_PROFILE'):
+        enable = True
+
+    ENABLED = enable
+    if not ENABLED:
+        return
+
+    dump_file = os.environ.get('SYNCTOOL_PROFILE_DUMP')
+    if dump_file:
+        import cProfile
+
+        PROFILER = cProfile.Profile()
+
+
+def _cpu_times():
+    '''Returns tuple: (cpu time, cpu time of child processes)'''
+
+    t = os.times()
+    return t[0] + t[1], t[2] + t[3]
+
+
+class Phase(object):
+    '''context manager that times a phase of the run'''
+
+    def __init__(self, name):
+        '''initialize instance'''
+
+        self.name = name
+        self.t_start = self.cpu_start = self.child_start = None
+
+    def __enter__(self):
+        '''start timing'''
+
+        if ENABLED:
+            self.t_start = time.time()
+            self.cpu_start, self.child_start = _cpu_times()
+            if PROFILER is not None:
+                PROFILER.enable()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        '''stop timing'''
+
+        if ENABLED:
+            if PROFILER is not None:
+                PROFILER.disable()
+
+            cpu, child = _cpu_times()
+            PHASES.append((self.name, time.time() - self.t_start,
+                           cpu - self.cpu_start, child - self.child_start))
+
+        # do not suppress exceptions
+        return False
+
+
+def _add_slowest(heap, elapsed, name):
+    '''keep the TOP_N slowest in heap'''
+
+    with SLOWEST_LOCK:
+        if len(heap) < TOP_N:
+            heapq.heappush(heap, (elapsed, name))
+        elif elapsed > heap[0][0]:
+            heapq.heapreplace(heap, (elapsed, name))
+
+
+def add_check(elapsed, name):
+    '''record time taken by SyncObject.check()'''
+
+    _add_slowest(SLOWEST_CHECKS, elapsed, name)
+
+
+def add_script(elapsed, name):
+    '''record time taken by a .post script or template generator'''
+
+    _add_slowest(SLOWEST_SCRIPTS, elapsed, name)
+
+
+def _out(msg):
+    '''print line of the summary'''
+
+    if synctool.lib.MASTERLOG:
+        # print it with magic prefix,
+        # synctool-master will pick it up
+        print '%synctool-profile%', msg
+    else:
+        print 'profile:', msg
+
+
+def finish():
+    '''print summary, and dump cProfile data'''
+
+    if not ENABLED:
+        return
+
+    for name, wall, cpu, child in PHASES:
+        _out('%s took %.3f seconds (cpu %.3f, children %.3f)' %
+             (name, wall, cpu, child))
+
+    _out('%d stat calls, %d files opened, %d bytes read' %
+         (STAT_CALLS, FILES_OPENED, BYTES_READ))
+
+    for elapsed, name in sorted(SLOWEST_CHECKS, reverse=True):
+        _out('check %s took %.3f seconds' % (name, elapsed))
+
+    for elapsed, name in sorted(SLOWEST_SCRIPTS, reverse=True):
+        _out('script %s took %.3f seconds' % (name, elapsed))
+
+    if PROFILER is not None:
+        dump_file = os.environ['SYNCTOOL_PROFILE_DUMP']
+        try:
+            PROFILER.dump_stats(dump_file)
+        except (IOError, OSError) as err:
+            synctool.lib.error('failed to write profile data %s: %s' %
+                               (dump_file, err.strerror))
+        else:
+            _out('profile data written to %s' % dump_file)
+
+# EOB
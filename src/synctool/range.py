@@ -19,6 +19,8 @@ or just a string "node-[10].sub[20].domain.org"
 '''
 
 import re
+import sys
+import bisect
 
 # a node expression may look like 'node1-[1,2,8-10/2]-mgmt'
 # or something somewhat resembling that
@@ -52,6 +54,10 @@ COMPRESSOR = re.compile(r'^([a-zA-Z0-9_+-]*[a-zA-Z_+-]+)'
                         r'(\d+)'
                         r'([a-zA-Z_+-]*)$')
 
+# this splits a name at its last number, like "r1n" "8" "-mgmt"
+# and is used by RangeSet
+NAME_NUMBER = re.compile(r'^(.*?)(\d+)(\D*)$')
+
 # state used for automatic numbering of IP ranges
 _EXPAND_SEQ = 0
 
@@ -98,6 +104,20 @@ def expand(expr):
 
     (prefix, range_expr, postfix) = m.groups()
 
+    arr = []
+    for start, end, step, width in _range_elements(range_expr):
+        arr.extend(['%s%.*d%s' % (prefix, width, num, postfix)
+                    for num in range(start, end + 1, step)])
+
+    return arr
+
+
+def _range_elements(range_expr):
+    '''split the range part of an expression like '1-10,20,30-40/2'
+    May throw RangeSyntaxError if there is a syntax error
+    Returns list of tuples: (start, end, step, width)
+    '''
+
     # first split range expression by comma
     # then process each element
 
@@ -139,8 +159,7 @@ def expand(expr):
             if end - start > 100000:
                 raise RangeSyntaxError('ignoring ridiculously large range')
 
-            arr.extend(['%s%.*d%s' % (prefix, width, num, postfix)
-                        for num in range(start, end + 1, step)])
+            arr.append((start, end, step, width))
         else:
             width = len(elem)
             try:
@@ -148,7 +167,7 @@ def expand(expr):
             except ValueError:
                 raise RangeSyntaxError('syntax error in range expression')
 
-            arr.append('%s%.*d%s' % (prefix, width, num, postfix))
+            arr.append((num, num, 1, width))
 
     return arr
 
@@ -237,137 +256,345 @@ def expand_seq(arg, radix=10, overflow=False):
     return result
 
 
-def _sort_compress(a, b):
-    '''sorting function
-    a and b are tuples: (nodename, prefix, number_str, number, postfix)
+def compress(nodelist):
+    '''Return comma-separated list of nodes, using range syntax
+
+    This is the opposite of function expand()
+    It can not do step-notation but it's good at finding sequences
+    like "n[1-5,7,8]"
+    The result does not depend on the order of nodelist
     '''
 
-    if a[1] != b[1]:
-        # sort by prefix
-        return cmp(a[1], b[1])
+    # make sort keys: (prefix, postfix, length of number, number, number_str)
+    # Node names that can not be put in a range have number -1
+    keys = []
+    match = COMPRESSOR.match
+    for node in set(nodelist):
+        m = match(node)
+        # the prefix must be valid for expand(), too
+        if m is None or not node[0].isalpha():
+            keys.append((node, '', 0, -1, node))
+        else:
+            prefix, number_str, postfix = m.groups()
+            keys.append((prefix, postfix, len(number_str), int(number_str),
+                         number_str))
+
+    keys.sort()
+
+    out = []
+    # nodes in the current group: same prefix and postfix
+    group = []
+    prev_prefix = prev_postfix = None
+    for key in keys:
+        prefix, postfix, _, num, node = key
+        if num < 0:
+            # no number in node name
+            _compress_group(group, out)
+            group = []
+            prev_prefix = prev_postfix = None
+            out.append(node)
+            continue
+
+        if prefix != prev_prefix or postfix != prev_postfix:
+            _compress_group(group, out)
+            group = []
+            prev_prefix = prefix
+            prev_postfix = postfix
 
-    if a[3] != b[3]:
-        # sort by postfix
-        return cmp(a[3], b[3])
+        group.append(key)
 
-    if len(a[2]) != len(b[2]):
-        # sort by length number_str
-        return cmp(len(a[2]), len(b[2]))
+    _compress_group(group, out)
 
-    if a[3] != b[3]:
-        # sort by number
-        return cmp(a[3], b[3])
+    # return comma-separated string of node ranges
+    return ','.join(out)
 
-    # lastly, sort by node name
-    return cmp(a[0], b[0])
 
+def _compress_group(group, out):
+    '''add range syntax for sorted list of keys to out
+    All keys in group have the same prefix and postfix
+    '''
 
-def uniq(seq):
-    '''remove duplicates from set, preserving order'''
+    if not group:
+        return
+
+    prefix, postfix = group[0][:2]
+
+    if len(group) == 1:
+        # add single node name
+        out.append(prefix + group[0][4] + postfix)
+        return
+
+    parts = []
+    # a sequence is written as "start-end", and expand() formats all
+    # numbers in it with the width of the start number
+    # so a number only belongs to the sequence if that gives the same string
+    seq = []
+    width = 0
+    for _, _, _, num, number_str in group:
+        if (seq and num == seq[-1][0] + 1 and
+                (len(number_str) == width or
+                 number_str == '%.*d' % (width, num))):
+            seq.append((num, number_str))
+            continue
 
-    # mostly taken from StackOverflow
+        _add_sequence(seq, parts)
+        seq = [(num, number_str)]
+        width = len(number_str)
 
-    seen = set()
-    return [x for x in seq if not (x in seen or seen.add(x))]
+    _add_sequence(seq, parts)
 
+    out.append(prefix + '[' + ','.join(parts) + ']' + postfix)
 
-def compress(nodelist):
-    '''Return comma-separated list of nodes, using range syntax
 
-    This is the opposite of function expand()
-    It can not do step-notation but it's good at finding sequences
-    like "n[1-5,7,8]"
+def _add_sequence(seq, parts):
+    '''add sequence of (number, number_str) to parts of range syntax'''
+
+    if not seq:
+        return
+
+    if len(seq) <= 2:
+        parts.extend([number_str for _, number_str in seq])
+    else:
+        parts.append(seq[0][1] + '-' + seq[-1][1])
+
+
+class RangeSet(object):
+    '''set of node names that keeps numbered names as intervals
+    so that large ranges need not be expanded
+    Names are only made when iterating over the set
+
+    A numbered name is split at its last number. Names with the same
+    prefix, postfix, and length of the number share a list of intervals
     '''
 
-    # make all_grouped a list of lists, of grouped splitted nodenames
-    all_grouped = []
-    grouped = []
-    prev_prefix = prev_postfix = None
-    for node in uniq(nodelist):
-        # try to match a number in the nodename
-        m = COMPRESSOR.match(node)
-        if not m:
-            # no number in node name
-            if len(grouped) > 0:
-                grouped.sort(_sort_compress)
-                all_grouped.append(grouped[:],)
-                grouped = []
-
-            grouped = [(node, '', '0', 0, ''),]
-            all_grouped.append(grouped[:],)
-            grouped = []
-            prev_prefix = prev_postfix = None
+    def __init__(self, names=None):
+        '''initialize instance'''
+
+        # names without a number
+        self.names = set()
+        # dict of intervals: (prefix, postfix, width) -> [(start, end), ...]
+        self.intervals = {}
+        # keys whose intervals still need to be sorted and merged
+        self.unsorted = set()
+
+        if names is not None:
+            self.update(names)
+
+    def add(self, elem):
+        '''add a node name or a range expression
+        May throw RangeSyntaxError if there is a syntax error
+        '''
+
+        if '[' in elem:
+            self._add_range(elem)
         else:
-            # group nodes with the same prefix and postfix together
-            prefix, number, postfix = m.groups()
-            if prefix == prev_prefix and postfix == prev_postfix:
-                grouped.append((node, prefix, number, int(number), postfix),)
+            self._add_name(elem)
+
+    def update(self, names):
+        '''add all names (not range expressions) of a set or RangeSet'''
+
+        if not isinstance(names, RangeSet):
+            for name in names:
+                self._add_name(name)
+            return
+
+        self.names |= names.names
+        for key, intervals in names.intervals.iteritems():
+            if key in self.intervals:
+                self.intervals[key].extend(intervals)
             else:
-                if len(grouped) > 0:
-                    grouped.sort(_sort_compress)
-                    all_grouped.append(grouped[:],)
-                    grouped = []
+                self.intervals[key] = intervals[:]
+            self.unsorted.add(key)
 
-                grouped.append((node, prefix, number, int(number), postfix),)
-                prev_prefix = prefix
-                prev_postfix = postfix
+    def difference_update(self, names):
+        '''remove all names of a set or RangeSet'''
 
-    if len(grouped) > 0:
-        grouped.sort(_sort_compress)
-        all_grouped.append(grouped[:],)
-        grouped = []
+        if not isinstance(names, RangeSet):
+            names = RangeSet(names)
 
-    # make out, a list of strings (with range-based node syntax)
-    out = []
-    for arr in all_grouped:
-        (node, prefix, number_str, num, postfix) = arr[0]
-        if len(arr) == 1:
-            # add single node name
-            out.append(node)
-            continue
+        self.names -= names.names
+        for key in names.intervals:
+            if not key in self.intervals:
+                continue
 
-        # make range syntax
-        range_str = prefix + '[' + number_str
+            intervals = _subtract_intervals(self._merged(key),
+                                            names._merged(key))
+            if intervals:
+                self.intervals[key] = intervals
+            else:
+                del self.intervals[key]
 
-        if len(arr) == 2:
-            (node, prefix, number_str, num, postfix) = arr[1]
-            range_str += ',' + number_str
-        else:
-            start = num
-            prev_number_str = None
-            prev_len = len(number_str)
-            in_seq = 0
-            for (node, prefix, number_str, num, postfix) in arr[1:]:
-                if num == start + 1 and 0 <= len(number_str) - prev_len <= 1:
-                    # it's in sequence
-                    in_seq += 1
-                else:
-                    # not in sequence
-                    if in_seq == 0:
-                        pass
-                    elif in_seq == 1:
-                        range_str += ',' + prev_number_str
+    def intersection(self, names):
+        '''Returns set of names that are also in this set'''
+
+        return set([x for x in names if x in self])
+
+    def _add_name(self, name):
+        '''add a single node name'''
+
+        m = NAME_NUMBER.match(name)
+        if not m:
+            self.names.add(name)
+            return
+
+        prefix, number_str, postfix = m.groups()
+        num = int(number_str)
+        self._add_interval((prefix, postfix, len(number_str)), num, num)
+
+    def _add_range(self, expr):
+        '''add range expression like 'node[1-10,20]-mgmt'
+        May throw RangeSyntaxError if there is a syntax error
+        '''
+
+        m = NODE_EXPR.match(expr)
+        if not m:
+            raise RangeSyntaxError('syntax error in range expression')
+
+        (prefix, range_expr, postfix) = m.groups()
+        elements = _range_elements(range_expr)
+
+        if NAME_NUMBER.match(postfix):
+            # the range is not the last number in the names
+            for name in expand(expr):
+                self._add_name(name)
+            return
+
+        # digits at the end of the prefix are part of the number
+        head = prefix.rstrip('0123456789')
+        lead = prefix[len(head):]
+
+        for start, end, step, width in elements:
+            if step > 1:
+                for num in xrange(start, end + 1, step):
+                    self._add_name('%s%.*d%s' % (prefix, width, num, postfix))
+                continue
+
+            # numbers are formatted with at least width digits;
+            # split the interval where the number gets longer
+            digits = width
+            while start <= end:
+                limit = 10 ** digits - 1
+                if start <= limit:
+                    upto = min(end, limit)
+                    if lead:
+                        offset = int(lead) * 10 ** digits
                     else:
-                        range_str += '-' + prev_number_str
+                        offset = 0
+                    self._add_interval((head, postfix, len(lead) + digits),
+                                       offset + start, offset + upto)
+                    start = upto + 1
+
+                digits += 1
+
+    def _add_interval(self, key, start, end):
+        '''add interval of numbers'''
+
+        if key in self.intervals:
+            self.intervals[key].append((start, end))
+        else:
+            self.intervals[key] = [(start, end)]
+
+        self.unsorted.add(key)
 
-                    range_str += ',' + number_str
-                    in_seq = 0
+    def _merged(self, key):
+        '''Returns sorted list of intervals for key, without overlaps'''
 
-                start = num
-                prev_number_str = number_str
-                prev_len = len(number_str)
+        intervals = self.intervals[key]
+        if not key in self.unsorted:
+            return intervals
 
-            if in_seq == 0:
-                pass
-            elif in_seq == 1:
-                range_str += ',' + prev_number_str
+        intervals.sort()
+        merged = [intervals[0]]
+        for start, end in intervals:
+            prev_start, prev_end = merged[-1]
+            if start <= prev_end + 1:
+                if end > prev_end:
+                    merged[-1] = (prev_start, end)
             else:
-                range_str += '-' + prev_number_str
+                merged.append((start, end))
 
-        range_str += ']' + postfix
-        out.append(range_str)
+        self.intervals[key] = merged
+        self.unsorted.remove(key)
+        return merged
 
-    # return comma-separated string of node ranges
-    return ','.join(out)
+    def __contains__(self, name):
+        '''Returns True if name is in the set'''
+
+        m = NAME_NUMBER.match(name)
+        if not m:
+            return name in self.names
+
+        prefix, number_str, postfix = m.groups()
+        key = (prefix, postfix, len(number_str))
+        if not key in self.intervals:
+            return False
+
+        num = int(number_str)
+        intervals = self._merged(key)
+        idx = bisect.bisect_right(intervals, (num, float('inf')))
+        return idx > 0 and intervals[idx - 1][1] >= num
+
+    def __iter__(self):
+        '''iterate over all names in the set'''
+
+        for name in self.names:
+            yield name
+
+        for key in sorted(self.intervals.keys()):
+            prefix, postfix, width = key
+            for start, end in self._merged(key):
+                if end < sys.maxint:
+                    numbers = xrange(start, end + 1)
+                else:
+                    numbers = range(start, end + 1)
+
+                for num in numbers:
+                    yield '%s%0*d%s' % (prefix, width, num, postfix)
+
+    def __len__(self):
+        '''Returns number of names in the set'''
+
+        count = len(self.names)
+        for key in self.intervals:
+            for start, end in self._merged(key):
+                count += end - start + 1
+
+        return count
+
+    def __nonzero__(self):
+        '''Returns True if the set is not empty'''
+
+        return len(self.names) > 0 or len(self.intervals) > 0
+
+
+def _subtract_intervals(intervals, remove):
+    '''subtract sorted list of intervals from another one
+    Returns new list of intervals
+    '''
+
+    out = []
+    idx = 0
+    len_remove = len(remove)
+    for start, end in intervals:
+        # skip what lies before this interval
+        while idx < len_remove and remove[idx][1] < start:
+            idx += 1
+
+        # cut out what overlaps; a removed interval may overlap
+        # the next interval too, so do not advance idx here
+        n = idx
+        while n < len_remove and remove[n][0] <= end:
+            r_start, r_end = remove[n]
+            if r_start > start:
+                out.append((start, r_start - 1))
+            start = max(start, r_end + 1)
+            if start > end:
+                break
+            n += 1
+
+        if start <= end:
+            out.append((start, end))
+
+    return out
 
 # EOB
@@ -0,0 +1,320 @@
+#
+#   synctool.reactor.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''run commands on many nodes at once from a single process
+
+The work for a node is written as a job: a generator that yields
+Command objects, and that is sent the exit code of each command.
+For example:
+
+    def job(addr):
+        exitcode = yield Command(['rsync', ...], nodename)
+        if exitcode == 0:
+            yield Command(['ssh', addr, ...], nodename)
+
+With the event loop, the output of all running commands is read
+from a single process, rather than from a forked process per node.
+Without it, jobs are simply run by the workers of synctool.parallel
+'''
+
+import os
+import errno
+import select
+import subprocess
+import time
+
+import synctool.lib
+from synctool.lib import verbose, stderr, error, unix_out
+import synctool.parallel
+import synctool.param
+
+# seconds between checks on commands that have no output pipe
+POLL_INTERVAL = 0.1
+
+# size for reading output
+READ_SIZE = 65536
+
+
+class Command(object):
+    '''command to run for a node
+    The output of a quiet command is discarded
+    stdin is an optional filename to use as standard input
+    '''
+
+    def __init__(self, cmd_arr, nodename, quiet=False, stdin=None):
+        '''initialize instance'''
+
+        self.cmd_arr = cmd_arr
+        self.nodename = nodename
+        self.quiet = quiet
+        self.stdin = stdin
+
+
+def do(job_func, work):
+    '''run job_func(item) for all items in work
+    job_func must return a job generator
+    Returns list of wall times (in seconds) per work item
+    '''
+
+    if (synctool.param.EVENT_DRIVEN and synctool.param.NUM_PROC > 1 and
+            synctool.param.SLEEP_TIME == 0):
+        return Reactor(job_func, work).run()
+
+    return synctool.parallel.do(lambda item: run_job(job_func(item)), work)
+
+
+def run_job(job):
+    '''run all commands of a job, one after another'''
+
+    exitcode = None
+    while True:
+        try:
+            cmd = job.send(exitcode)
+        except StopIteration:
+            break
+
+        if cmd.quiet:
+            exitcode = _call_quiet(cmd.cmd_arr)
+        else:
+            exitcode = synctool.lib.run_with_nodename(cmd.cmd_arr,
+                                                      cmd.nodename,
+                                                      cmd.stdin)
+
+
+def _call_quiet(cmd_arr):
+    '''run command, discarding output
+    Returns exit code, or -1 on error
+    '''
+
+    unix_out(' '.join(cmd_arr))
+
+    with open(os.devnull, 'r+') as devnull:
+        try:
+            return subprocess.call(cmd_arr, shell=False, stdin=devnull,
+                                   stdout=devnull, stderr=devnull)
+        except OSError as err:
+            error('failed to run command %s: %s' % (cmd_arr[0],
+                                                    err.strerror))
+            return -1
+
+
+class _Job(object):
+    '''state of a running job'''
+
+    def __init__(self, idx, item, gen):
+        '''initialize instance'''
+
+        self.idx = idx
+        self.item = item
+        self.gen = gen
+        self.t_start = time.time()
+        self.nodename = None
+        self.proc = None
+        self.buf = ''
+
+
+class _Poller(object):
+    '''wait for input on a set of file descriptors
+    Uses epoll where available, or else select
+    '''
+
+    def __init__(self):
+        '''initialize instance'''
+
+        if hasattr(select, 'epoll'):
+            self.epoll = select.epoll()
+        else:
+            self.epoll = None
+
+        self.fds = set()
+
+    def register(self, fd):
+        '''watch fd for input'''
+
+        if self.epoll is not None:
+            self.epoll.register(fd, select.EPOLLIN)
+
+        self.fds.add(fd)
+
+    def unregister(self, fd):
+        '''stop watching fd'''
+
+        if self.epoll is not None:
+            self.epoll.unregister(fd)
+
+        self.fds.remove(fd)
+
+    def poll(self, timeout):
+        '''Returns list of file descriptors that have input (or EOF)
+        timeout is in seconds; None means wait indefinitely
+        '''
+
+        try:
+            if self.epoll is not None:
+                if timeout is None:
+                    timeout = -1
+                return [fd for fd, _ in self.epoll.poll(timeout)]
+
+            rlist, _, _ = select.select(list(self.fds), [], [], timeout)
+            return rlist
+
+        except (select.error, IOError) as err:
+            if err.args[0] == errno.EINTR:
+                return []
+            raise
+
+    def close(self):
+        '''release resources'''
+
+        if self.epoll is not None:
+            self.epoll.close()
+
+
+class Reactor(object):
+    '''runs jobs for many nodes at once, in a single process
+    At most NUM_PROC jobs run at the same time
+    '''
+
+    def __init__(self, job_func, work):
+        '''initialize instance'''
+
+        self.job_func = job_func
+        self.work = work
+        self.timings = [None] * len(work)
+        self.next_idx = 0
+        self.num_running = 0
+
+        self.poller = _Poller()
+        # jobs running a command with output, by file descriptor
+        self.jobs_by_fd = {}
+        # jobs running a quiet command
+        self.quiet_jobs = []
+
+    def run(self):
+        '''run all jobs
+        Returns list of wall times (in seconds) per work item
+        '''
+
+        len_work = len(self.work)
+
+        while self.next_idx < len_work or self.num_running > 0:
+            while (self.next_idx < len_work and
+                   self.num_running < synctool.param.NUM_PROC):
+                item = self.work[self.next_idx]
+                job = _Job(self.next_idx, item, self.job_func(item))
+                self.next_idx += 1
+                self.num_running += 1
+                self._advance(job, None)
+
+            if self.quiet_jobs:
+                timeout = POLL_INTERVAL
+            elif self.jobs_by_fd:
+                timeout = None
+            else:
+                # every job that was started, has already finished
+                continue
+
+            for fd in self.poller.poll(timeout):
+                self._read(self.jobs_by_fd[fd])
+
+            for job in self.quiet_jobs[:]:
+                if job.proc.poll() is not None:
+                    self.quiet_jobs.remove(job)
+                    self._advance(job, job.proc.returncode)
+
+        self.poller.close()
+        return self.timings
+
+    def _advance(self, job, exitcode):
+        '''start the next command of the job, or finish it'''
+
+        while True:
+            try:
+                cmd = job.gen.send(exitcode)
+            except StopIteration:
+                elapsed = time.time() - job.t_start
+                self.timings[job.idx] = elapsed
+                self.num_running -= 1
+                verbose('%s took %.3f seconds' % (job.item, elapsed))
+                return
+
+            job.nodename = cmd.nodename
+
+            unix_out(' '.join(cmd.cmd_arr))
+
+            try:
+                if cmd.quiet:
+                    # ssh may leave a master process in the background,
+                    # so there is no pipe to wait on
+                    with open(os.devnull, 'r+') as devnull:
+                        job.proc = subprocess.Popen(cmd.cmd_arr, shell=False,
+                                                    stdin=devnull,
+                                                    stdout=devnull,
+                                                    stderr=devnull)
+                elif cmd.stdin is not None:
+                    with open(cmd.stdin) as f:
+                        job.proc = subprocess.Popen(cmd.cmd_arr, shell=False,
+                                                    stdin=f,
+                                                    stdout=subprocess.PIPE,
+                                                    stderr=subprocess.STDOUT)
+                else:
+                    job.proc = subprocess.Popen(cmd.cmd_arr, shell=False,
+                                                stdout=subprocess.PIPE,
+                                                stderr=subprocess.STDOUT)
+            except (IOError, OSError) as err:
+                stderr('failed to run command %s: %s' % (cmd.cmd_arr[0],
+                                                         err.strerror))
+                exitcode = -1
+                continue
+
+            if cmd.quiet:
+                self.quiet_jobs.append(job)
+            else:
+                fd = job.proc.stdout.fileno()
+                self.jobs_by_fd[fd] = job
+                self.poller.register(fd)
+            return
+
+    def _read(self, job):
+        '''read output of job, and show all complete lines'''
+
+        fd = job.proc.stdout.fileno()
+        try:
+            data = os.read(fd, READ_SIZE)
+        except OSError as err:
+            if err.errno == errno.EINTR:
+                return
+            data = ''
+
+        if data:
+            lines = (job.buf + data).split('\n')
+            # the last one is an incomplete line (or empty)
+            job.buf = lines.pop()
+            for line in lines:
+                synctool.lib.output_with_nodename(line.rstrip(),
+                                                  job.nodename)
+            return
+
+        # end of file
+        if job.buf:
+            synctool.lib.output_with_nodename(job.buf.rstrip(), job.nodename)
+            job.buf = ''
+
+        self.poller.unregister(fd)
+        del self.jobs_by_fd[fd]
+        job.proc.stdout.close()
+
+        exitcode = job.proc.wait()
+        if exitcode != 0:
+            verbose('exit code %d' % exitcode)
+
+        self._advance(job, exitcode)
+
+# EOB
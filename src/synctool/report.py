@@ -0,0 +1,164 @@
+#
+#   synctool.report.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''timing report of a synctool run
+
+For every node, the master records how long the rsync of the repository
+and the run of synctool-client took, their exit codes, and the number of
+bytes that rsync transferred. Workers may run in forked processes,
+so every node's record is written to a file in a temp directory.
+At the end, the records are gathered into a single JSON report in TEMP_DIR
+'''
+
+import os
+import re
+import json
+import shutil
+import tempfile
+
+from synctool.lib import stdout, error
+import synctool.param
+
+# records of the nodes are kept here during a run
+REPORT_DIR = None
+
+# number of nodes shown in the summary
+SLOWEST = 5
+
+# rsync writes this line to its log file when it's done
+RSYNC_SUMMARY = re.compile(r'sent ([\d,.]+) bytes\s+'
+                           r'received ([\d,.]+) bytes')
+
+
+def start():
+    '''make directory for holding the records
+    Returns True on success
+    '''
+
+    global REPORT_DIR
+
+    try:
+        REPORT_DIR = tempfile.mkdtemp(prefix='report-',
+                                      dir=synctool.param.TEMP_DIR)
+    except OSError as err:
+        error('failed to create temp dir: %s' % err.strerror)
+        return False
+
+    return True
+
+
+def rsync_logfile(nodename):
+    '''Returns filename of the rsync log for node'''
+
+    return os.path.join(REPORT_DIR, nodename + '.rsync')
+
+
+def record(nodename, rec):
+    '''save dict with timings of node'''
+
+    rec['node'] = nodename
+    filename = os.path.join(REPORT_DIR, nodename + '.json')
+    try:
+        with open(filename, 'w') as f:
+            json.dump(rec, f)
+    except IOError as err:
+        error('failed to write %s: %s' % (filename, err.strerror))
+
+
+def _rsync_bytes(nodename):
+    '''Returns tuple: (bytes sent, bytes received) by rsync
+    or (None, None) if unknown
+    '''
+
+    sent = received = None
+    try:
+        with open(rsync_logfile(nodename)) as f:
+            for line in f:
+                m = RSYNC_SUMMARY.search(line)
+                if m:
+                    # strip thousands separators
+                    sent = int(re.sub(r'\D', '', m.group(1)))
+                    received = int(re.sub(r'\D', '', m.group(2)))
+    except IOError:
+        pass
+
+    return sent, received
+
+
+def finish():
+    '''gather the records of all nodes and write the report
+    Prints the slowest nodes
+    '''
+
+    global REPORT_DIR
+
+    if REPORT_DIR is None:
+        return
+
+    records = []
+    for entry in sorted(os.listdir(REPORT_DIR)):
+        if not entry.endswith('.json'):
+            continue
+
+        try:
+            with open(os.path.join(REPORT_DIR, entry)) as f:
+                rec = json.load(f)
+        except (IOError, ValueError):
+            continue
+
+        if rec.get('rsync_time') is not None:
+            rec['bytes_sent'], rec['bytes_received'] = _rsync_bytes(
+                                                           rec['node'])
+        records.append(rec)
+
+    shutil.rmtree(REPORT_DIR, ignore_errors=True)
+    REPORT_DIR = None
+
+    if not records:
+        return
+
+    filename = os.path.join(synctool.param.TEMP_DIR, 'report.json')
+    try:
+        with open(filename, 'w') as f:
+            json.dump(records, f, indent=1, sort_keys=True)
+            f.write('\n')
+    except IOError as err:
+        error('failed to write %s: %s' % (filename, err.strerror))
+        return
+
+    records.sort(key=lambda rec: rec['total_time'], reverse=True)
+
+    # no colons in the output, or else synctool -a takes it
+    # for output of a node
+    stdout('slowest nodes')
+    for rec in records[:SLOWEST]:
+        msg = '  %s took %.3f seconds' % (rec['node'], rec['total_time'])
+
+        parts = []
+        if rec.get('session_time') is not None:
+            parts.append('ssh %.3f' % rec['session_time'])
+
+        if rec.get('rsync_time') is not None:
+            parts.append('rsync %.3f' % rec['rsync_time'])
+            if rec.get('bytes_sent') is not None:
+                parts.append('%d bytes' % (rec['bytes_sent'] +
+                                           rec['bytes_received']))
+
+        if rec.get('client_time') is not None:
+            parts.append('synctool %.3f' % rec['client_time'])
+
+        if parts:
+            msg += ' (%s)' % ', '.join(parts)
+
+        stdout(msg)
+
+    stdout('report written to %s' % filename)
+
+# EOB
@@ -15,6 +15,7 @@ import stat
 import errno
 
 from synctool.lib import error
+import synctool.profiler
 import synctool.pwdgrp
 
 
@@ -28,12 +29,14 @@ class SyncStat(object):
     # Python object
     # Also note how I left device files (major, minor) out, they are so rare
     # that they get special treatment in object.py
+    # The mtime, ctime, and inode number are kept for the manifest
 
     def __init__(self, path = None):
         '''initialize instance'''
 
         self.entry_exists = False
         self.mode = self.uid = self.gid = self.size = None
+        self.mtime = self.ctime = self.ino = None
         self.stat(path)
 
     def __repr__(self):
@@ -51,8 +54,12 @@ class SyncStat(object):
         if not path:
             self.entry_exists = False
             self.mode = self.uid = self.gid = self.size = None
+            self.mtime = self.ctime = self.ino = None
             return
 
+        if synctool.profiler.ENABLED:
+            synctool.profiler.STAT_CALLS += 1
+
         try:
             statbuf = os.lstat(path)
         except OSError as err:
@@ -66,6 +73,7 @@ class SyncStat(object):
 
             self.entry_exists = False
             self.mode = self.uid = self.gid = self.size = None
+            self.mtime = self.ctime = self.ino = None
 
         else:
             self.entry_exists = True
@@ -74,6 +82,9 @@ class SyncStat(object):
             self.uid = statbuf.st_uid
             self.gid = statbuf.st_gid
             self.size = statbuf.st_size
+            self.mtime = statbuf.st_mtime
+            self.ctime = statbuf.st_ctime
+            self.ino = statbuf.st_ino
 
     def is_dir(self):
         '''Returns True if it's a directory'''
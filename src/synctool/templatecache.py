@@ -0,0 +1,166 @@
+#
+#   synctool.templatecache.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''the template cache keeps the output of template generators.
+The output is stored under a checksum of everything that goes into it:
+the template, the generator script, and the SYNCTOOL_* environment
+variables plus those listed with template_cache_env. The generator is
+run again only when any of these change. Outputs that are no longer
+used are removed after a full run.
+
+The cache is kept in $SYNCTOOL/var/cache/template/
+The outputs are hard links to the generated files in the repository
+'''
+
+import os
+import errno
+import hashlib
+
+import synctool.lib
+from synctool.lib import verbose, error
+import synctool.param
+
+# environment variables that are always part of the key
+# Other variables, like those set by the login session, may differ
+# from run to run; they are only used when listed in TEMPLATE_CACHE_ENV
+ENV_PREFIX = 'SYNCTOOL_'
+
+# set of keys that were used during this run
+USED = set()
+
+
+def cache_dir():
+    '''Returns path of the directory holding the cached outputs'''
+
+    return os.path.join(synctool.param.CACHE_DIR, 'template')
+
+
+def _hash_file(digest, filename):
+    '''update digest with the contents of filename
+    May raise IOError
+    '''
+
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(synctool.lib.COMPARE_IO_SIZE)
+            if not data:
+                break
+
+            digest.update(data)
+
+
+def key(template, generator, output):
+    '''Returns checksum of the inputs of the template generator
+    or None if they can not be read
+    '''
+
+    digest = hashlib.md5()
+    digest.update('%s\0%s\0%s\0%s\0' % (synctool.param.VERSION, template,
+                                        generator, output))
+
+    for name in sorted(os.environ):
+        if (name.startswith(ENV_PREFIX) or
+                name in synctool.param.TEMPLATE_CACHE_ENV):
+            digest.update('%s=%s\0' % (name, os.environ[name]))
+
+    try:
+        _hash_file(digest, template)
+        _hash_file(digest, generator)
+    except IOError as err:
+        verbose('not caching template %s: %s: %s' % (template, err.filename,
+                                                     err.strerror))
+        return None
+
+    return digest.hexdigest()
+
+
+def fetch(cache_key, output):
+    '''put the cached output for cache_key in place
+    Returns True on success, False if it is not in the cache
+    '''
+
+    USED.add(cache_key)
+
+    cached = os.path.join(cache_dir(), cache_key)
+    try:
+        cached_stat = os.stat(cached)
+    except OSError:
+        return False
+
+    try:
+        output_stat = os.lstat(output)
+    except OSError:
+        pass
+    else:
+        if (output_stat.st_ino == cached_stat.st_ino and
+                output_stat.st_dev == cached_stat.st_dev):
+            # already in place
+            return True
+
+        try:
+            os.unlink(output)
+        except OSError as err:
+            error('failed to remove %s: %s' % (output, err.strerror))
+            return False
+
+    try:
+        os.link(cached, output)
+    except OSError as err:
+        verbose('failed to link %s: %s' % (cached, err.strerror))
+        return False
+
+    return True
+
+
+def store(cache_key, output):
+    '''enter the generated output into the cache'''
+
+    USED.add(cache_key)
+
+    directory = cache_dir()
+    if not synctool.lib.mkdir_p(directory):
+        # error message already printed
+        return
+
+    cached = os.path.join(directory, cache_key)
+    tmp_cached = '%s.%d' % (cached, os.getpid())
+    try:
+        os.link(output, tmp_cached)
+        os.rename(tmp_cached, cached)
+    except OSError as err:
+        verbose('failed to cache template output %s: %s' % (output,
+                                                            err.strerror))
+        try:
+            os.unlink(tmp_cached)
+        except OSError:
+            pass
+
+
+def prune():
+    '''remove cached outputs that were not used in this run'''
+
+    directory = cache_dir()
+    try:
+        entries = os.listdir(directory)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            error('failed to read directory %s: %s' % (directory,
+                                                       err.strerror))
+        return
+
+    for name in entries:
+        if not name in USED:
+            verbose('removing stale template output %s' % name)
+            try:
+                os.unlink(os.path.join(directory, name))
+            except OSError:
+                pass
+
+# EOB
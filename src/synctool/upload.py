@@ -25,6 +25,7 @@ from synctool.lib import terse, unix_out, prettypath
 import synctool.multiplex
 import synctool.overlay
 import synctool.param
+import synctool.pathindex
 import synctool.pwdgrp
 
 # UploadFile object, used in callback function for overlay.visit()
@@ -369,7 +370,9 @@ def upload(up):
     # see if file is already in the repository
     # Note: ugly global is needed because of callback function
     GLOBAL_UPLOAD_FILE = up
-    synctool.overlay.visit(synctool.param.OVERLAY_DIR, _upload_callback)
+    index = synctool.pathindex.PathIndex([up.filename])
+    synctool.overlay.visit(synctool.param.OVERLAY_DIR, _upload_callback,
+                           want_dir=index.want_dir)
     up = GLOBAL_UPLOAD_FILE
 
     synctool.param.NODENAME = orig_nodename
@@ -0,0 +1,102 @@
+#
+#   test_range.py    WJ115
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''round-trip tests for synctool.range.compress() and expand()
+Run with: python -m unittest discover -s tests
+'''
+
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import synctool.range
+
+PREFIXES = ['n', 'node', 'r1n', 'gpu-', 'a_b', 'x+']
+POSTFIXES = ['', '-mgmt', 'ib', '_x']
+# names that compress() can not put in a range
+OTHER_NAMES = ['master', 'localhost', '1node', '01', 'n1x2']
+
+
+def _expand_list(expr):
+    '''Returns list of node names in comma-separated range expression'''
+
+    arr = []
+    for elem in synctool.range.split_nodelist(expr):
+        if '[' in elem:
+            arr.extend(synctool.range.expand(elem))
+        else:
+            arr.append(elem)
+
+    return arr
+
+
+def _random_nodelist(rng):
+    '''Returns random list of node names'''
+
+    nodes = []
+    for _ in xrange(rng.randint(1, 60)):
+        if rng.random() < 0.05:
+            nodes.append(rng.choice(OTHER_NAMES))
+            continue
+
+        num = rng.randint(0, 120)
+        width = rng.choice([0, 0, 0, 2, 3, 4])
+        nodes.append('%s%.*d%s' % (rng.choice(PREFIXES), width, num,
+                                   rng.choice(POSTFIXES)))
+
+    return nodes
+
+
+class TestCompress(unittest.TestCase):
+    '''tests for synctool.range.compress()'''
+
+    def test_examples(self):
+        '''compress() produces the expected ranges'''
+
+        compress = synctool.range.compress
+        self.assertEqual(compress(['n1', 'n2', 'n3', 'n5']), 'n[1-3,5]')
+        self.assertEqual(compress(['n3', 'n1', 'n2']), 'n[1-3]')
+        self.assertEqual(compress(['n1-mgmt', 'n2-mgmt']), 'n[1,2]-mgmt')
+        self.assertEqual(compress(['n08', 'n09', 'n10']), 'n[08-10]')
+        self.assertEqual(compress(['node']), 'node')
+        self.assertEqual(compress([]), '')
+
+    def test_round_trip(self):
+        '''expand(compress(x)) gives back the nodes of x'''
+
+        rng = random.Random(5000)
+        for _ in xrange(5000):
+            nodes = _random_nodelist(rng)
+            expr = synctool.range.compress(nodes)
+            expanded = _expand_list(expr)
+            self.assertEqual(sorted(expanded), sorted(set(nodes)),
+                             'round trip failed for %r -> %r' %
+                             (nodes, expr))
+
+    def test_canonical(self):
+        '''compress() does not depend on the order of its input'''
+
+        rng = random.Random(42)
+        for _ in xrange(500):
+            nodes = _random_nodelist(rng)
+            shuffled = nodes[:]
+            rng.shuffle(shuffled)
+            self.assertEqual(synctool.range.compress(nodes),
+                             synctool.range.compress(shuffled))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# EOB